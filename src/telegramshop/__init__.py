@@ -1,8 +1,20 @@
 """
 TelegramShop - Telegram бот-магазин для продажи цифровых товаров
 """
-from .main import run
+
+import sys
 
 __version__ = "0.1.0"
 __all__ = ["run"]
 
+
+def run():
+    """Запуск бота (main импортируется только при вызове)"""
+    profiler = None
+    if "--profile-startup" in sys.argv[1:]:
+        # Замер импортов начинается до импорта main и его зависимостей
+        from .startup import StartupProfiler
+        profiler = StartupProfiler()
+        profiler.track_imports()
+    from .main import run as _run
+    _run(profiler)
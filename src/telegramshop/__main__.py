@@ -1,7 +1,7 @@
 """
 Точка входа для запуска бота как модуля
 """
-from .main import run
+from . import run
 
 if __name__ == "__main__":
     run()
@@ -0,0 +1,88 @@
+"""
+Аналитика: просмотры карточек товаров и активность пользователей
+
+Продажи учитываются в сводке sales_rollup транзакцией покупки, а
+просмотры и активность копятся в памяти и записываются пачкой раз
+в интервал, чтобы открытие карточки или нажатие кнопки не было записью
+в базу.
+"""
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from .database import Database
+
+
+logger = logging.getLogger(__name__)
+
+# Периоды отчета: подпись кнопки и окно отчета
+GRANULARITIES = {
+    "hour": ("По часам", "24 часа"),
+    "day": ("По дням", "30 дней"),
+    "week": ("По неделям", "12 недель"),
+}
+
+
+class ViewCounter:
+    """Счетчик просмотров карточек товаров с периодической записью в базу"""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._views: Counter = Counter()
+
+    def hit(self, product_id: int):
+        """Просмотр карточки товара"""
+        self._views[product_id] += 1
+
+    async def flush(self) -> int:
+        """Запись накопленных просмотров. Возвращает число товаров"""
+        views, self._views = self._views, Counter()
+        if not views:
+            return 0
+        try:
+            await self.db.add_product_views(dict(views))
+        except Exception:
+            # Не теряем просмотры: вернутся в следующую запись
+            self._views.update(views)
+            raise
+        logger.debug("Записаны просмотры товаров: %s", len(views))
+        return len(views)
+
+
+class ActivityTracker(BaseMiddleware):
+    """
+    Outer middleware на update: отмечает пользователей, писавших боту
+
+    Отметки (users.last_active_at) нужны сегменту рассылок «активные за N
+    дней» и снимают признак блокировки бота.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._seen: Set[int] = set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None:
+            self._seen.add(user.id)
+        return await handler(event, data)
+
+    async def flush(self) -> int:
+        """Запись накопленных отметок. Возвращает число пользователей"""
+        seen, self._seen = self._seen, set()
+        if not seen:
+            return 0
+        try:
+            await self.db.touch_users(seen)
+        except Exception:
+            self._seen.update(seen)
+            raise
+        return len(seen)
@@ -0,0 +1,136 @@
+"""
+Перенос проданных товарных позиций и старых заказов в архивную базу
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+from pathlib import Path
+
+from .database import Database
+
+
+logger = logging.getLogger(__name__)
+
+
+class Archiver:
+    """
+    Архивирование истории продаж
+
+    Проданные позиции и заказы старше older_than_days дней переносятся
+    в отдельный файл базы пачками по batch_size: каждая пачка — короткая
+    транзакция, между пачками покупки успевают взять блокировку записи.
+    Освободившиеся страницы возвращаются файловой системе инкрементальным
+    VACUUM по vacuum_pages страниц за шаг. История покупок и заказов
+    читается с архивом, подключенным только для чтения (см. Database).
+    """
+
+    def __init__(self, db: Database, archive_path: str, older_than_days: int = 90,
+                 batch_size: int = 1000, vacuum_pages: int = 1000, pause: float = 0.05):
+        self.db = db
+        self.archive_path = archive_path
+        self.older_than_days = older_than_days
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.pause = pause
+        self.stats = {'runs': 0, 'items': 0, 'orders': 0, 'vacuumed_pages': 0}
+        self._vacuum_warned = False
+
+    async def _drain(self, archive_batch) -> int:
+        moved = 0
+        while True:
+            count = await archive_batch(self.archive_path, self.older_than_days, self.batch_size)
+            moved += count
+            if count < self.batch_size:
+                return moved
+            await asyncio.sleep(self.pause)
+
+    async def vacuum(self) -> int:
+        """Инкрементальный VACUUM основной базы. Возвращает количество освобожденных страниц"""
+        info = await self.db.get_storage_info()
+        if info['auto_vacuum'] != 2:
+            if not self._vacuum_warned:
+                logger.warning(
+                    "auto_vacuum базы не INCREMENTAL: место освобождается только после "
+                    "telegramshop archive --vacuum (файл не уменьшается, страницы переиспользуются)"
+                )
+                self._vacuum_warned = True
+            return 0
+
+        freed = 0
+        while True:
+            count = await self.db.incremental_vacuum(self.vacuum_pages)
+            freed += count
+            if count < self.vacuum_pages:
+                return freed
+            await asyncio.sleep(self.pause)
+
+    async def archive(self) -> dict:
+        """Один проход: перенос позиций и заказов, затем освобождение места"""
+        started = time.perf_counter()
+        await self.db.init_archive(self.archive_path)
+        items = await self._drain(self.db.archive_sold_items)
+        orders = await self._drain(self.db.archive_orders)
+        freed = await self.vacuum() if items or orders else 0
+
+        self.stats['runs'] += 1
+        self.stats['items'] += items
+        self.stats['orders'] += orders
+        self.stats['vacuumed_pages'] += freed
+        if items or orders:
+            logger.info(
+                "В архив перенесено позиций: %s, заказов: %s, освобождено страниц: %s за %.1f с",
+                items, orders, freed, time.perf_counter() - started
+            )
+        return {'items': items, 'orders': orders, 'vacuumed_pages': freed}
+
+
+def convert_to_incremental_vacuum(db_path: str):
+    """
+    Перевод существующей базы в режим auto_vacuum = INCREMENTAL
+
+    Требует полного VACUUM (перезапись файла под эксклюзивной блокировкой),
+    поэтому выполняется при остановленном боте.
+    """
+    db = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("VACUUM")
+    finally:
+        db.close()
+
+
+def command(args) -> int:
+    """Подкоманда archive"""
+    if not Path(args.db).exists():
+        print(f"{args.db} не найден")
+        return 2
+
+    if args.vacuum:
+        started = time.perf_counter()
+        convert_to_incremental_vacuum(args.db)
+        print(f"База переведена в auto_vacuum = INCREMENTAL за {time.perf_counter() - started:.1f} с")
+
+    archiver = Archiver(
+        Database(args.db, archive_path=args.archive), args.archive,
+        older_than_days=args.days, batch_size=args.batch_size, pause=0
+    )
+    started = time.perf_counter()
+    result = asyncio.run(archiver.archive())
+    print(
+        f"Перенесено позиций: {result['items']}, заказов: {result['orders']}, "
+        f"освобождено страниц: {result['vacuumed_pages']} за {time.perf_counter() - started:.1f} с"
+    )
+    return 0
+
+
+def register(subparsers):
+    """Регистрация подкоманды archive"""
+    parser = subparsers.add_parser("archive", help="Перенести старые продажи и заказы в архив")
+    parser.add_argument("--db", default="data/shop.db", help="Основная база")
+    parser.add_argument("--archive", default="data/archive.db", help="Файл архива")
+    parser.add_argument("--days", type=int, default=90, help="Возраст продажи или заказа, дней")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--vacuum", action="store_true",
+                        help="Сначала перевести базу в auto_vacuum = INCREMENTAL (полный VACUUM, бот остановлен)")
+    parser.set_defaults(func=command)
@@ -0,0 +1,201 @@
+"""
+Онлайн-резервное копирование базы через SQLite backup API
+"""
+import asyncio
+import gzip
+import logging
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BackupError(Exception):
+    """Копия не создана или не прошла проверку"""
+
+
+class _Restarted(Exception):
+    """Копирование начинается заново слишком часто (база активно меняется)"""
+
+
+class BackupService:
+    """
+    Резервные копии работающей базы
+
+    Копия снимается backup API пачками по pages страниц с паузой между
+    ними, поэтому запись в базу блокируется только на время одной пачки.
+    Запись в базу другим соединением начинает копирование заново; если
+    это случается больше max_restarts раз, пачка увеличивается в 8 раз,
+    а в последней попытке база копируется за один шаг, так что копия
+    получается и под постоянной нагрузкой.
+
+    Готовая копия проверяется PRAGMA integrity_check, сжимается gzip и
+    кладется в backup_dir; хранятся последние keep снимков. Копирование,
+    проверка и сжатие выполняются в отдельном потоке.
+
+    Args:
+        db_path: Путь к базе
+        backup_dir: Каталог снимков
+        keep: Сколько последних снимков хранить
+        pages: Страниц за шаг копирования
+        step_pause: Пауза между шагами (сек)
+    """
+
+    def __init__(self, db_path: str, backup_dir: str, keep: int = 7, pages: int = 256, step_pause: float = 0.01,
+                 max_restarts: int = 3):
+        self.db_path = db_path
+        self.backup_dir = Path(backup_dir)
+        self.keep = keep
+        self.pages = pages
+        self.step_pause = step_pause
+        self.max_restarts = max_restarts
+        self.last: Optional[dict] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def prefix(self) -> str:
+        return Path(self.db_path).stem + "-"
+
+    def snapshots(self) -> List[Path]:
+        """Снимки от новых к старым"""
+        return sorted(self.backup_dir.glob(f"{self.prefix}*.db.gz"), reverse=True)
+
+    def _copy(self, target_path: Path) -> int:
+        """Постраничное копирование базы в target_path. Возвращает число попыток"""
+        pages = self.pages
+        attempt = 0
+        while True:
+            attempt += 1
+            last = attempt == 4 or pages <= 0
+            remaining_before = None
+            restarts = 0
+
+            def progress(status, remaining, total):
+                nonlocal remaining_before, restarts
+                if remaining_before is not None and remaining > remaining_before:
+                    restarts += 1
+                    if restarts > self.max_restarts and not last:
+                        raise _Restarted()
+                remaining_before = remaining
+
+            source = sqlite3.connect(self.db_path)
+            target = sqlite3.connect(target_path)
+            try:
+                source.backup(target, pages=-1 if last else pages, progress=progress, sleep=self.step_pause)
+                return attempt
+            except _Restarted:
+                logger.info("Резервное копирование: база меняется, пачка %s → %s страниц", pages, pages * 8)
+                pages *= 8
+            finally:
+                target.close()
+                source.close()
+
+    @staticmethod
+    def _verify(path: Path):
+        db = sqlite3.connect(path)
+        try:
+            result = db.execute("PRAGMA integrity_check").fetchall()
+        finally:
+            db.close()
+        if result != [("ok",)]:
+            raise BackupError(f"integrity_check: {'; '.join(row[0] for row in result[:5])}")
+
+    @staticmethod
+    def _compress(source: Path, target: Path):
+        partial = target.with_name(target.name + ".partial")
+        with open(source, "rb") as src, gzip.open(partial, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        partial.rename(target)
+
+    def _rotate(self) -> List[Path]:
+        removed = self.snapshots()[self.keep:]
+        for path in removed:
+            path.unlink(missing_ok=True)
+        return removed
+
+    async def backup(self) -> dict:
+        """
+        Создание снимка
+
+        Returns:
+            Словарь: path, size (сжатый), db_size, duration, copy_duration, removed
+        """
+        async with self._lock:
+            started = time.perf_counter()
+            self.backup_dir.mkdir(parents=True, exist_ok=True)
+            name = f"{self.prefix}{datetime.now():%Y%m%d-%H%M%S}"
+            copy_path = self.backup_dir / f"{name}.db.tmp"
+            snapshot = self.backup_dir / f"{name}.db.gz"
+
+            try:
+                attempts = await asyncio.to_thread(self._copy, copy_path)
+                copied = time.perf_counter()
+                await asyncio.to_thread(self._verify, copy_path)
+                db_size = copy_path.stat().st_size
+                await asyncio.to_thread(self._compress, copy_path, snapshot)
+            except BackupError:
+                logger.error("Резервная копия %s не прошла проверку", name)
+                raise
+            finally:
+                copy_path.unlink(missing_ok=True)
+
+            removed = self._rotate()
+            self.last = {
+                'path': str(snapshot),
+                'size': snapshot.stat().st_size,
+                'db_size': db_size,
+                'duration': time.perf_counter() - started,
+                'copy_duration': copied - started,
+                'removed': len(removed),
+                'attempts': attempts,
+                'created_at': datetime.now(),
+            }
+            logger.info(
+                "Резервная копия %s: %.1f МБ → %.1f МБ за %.1f с (копирование %.1f с)",
+                snapshot.name, db_size / 2 ** 20, self.last['size'] / 2 ** 20,
+                self.last['duration'], self.last['copy_duration']
+            )
+            return self.last
+
+
+def restore(snapshot: str, db_path: str):
+    """Восстановление базы из снимка (бот должен быть остановлен)"""
+    partial = Path(db_path).with_suffix(".restore")
+    with gzip.open(snapshot, "rb") as src, open(partial, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    BackupService._verify(partial)
+    # Журнал WAL от прежней базы применился бы к восстановленной
+    for suffix in ("-wal", "-shm"):
+        Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+    partial.replace(db_path)
+
+
+def command(args) -> int:
+    """Подкоманда backup: снимок или восстановление из снимка"""
+    if args.restore:
+        restore(args.restore, args.db)
+        print(f"{args.db} восстановлена из {args.restore}")
+        return 0
+
+    service = BackupService(args.db, args.dir, keep=args.keep)
+    result = asyncio.run(service.backup())
+    print(
+        f"{result['path']}: {result['db_size'] / 2 ** 20:.1f} МБ → {result['size'] / 2 ** 20:.1f} МБ "
+        f"за {result['duration']:.1f} с"
+    )
+    return 0
+
+
+def register(subparsers):
+    """Регистрация подкоманды backup"""
+    parser = subparsers.add_parser("backup", help="Резервная копия базы или восстановление из нее")
+    parser.add_argument("--db", default="data/shop.db", help="База данных")
+    parser.add_argument("--dir", default="data/backups", help="Каталог снимков")
+    parser.add_argument("--keep", type=int, default=7, help="Сколько последних снимков хранить")
+    parser.add_argument("--restore", metavar="SNAPSHOT",
+                        help="Восстановить базу из снимка .db.gz (бот должен быть остановлен)")
+    parser.set_defaults(func=command)
@@ -0,0 +1,38 @@
+"""
+Бенчмарки производительности бота
+
+Запуск: python -m telegramshop.benchmarks <сценарий> [параметры]
+"""
+import math
+import statistics
+from typing import List
+
+
+def percentile(sorted_samples: List[float], q: float) -> float:
+    """Перцентиль q (0..100) по отсортированной выборке"""
+    if not sorted_samples:
+        return 0.0
+    index = max(0, math.ceil(q / 100 * len(sorted_samples)) - 1)
+    return sorted_samples[index]
+
+
+def summarize(samples: List[float]) -> dict:
+    """
+    Сводка по замерам
+
+    Args:
+        samples: Длительности операций в секундах
+
+    Returns:
+        Словарь: count, ops_per_sec, mean_ms, p50_ms, p95_ms, p99_ms
+    """
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        'count': len(ordered),
+        'ops_per_sec': len(ordered) / total if total else 0.0,
+        'mean_ms': statistics.fmean(ordered) * 1000 if ordered else 0.0,
+        'p50_ms': percentile(ordered, 50) * 1000,
+        'p95_ms': percentile(ordered, 95) * 1000,
+        'p99_ms': percentile(ordered, 99) * 1000,
+    }
@@ -0,0 +1,26 @@
+"""
+Точка входа для запуска бенчмарков
+"""
+import argparse
+import asyncio
+
+from . import analytics, database, dispatcher, encryption, purchase
+
+
+SCENARIOS = [purchase, dispatcher, database, encryption, analytics]
+
+
+def main():
+    """Разбор аргументов и запуск выбранного сценария"""
+    parser = argparse.ArgumentParser(prog="python -m telegramshop.benchmarks")
+    subparsers = parser.add_subparsers(dest="scenario", required=True)
+    for scenario in SCENARIOS:
+        scenario.register(subparsers)
+
+    args = parser.parse_args()
+    # Сценарий может вернуть код завершения (например, 1 при регрессии)
+    raise SystemExit(asyncio.run(args.func(args)))
+
+
+if __name__ == "__main__":
+    main()
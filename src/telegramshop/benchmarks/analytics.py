@@ -0,0 +1,158 @@
+"""
+Бенчмарк аналитики продаж: сводка sales_rollup против запросов по orders
+
+Для каждого масштаба история заказов генерируется за одни и те же
+--days дней, поэтому с ростом числа заказов растет их плотность в окне
+отчета. Отчет по сводке должен оставаться на месте (строк сводки не
+больше, чем товаров на число периодов), запрос по orders — расти вместе
+с историей. Заодно замеряется покупка, которая теперь обновляет сводку.
+"""
+import asyncio
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import aiosqlite
+
+from .. import datagen
+from ..database import SALES_BUCKETS, SALES_WINDOWS, SCHEMA_VERSION, Database
+from . import summarize
+
+
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+PRODUCTS = 200
+
+
+async def _raw_report(db_path: str, granularity: str, limit: int = 10):
+    """Тот же отчет, что get_sales_report, но по таблице orders"""
+    since = SALES_BUCKETS[granularity].format(ts=SALES_WINDOWS[granularity])
+    bucket = SALES_BUCKETS[granularity].format(ts="o.created_at")
+    window = f"FROM orders o WHERE o.status = 'completed' AND o.created_at >= {since}"
+    totals = "COUNT(*) AS orders, SUM(o.quantity) AS units, SUM(o.amount) AS revenue"
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute(f"SELECT {bucket} AS bucket, {totals} {window} GROUP BY bucket") as cursor:
+            series = await cursor.fetchall()
+        async with db.execute(f"""
+            SELECT o.product_id, {totals} {window}
+            GROUP BY o.product_id ORDER BY revenue DESC LIMIT ?
+        """, (limit,)) as cursor:
+            products = await cursor.fetchall()
+        async with db.execute(f"""
+            SELECT p.category_id, {totals}
+            FROM orders o JOIN products p ON p.product_id = o.product_id
+            WHERE o.status = 'completed' AND o.created_at >= {since}
+            GROUP BY p.category_id
+        """) as cursor:
+            categories = await cursor.fetchall()
+    return series, products, categories
+
+
+async def _raw_forecast(db_path: str, days: int = 7, limit: int = 10):
+    """Тот же прогноз, что get_stockout_forecast, но по таблице orders"""
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute("""
+            SELECT p.product_id, p.stock_count * ? * 1.0 / s.units AS days_left
+            FROM (
+                SELECT product_id, SUM(quantity) AS units FROM orders
+                WHERE status = 'completed' AND created_at >= date('now', ?)
+                GROUP BY product_id
+            ) s
+            JOIN products p ON p.product_id = s.product_id
+            WHERE p.is_active = 1
+            ORDER BY days_left LIMIT ?
+        """, (days, f"-{days - 1} days", limit)) as cursor:
+            return await cursor.fetchall()
+
+
+async def _template(data_dir: Path, rows: int, days: int) -> Path:
+    """Закэшированная база: rows заказов за days дней"""
+    path = data_dir / f"analytics-{rows}-d{days}-s{SCHEMA_VERSION}.db"
+    if path.exists():
+        return path
+    started = time.perf_counter()
+    partial = path.with_suffix(".tmp")
+    partial.unlink(missing_ok=True)
+    # generate сам запускает цикл событий для создания схемы
+    await asyncio.to_thread(datagen.generate, str(partial), datagen.DataSpec(
+        users=max(rows // 2, 1), products=PRODUCTS, items=max(rows // 10, 10_000),
+        orders_per_user=2.0, payments_per_user=0, days=days,
+    ))
+    partial.rename(path)
+    print(f"  База на {rows} заказов создана за {time.perf_counter() - started:.1f} с")
+    return path
+
+
+async def _samples(operation, iterations: int, max_seconds: float) -> dict:
+    """Замеры вызовов operation(i): iterations раз, но не дольше max_seconds (минимум 3)"""
+    samples = []
+    deadline = time.perf_counter() + max_seconds
+    for i in range(iterations):
+        started = time.perf_counter()
+        await operation(i)
+        samples.append(time.perf_counter() - started)
+        if len(samples) >= 3 and time.perf_counter() > deadline:
+            break
+    return summarize(samples)
+
+
+async def _measure(path: Path, args) -> dict:
+    db = Database(str(path))
+    results = {}
+    for granularity in SALES_BUCKETS:
+        results[f"report_{granularity}"] = (
+            await _samples(lambda i: db.get_sales_report(granularity), args.iterations, args.max_seconds),
+            await _samples(lambda i: _raw_report(str(path), granularity), args.iterations, args.max_seconds),
+        )
+    results["forecast"] = (
+        await _samples(lambda i: db.get_stockout_forecast(), args.iterations, args.max_seconds),
+        await _samples(lambda i: _raw_forecast(str(path)), args.iterations, args.max_seconds),
+    )
+
+    # Покупка с обновлением сводки: у товаров в наличии, пользователям хватает баланса
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE users SET balance = 1000000")
+        products = [row[0] for row in conn.execute(
+            "SELECT product_id FROM products WHERE stock_count > 0 ORDER BY stock_count DESC LIMIT 20"
+        )]
+    conn.close()
+
+    async def purchase(i: int):
+        user_id, product_id = i + 1, products[i % len(products)]
+        await db.reserve_product_items(product_id, user_id, 1)
+        await db.complete_purchase(user_id, product_id)
+
+    results["purchase"] = (await _samples(purchase, args.iterations, args.max_seconds), None)
+    return results
+
+
+async def run(args):
+    """Запуск сценария и вывод результатов"""
+    data_dir = Path(args.data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    print(f"История заказов: {args.days} дней, товаров: {PRODUCTS}")
+    print(f"  {'заказов':>9}  {'операция':<14}{'сводка p50':>12}{'orders p50, мс':>16}{'выигрыш':>10}")
+    for rows in args.rows:
+        template = await _template(data_dir, rows, args.days)
+        with tempfile.TemporaryDirectory(dir=data_dir) as tmp:
+            path = Path(tmp) / "bench.db"
+            shutil.copyfile(template, path)
+            results = await _measure(path, args)
+        for name, (rollup, raw) in results.items():
+            line = f"  {rows:>9}  {name:<14}{rollup['p50_ms']:>12.3f}"
+            if raw:
+                line += f"{raw['p50_ms']:>16.3f}{raw['p50_ms'] / rollup['p50_ms']:>9.0f}×"
+            print(line)
+
+
+def register(subparsers):
+    """Регистрация сценария в CLI"""
+    parser = subparsers.add_parser("analytics", help="Отчеты по сводке продаж против запросов по orders")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="Заказов в истории")
+    parser.add_argument("--days", type=int, default=90, help="Длина истории заказов, дней")
+    parser.add_argument("--iterations", type=int, default=50, help="Вызовов каждого запроса")
+    parser.add_argument("--max-seconds", type=float, default=3.0, help="Предел времени на запрос, сек")
+    parser.add_argument("--data-dir", default=str(Path(tempfile.gettempdir()) / "telegramshop-bench"),
+                        help="Каталог для сгенерированных баз (переиспользуются между запусками)")
+    parser.set_defaults(func=run)
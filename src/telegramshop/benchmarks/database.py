@@ -0,0 +1,410 @@
+"""
+Бенчмарк методов Database на сгенерированных базах разного размера
+
+Для каждого масштаба (строк в users, orders и product_items) база
+генерируется один раз и кэшируется в --data-dir; замеры идут на копии.
+Результаты (ops/s и перцентили задержки) сохраняются в JSON, а при
+указании --baseline сравниваются с прошлым прогоном: рост p50 больше
+порога считается регрессией, и процесс завершается с кодом 1.
+"""
+import inspect
+import json
+import platform
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from .. import payload
+from ..database import SALES_ROLLUP_BACKFILL, SCHEMA_VERSION, Database
+from . import summarize
+
+
+# Версия генератора: при изменении данных кэшированные базы пересоздаются
+DATA_VERSION = 5
+
+CATEGORIES = 20
+PRODUCTS = 200
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+
+
+class Context:
+    """Параметры сгенерированной базы, по которым выбираются аргументы вызовов"""
+
+    def __init__(self, rows: int, archive_path: str):
+        self.rows = rows
+        self.payments = max(rows // 10, 100)
+        self.archive_path = archive_path
+
+    def user_id(self, i: int) -> int:
+        """Псевдослучайный существующий пользователь (без горячего кэша страниц)"""
+        return (i * 7919) % self.rows + 1
+
+    def product_id(self, i: int) -> int:
+        return i % PRODUCTS + 1
+
+    def category_id(self, i: int) -> int:
+        return i % CATEGORIES + 1
+
+    def payment_id(self, i: int) -> int:
+        return (i * 613) % self.payments + 1
+
+    def pending_payment_id(self, i: int) -> int:
+        """Ожидающие платежи — с нечетными ID"""
+        return (i * 2 + 1) % self.payments or 1
+
+
+def _generate(path: Path, rows: int):
+    """Генерация базы: rows пользователей, заказов, позиций и записей журнала"""
+    db = sqlite3.connect(path)
+    db.executemany(
+        "INSERT INTO categories (category_id, name, position) VALUES (?, ?, ?)",
+        ((i, f"Категория {i}", i) for i in range(1, CATEGORIES + 1))
+    )
+    db.executemany(
+        "INSERT INTO products (product_id, category_id, name, description, price, position) "
+        "VALUES (?, ?, ?, '', ?, ?)",
+        ((i, i % CATEGORIES + 1, f"Товар {i}", float(i % 50 + 1), i) for i in range(1, PRODUCTS + 1))
+    )
+    db.executemany(
+        "INSERT INTO users (user_id, username, first_name, balance, purchases_count, created_at, last_active_at) "
+        "VALUES (?, ?, ?, 1000, 1, datetime('now', ?4), datetime('now', ?4))",
+        ((i, f"user{i}", f"User {i}", f"-{rows - i} minutes") for i in range(1, rows + 1))
+    )
+    db.executemany(
+        "INSERT INTO balance_ledger (user_id, amount, balance_after, reason) VALUES (?, 1000, 1000, 'opening')",
+        ((i,) for i in range(1, rows + 1))
+    )
+    db.executemany(
+        "INSERT INTO orders (user_id, product_id, product_name, amount, status, created_at) "
+        "VALUES (?, ?, ?, ?, 'completed', datetime('now', ?))",
+        (((i * 31) % rows + 1, i % PRODUCTS + 1, f"Товар {i % PRODUCTS + 1}", 10.0, f"-{rows - i} minutes")
+         for i in range(1, rows + 1))
+    )
+    # Четверть позиций каждого товара продана, остальные в наличии
+    def sold(i: int) -> bool:
+        return i // PRODUCTS % 4 == 0
+
+    db.executemany(
+        "INSERT INTO product_items (product_id, data, is_sold, sold_to_user_id, sold_at) "
+        "VALUES (?, ?, ?, ?, datetime('now', ?))",
+        ((i % PRODUCTS + 1, f"item-{i}", int(sold(i)), (i * 17) % rows + 1 if sold(i) else None,
+          f"-{rows - i} minutes" if sold(i) else None)
+         for i in range(1, rows + 1))
+    )
+    db.executemany(
+        "INSERT INTO payments (payment_id, user_id, amount, status, payment_method, external_id) "
+        "VALUES (?, ?, 100, ?, 'bench', ?)",
+        ((i, (i * 13) % rows + 1, "pending" if i % 2 else "completed", f"ext-{i}")
+         for i in range(1, max(rows // 10, 100) + 1))
+    )
+    db.execute("""
+        UPDATE products SET stock_count = (
+            SELECT COUNT(*) FROM product_items i
+            WHERE i.product_id = products.product_id AND i.is_sold = 0
+        )
+    """)
+    db.execute(SALES_ROLLUP_BACKFILL)
+    db.commit()
+    db.close()
+
+
+async def _template(data_dir: Path, rows: int) -> Path:
+    """Закэшированная база нужного размера (создается при первом запуске)"""
+    path = data_dir / f"bench-{rows}-v{DATA_VERSION}-s{SCHEMA_VERSION}.db"
+    if path.exists():
+        return path
+
+    started = time.perf_counter()
+    partial = path.with_suffix(".tmp")
+    partial.unlink(missing_ok=True)
+    db = Database(str(partial))
+    await db.init_db()
+    await db.init_default_info_texts()
+    _generate(partial, rows)
+    partial.rename(path)
+    print(f"  База на {rows} строк создана за {time.perf_counter() - started:.1f} с")
+    return path
+
+
+async def _consume(iterator) -> int:
+    count = 0
+    async for _ in iterator:
+        count += 1
+    return count
+
+
+def _export_period(i: int) -> tuple:
+    """Месячный период выгрузки за последний год"""
+    start = date.today() - timedelta(days=30 * (i % 12 + 1))
+    return start.isoformat(), (start + timedelta(days=30)).isoformat()
+
+
+async def _first_page(iterator):
+    """Первая страница постраничного чтения (полное чтение большой базы не укладывается в замер)"""
+    async for page in iterator:
+        return page
+
+
+async def _add_then(add: Awaitable[int], operation: Callable[[int], Awaitable]):
+    """Подготовка вне замера: создание объекта, который удаляет замеряемый вызов"""
+    return operation(await add)
+
+
+async def _reserved_purchase(db: Database, ctx: Context, i: int):
+    user_id = ctx.user_id(i)
+    await db.reserve_product_items(ctx.product_id(i), user_id, 1)
+    return db.complete_purchase(user_id, ctx.product_id(i))
+
+
+# Подготовка вызова: (db, ctx, номер итерации) -> корутина, время которой замеряется
+Case = Callable[[Database, Context, int], Awaitable[Awaitable]]
+
+
+def _call(factory: Callable[[Database, Context, int], Awaitable]) -> Case:
+    async def case(db: Database, ctx: Context, i: int):
+        return factory(db, ctx, i)
+    return case
+
+
+CASES: Dict[str, Case] = {
+    # Схема и служебное
+    "init_db": _call(lambda db, ctx, i: db.init_db()),
+    "close": _call(lambda db, ctx, i: db.close()),
+    "get_setting": _call(lambda db, ctx, i: db.get_setting("bench")),
+    "set_setting": _call(lambda db, ctx, i: db.set_setting("bench", str(i))),
+    "get_info_text": _call(lambda db, ctx, i: db.get_info_text("rules")),
+    "set_info_text": _call(lambda db, ctx, i: db.set_info_text("bench", str(i))),
+    "init_default_info_texts": _call(lambda db, ctx, i: db.init_default_info_texts()),
+
+    # Пользователи и баланс
+    "add_user": _call(lambda db, ctx, i: db.add_user(ctx.rows + i + 1, f"new{i}", "New")),
+    "get_user": _call(lambda db, ctx, i: db.get_user(ctx.user_id(i))),
+    "update_user_balance": _call(lambda db, ctx, i: db.update_user_balance(ctx.user_id(i), 1.0)),
+    "get_balance_ledger": _call(lambda db, ctx, i: db.get_balance_ledger(ctx.user_id(i))),
+    "verify_balances": _call(lambda db, ctx, i: db.verify_balances()),
+    "increment_purchases": _call(lambda db, ctx, i: db.increment_purchases(ctx.user_id(i))),
+    "get_all_users": _call(lambda db, ctx, i: db.get_all_users(offset=(i * 50) % ctx.rows)),
+    "get_users_count": _call(lambda db, ctx, i: db.get_users_count()),
+    "search_users": _call(lambda db, ctx, i: db.search_users(f"user{ctx.user_id(i)}")),
+    "set_user_blocked": _call(lambda db, ctx, i: db.set_user_blocked(ctx.user_id(i), False)),
+    "get_statistics": _call(lambda db, ctx, i: db.get_statistics()),
+
+    # Заказы и платежи
+    "add_order": _call(lambda db, ctx, i: db.add_order(ctx.user_id(i), "bench", 1.0)),
+    "get_user_orders": _call(lambda db, ctx, i: db.get_user_orders(ctx.user_id(i))),
+    "add_payment": _call(lambda db, ctx, i: db.add_payment(ctx.user_id(i), 100.0, "bench")),
+    "get_payment": _call(lambda db, ctx, i: db.get_payment(ctx.payment_id(i))),
+    "get_payment_by_external_id": _call(
+        lambda db, ctx, i: db.get_payment_by_external_id("bench", f"ext-{ctx.payment_id(i)}")
+    ),
+    "set_payment_external_id": _call(
+        lambda db, ctx, i: db.set_payment_external_id(ctx.payment_id(i), f"ext-{ctx.payment_id(i)}")
+    ),
+    "get_pending_payments": _call(lambda db, ctx, i: db.get_pending_payments()),
+    "complete_payment": _call(lambda db, ctx, i: db.complete_payment(ctx.pending_payment_id(i))),
+    "cancel_stale_payments": _call(lambda db, ctx, i: db.cancel_stale_payments(86400 * 365)),
+    "get_user_payments": _call(lambda db, ctx, i: db.get_user_payments(ctx.user_id(i))),
+    "update_payment_status": _call(
+        lambda db, ctx, i: db.update_payment_status(ctx.payment_id(i), "pending", expected_status="bench")
+    ),
+
+    # Каталог
+    "get_active_categories": _call(lambda db, ctx, i: db.get_active_categories()),
+    "get_category": _call(lambda db, ctx, i: db.get_category(ctx.category_id(i))),
+    "add_category": _call(lambda db, ctx, i: db.add_category(f"bench-{i}", is_active=False)),
+    "update_category": _call(lambda db, ctx, i: db.update_category(ctx.category_id(i), position=i)),
+    "delete_category": lambda db, ctx, i: _add_then(
+        db.add_category(f"tmp-{i}", is_active=False), db.delete_category
+    ),
+    "get_all_categories": _call(lambda db, ctx, i: db.get_all_categories()),
+    "get_products_by_category": _call(lambda db, ctx, i: db.get_products_by_category(ctx.category_id(i))),
+    "get_product": _call(lambda db, ctx, i: db.get_product(ctx.product_id(i))),
+    "add_product": _call(lambda db, ctx, i: db.add_product(1, f"bench-{i}", "", 1.0, is_active=False)),
+    "update_product": _call(lambda db, ctx, i: db.update_product(ctx.product_id(i), position=i)),
+    "delete_product": lambda db, ctx, i: _add_then(
+        db.add_product(1, f"tmp-{i}", "", 1.0, is_active=False), db.delete_product
+    ),
+    "get_all_products": _call(lambda db, ctx, i: db.get_all_products()),
+    "update_product_stock": _call(lambda db, ctx, i: db.update_product_stock(ctx.product_id(i))),
+    "reconcile_stock": _call(lambda db, ctx, i: db.reconcile_stock()),
+    "get_stock_counts": _call(lambda db, ctx, i: db.get_stock_counts()),
+
+    # Товарные позиции, брони и покупка
+    "add_product_item": _call(lambda db, ctx, i: db.add_product_item(ctx.product_id(i), f"new-{i}")),
+    "add_product_items_bulk": _call(
+        lambda db, ctx, i: db.add_product_items_bulk(ctx.product_id(i), [f"bulk-{i}-{n}" for n in range(100)])
+    ),
+    "get_available_product_item": _call(lambda db, ctx, i: db.get_available_product_item(ctx.product_id(i))),
+    "mark_item_as_sold": _call(lambda db, ctx, i: db.mark_item_as_sold((i * 4 + 1) % ctx.rows, ctx.user_id(i))),
+    "count_sold_items": _call(lambda db, ctx, i: db.count_sold_items(ctx.user_id(i))),
+    "iter_sold_items": _call(lambda db, ctx, i: _consume(db.iter_sold_items(ctx.user_id(i)))),
+    "reveal_items": _call(lambda db, ctx, i: db.reveal_items([{'data': f"item-{i}"}])),
+    "get_available_stock": _call(lambda db, ctx, i: db.get_available_stock(ctx.product_id(i))),
+    "reserve_product_items": _call(
+        lambda db, ctx, i: db.reserve_product_items(ctx.product_id(i), ctx.user_id(i), 1)
+    ),
+    "release_reservation": _call(lambda db, ctx, i: db.release_reservation(ctx.product_id(i), ctx.user_id(i))),
+    "release_expired_reservations": _call(lambda db, ctx, i: db.release_expired_reservations()),
+    "complete_purchase": _reserved_purchase,
+
+    # Аналитика продаж
+    "add_product_views": _call(lambda db, ctx, i: db.add_product_views({ctx.product_id(i): 1})),
+    "get_sales_report": _call(lambda db, ctx, i: db.get_sales_report(("hour", "day", "week")[i % 3])),
+    "get_stockout_forecast": _call(lambda db, ctx, i: db.get_stockout_forecast()),
+    "prune_sales_rollup": _call(lambda db, ctx, i: db.prune_sales_rollup()),
+
+    # Рассылки (активны за сутки последние 1440 пользователей)
+    "touch_users": _call(lambda db, ctx, i: db.touch_users([ctx.user_id(i + n) for n in range(100)])),
+    "count_broadcast_audience": _call(lambda db, ctx, i: db.count_broadcast_audience("active", "1")),
+    "create_broadcast": _call(lambda db, ctx, i: db.create_broadcast("active", "bench", "1")),
+    "get_broadcast_recipients": _call(lambda db, ctx, i: db.get_broadcast_recipients(1, 0, 100)),
+    "record_broadcast_results": _call(
+        lambda db, ctx, i: db.record_broadcast_results(1, {ctx.user_id(i + n): "sent" for n in range(100)})
+    ),
+    "finish_broadcast": _call(lambda db, ctx, i: db.finish_broadcast(1)),
+
+    # Выгрузки
+    "count_export_rows": _call(lambda db, ctx, i: db.count_export_rows("orders", *_export_period(i))),
+    "iter_export_rows": _call(lambda db, ctx, i: _first_page(db.iter_export_rows("orders", *_export_period(i)))),
+
+    # Отложенные задачи
+    "add_scheduled_job": _call(lambda db, ctx, i: db.add_scheduled_job("bench", "{}", time.time() + 3600)),
+    "delete_scheduled_job": lambda db, ctx, i: _add_then(
+        db.add_scheduled_job("tmp", "{}", time.time() + 3600), db.delete_scheduled_job
+    ),
+    "get_scheduled_jobs": _call(lambda db, ctx, i: db.get_scheduled_jobs()),
+
+    # Архив и место на диске
+    "init_archive": _call(lambda db, ctx, i: db.init_archive(ctx.archive_path)),
+    "archive_sold_items": _call(lambda db, ctx, i: db.archive_sold_items(ctx.archive_path, 0, 100)),
+    "archive_orders": _call(lambda db, ctx, i: db.archive_orders(ctx.archive_path, 0, 100)),
+    "get_storage_info": _call(lambda db, ctx, i: db.get_storage_info()),
+    "incremental_vacuum": _call(lambda db, ctx, i: db.incremental_vacuum(100)),
+    "compress_payloads": _call(lambda db, ctx, i: db.compress_payloads((i * 97) % ctx.rows, 100)),
+}
+
+
+def public_methods() -> List[str]:
+    """Публичные асинхронные методы Database (включая асинхронные генераторы)"""
+    return [
+        name for name, value in vars(Database).items()
+        if not name.startswith("_")
+        and (inspect.iscoroutinefunction(value) or inspect.isasyncgenfunction(value))
+    ]
+
+
+async def measure(db: Database, ctx: Context, case: Case, iterations: int, max_seconds: float) -> List[float]:
+    """Замеры одного метода: iterations вызовов, но не дольше max_seconds (минимум 3 вызова)"""
+    samples = []
+    deadline = time.perf_counter() + max_seconds
+    for i in range(iterations):
+        operation = await case(db, ctx, i)
+        started = time.perf_counter()
+        await operation
+        samples.append(time.perf_counter() - started)
+        if len(samples) >= 3 and time.perf_counter() > deadline:
+            break
+    return samples
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta_ms: float) -> List[str]:
+    """
+    Сравнение с прошлым прогоном
+
+    Регрессия — рост p50 больше чем на threshold (доля) и больше
+    min_delta_ms миллисекунд, чтобы шум быстрых запросов не срабатывал.
+    """
+    regressions = []
+    for rows, methods in results["results"].items():
+        previous = baseline.get("results", {}).get(rows, {})
+        for name, stats in methods.items():
+            before = previous.get(name)
+            if not before:
+                continue
+            delta = stats["p50_ms"] - before["p50_ms"]
+            if delta > min_delta_ms and stats["p50_ms"] > before["p50_ms"] * (1 + threshold):
+                regressions.append(
+                    f"{rows} строк, {name}: p50 {before['p50_ms']:.3f} → {stats['p50_ms']:.3f} мс "
+                    f"(+{delta / before['p50_ms'] * 100:.0f}%)"
+                )
+    return regressions
+
+
+async def run(args) -> Optional[int]:
+    """Запуск замеров, сохранение и сравнение результатов"""
+    methods = public_methods()
+    uncovered = [name for name in methods if name not in CASES]
+    if uncovered:
+        print(f"Методы без замеров: {', '.join(uncovered)}")
+    selected = args.methods or [name for name in methods if name in CASES]
+
+    data_dir = Path(args.data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    results = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "schema_version": SCHEMA_VERSION,
+        "iterations": args.iterations,
+        "compression": args.compression,
+        "results": {},
+    }
+
+    for rows in args.rows:
+        print(f"Масштаб: {rows} строк")
+        template = await _template(data_dir, rows)
+        with tempfile.TemporaryDirectory(dir=data_dir) as tmp:
+            path = Path(tmp) / "bench.db"
+            shutil.copyfile(template, path)
+            ctx = Context(rows, str(Path(tmp) / "archive.db"))
+            # История покупок и заказов читается вместе с архивом, как в боте
+            db = Database(str(path), archive_path=ctx.archive_path, compression=args.compression)
+            await db.init_archive(ctx.archive_path)
+
+            scale = results["results"][str(rows)] = {}
+            for name in selected:
+                stats = summarize(await measure(db, ctx, CASES[name], args.iterations, args.max_seconds))
+                scale[name] = {key: round(value, 4) for key, value in stats.items()}
+                print(
+                    f"  {name:<28} {stats['ops_per_sec']:>9.0f} оп/с  p50 {stats['p50_ms']:>8.3f}  "
+                    f"p95 {stats['p95_ms']:>8.3f}  p99 {stats['p99_ms']:>8.3f} мс"
+                )
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Результаты сохранены в {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"Регрессии (порог {args.threshold * 100:.0f}%):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("Регрессий нет")
+    return None
+
+
+def register(subparsers):
+    """Регистрация сценария в CLI"""
+    parser = subparsers.add_parser("database", help="Замеры всех публичных методов Database")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS,
+                        help="Размеры баз: строк в users, orders и product_items")
+    parser.add_argument("--methods", nargs="+", choices=sorted(CASES), help="Только указанные методы")
+    parser.add_argument("--iterations", type=int, default=200, help="Вызовов каждого метода")
+    parser.add_argument("--max-seconds", type=float, default=2.0, help="Предел времени на метод, сек")
+    parser.add_argument("--data-dir", default=str(Path(tempfile.gettempdir()) / "telegramshop-bench"),
+                        help="Каталог для сгенерированных баз (переиспользуются между запусками)")
+    parser.add_argument("--compression", choices=payload.ALGORITHMS, default="none",
+                        help="Сжатие данных позиций (PAYLOAD_COMPRESSION)")
+    parser.add_argument("--output", help="Файл для результатов в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Допустимый рост p50 (доля)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="Рост p50 меньше этого значения не считается регрессией, мс")
+    parser.set_defaults(func=run)
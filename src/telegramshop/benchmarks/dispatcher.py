@@ -0,0 +1,223 @@
+"""
+Сквозной бенчмарк: настоящий Dispatcher с обработчиками бота против
+локального FakeBotAPI
+
+Сценарии:
+- shop: пользователи параллельно проходят покупку от /start до выдачи
+- polling: поток /start через getUpdates (long polling)
+- broadcast: две рассылки администратора всем пользователям; часть
+  пользователей (--blocked) заблокировала бота, и вторая рассылка
+  к ним уже не обращается. Третья — фото с кнопкой и предпросмотром:
+  рассылается copyMessage, с той же скоростью, что и текст
+"""
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import SimpleEventIsolation
+from aiogram.types import Update
+
+from ..analytics import ViewCounter
+from ..config import BotConfig
+from ..database import Database
+from ..fake_bot_api import FakeBotAPI
+from ..fsm_context import BufferedFSMMiddleware
+from ..lifecycle import Lifecycle
+from ..handlers import get_handlers_router
+from ..session import create_session
+from . import summarize
+
+
+ADMIN_ID = 10 ** 9
+
+
+async def _prepare(db_path: str, users: int, stock: int):
+    """База с пользователями, одной категорией и товаром"""
+    db = Database(db_path)
+    await db.init_db()
+    for user_id in range(1, users + 1):
+        await db.add_user(user_id, f"user{user_id}", f"User {user_id}")
+        await db.update_user_balance(user_id, 10 ** 6)
+    await db.add_user(ADMIN_ID, "admin", "Admin")
+    category_id = await db.add_category("bench")
+    product_id = await db.add_product(category_id, "bench", "", 1.0)
+    await db.add_product_items_bulk(product_id, [f"item-{i}" for i in range(stock)])
+    await db.update_product_stock(product_id)
+    return db, category_id, product_id
+
+
+def _build_dispatcher(db: Database, bot: Bot, config: BotConfig) -> Dispatcher:
+    """Диспетчер с теми же обработчиками и зависимостями, что и в main"""
+    dp = Dispatcher(events_isolation=SimpleEventIsolation())
+    dp.update.outer_middleware(BufferedFSMMiddleware())
+    views = ViewCounter(db)
+    # Фоновые задачи обработчиков (рассылки); сценарии дожидаются их через wait_tasks
+    lifecycle = dp["lifecycle"] = Lifecycle()
+    # Исключения обработчиков: при polling диспетчер только пишет их в лог
+    errors = dp["errors"] = []
+
+    @dp.update.outer_middleware()
+    async def dependencies(handler, event, data):
+        data["config"] = config
+        data["db"] = db
+        data["bot"] = bot
+        data["payments"] = None
+        data["views"] = views
+        data["lifecycle"] = lifecycle
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            errors.append(e)
+            raise
+
+    dp.include_router(get_handlers_router())
+    return dp
+
+
+async def _feed(dp: Dispatcher, bot: Bot, update: dict) -> float:
+    started = time.perf_counter()
+    await dp.feed_update(bot, Update.model_validate(update, context={"bot": bot}))
+    return time.perf_counter() - started
+
+
+async def shop_flow(api: FakeBotAPI, dp: Dispatcher, bot: Bot, users: int,
+                    category_id: int, product_id: int):
+    """Каждый пользователь: /start, каталог, категория, товар, бронь, покупка"""
+    async def customer(user_id: int):
+        steps = [
+            api.message_update(user_id, "/start"),
+            api.message_update(user_id, "🛒 Купить товар"),
+            api.callback_update(user_id, f"category_{category_id}"),
+            api.callback_update(user_id, f"product_{product_id}"),
+            api.callback_update(user_id, f"buy_{product_id}_1"),
+            api.callback_update(user_id, f"confirm_buy_{product_id}"),
+        ]
+        return [await _feed(dp, bot, step) for step in steps]
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(customer(user_id) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+    return [sample for samples in results for sample in samples], elapsed
+
+
+async def wait_replies(api: FakeBotAPI, dp: Dispatcher, count: int, timeout: float = 300.0):
+    """
+    Ожидание count вызовов sendMessage
+
+    Обновление, обработчик которого упал, ответа не получит, поэтому
+    ошибка обработчика прерывает ожидание сразу, а не по таймауту.
+    """
+    deadline = time.monotonic() + timeout
+    while api.calls["sendMessage"] < count:
+        if dp["errors"]:
+            error = dp["errors"][0]
+            raise RuntimeError(f"Ошибок обработчиков: {len(dp['errors'])}, первая: {error!r}") from error
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError(f"sendMessage: {api.calls['sendMessage']} из {count} вызовов")
+        try:
+            await api.wait_calls("sendMessage", count, timeout=min(remaining, 0.5))
+        except asyncio.TimeoutError:
+            pass
+
+
+async def polling_flow(api: FakeBotAPI, dp: Dispatcher, bot: Bot, updates: int):
+    """Поток /start через getUpdates до получения всех ответов"""
+    sent_before = api.calls["sendMessage"]
+    # Обновления ставятся в очередь до запуска: первый getUpdates забирает
+    # их сразу, а не после таймаута пустого long polling
+    for index in range(updates):
+        api.push_update(api.message_update(index % 1000 + 1, "/start"))
+    started = time.perf_counter()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+
+    try:
+        await wait_replies(api, dp, sent_before + updates)
+        return time.perf_counter() - started
+    finally:
+        await dp.stop_polling()
+        await polling
+
+
+async def broadcast_flow(api: FakeBotAPI, dp: Dispatcher, bot: Bot, media: bool = False) -> float:
+    """Рассылка: ввод сообщения, подтверждение; замеряется отправка после подтверждения"""
+    await _feed(dp, bot, api.callback_update(ADMIN_ID, "admin_broadcast"))
+    await _feed(dp, bot, api.callback_update(ADMIN_ID, "admin_broadcast_seg_all"))
+    if not media:
+        await _feed(dp, bot, api.message_update(ADMIN_ID, "benchmark"))
+    else:
+        photo = {"file_id": "benchmark", "file_unique_id": "benchmark", "width": 1280, "height": 720}
+        await _feed(dp, bot, api.message_update(ADMIN_ID, None, photo=[photo], caption="benchmark"))
+        await _feed(dp, bot, api.callback_update(ADMIN_ID, "admin_broadcast_buttons"))
+        await _feed(dp, bot, api.message_update(ADMIN_ID, "Каталог - https://t.me/fake_bot"))
+        await _feed(dp, bot, api.callback_update(ADMIN_ID, "admin_broadcast_preview"))
+    # Подтверждение запускает рассылку в фоне: замеряется до ее завершения
+    started = time.perf_counter()
+    await _feed(dp, bot, api.callback_update(ADMIN_ID, "admin_broadcast_confirm"))
+    await dp["lifecycle"].wait_tasks()
+    return time.perf_counter() - started
+
+
+async def run(args):
+    """Запуск сценариев и вывод результатов"""
+    api = FakeBotAPI(latency=args.latency / 1000, retry_after_every=args.retry_after_every)
+    url = await api.start()
+    bot = Bot("1:benchmark", session=create_session(api_url=url))
+    config = BotConfig(token="1:benchmark", admin_ids=[ADMIN_ID])
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db, category_id, product_id = await _prepare(
+                str(Path(tmp) / "bench.db"), args.users, args.users * 2
+            )
+            dp = _build_dispatcher(db, bot, config)
+            print(f"Задержка Bot API: {args.latency} мс, пользователей: {args.users}")
+
+            if "shop" in args.flows:
+                samples, elapsed = await shop_flow(api, dp, bot, args.users, category_id, product_id)
+                stats = summarize(samples)
+                print(
+                    f"  shop: {len(samples)} обновлений за {elapsed:.2f} с "
+                    f"({len(samples) / elapsed:.0f} обн./с), p50 {stats['p50_ms']:.1f} мс, "
+                    f"p95 {stats['p95_ms']:.1f} мс"
+                )
+
+            if "polling" in args.flows:
+                elapsed = await polling_flow(api, dp, bot, args.updates)
+                print(f"  polling: {args.updates} обновлений за {elapsed:.2f} с "
+                      f"({args.updates / elapsed:.0f} обн./с)")
+
+            if "broadcast" in args.flows:
+                api.blocked_chats.update(range(1, int(args.users * args.blocked) + 1))
+                for run_number, media in ((1, False), (2, False), (3, True)):
+                    # Получатели — все пользователи базы, включая созданных в сценарии polling
+                    recipients = await db.count_broadcast_audience("all")
+                    method = "copyMessage" if media else "sendMessage"
+                    sent_before = api.calls[method]
+                    elapsed = await broadcast_flow(api, dp, bot, media)
+                    print(f"  broadcast #{run_number}: {recipients} получателей, "
+                          f"{api.calls[method] - sent_before} {method} за {elapsed:.2f} с "
+                          f"({recipients / elapsed:.0f} сообщ./с)")
+
+            stats = bot.session.stats
+            print(f"  Запросов к Bot API: {stats.requests}, повторов после 429: {stats.retries}")
+    finally:
+        await bot.session.close()
+        await api.stop()
+
+
+def register(subparsers):
+    """Регистрация сценария в CLI"""
+    parser = subparsers.add_parser("dispatcher", help="Сквозная обработка обновлений против FakeBotAPI")
+    parser.add_argument("--users", type=int, default=50, help="Количество покупателей")
+    parser.add_argument("--updates", type=int, default=500, help="Обновлений в сценарии polling")
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа Bot API, мс")
+    parser.add_argument("--retry-after-every", type=int, default=0,
+                        help="Каждый N-й запрос получает 429 (0 — выключено)")
+    parser.add_argument("--blocked", type=float, default=0.2,
+                        help="Доля покупателей, заблокировавших бота (сценарий broadcast)")
+    parser.add_argument("--flows", nargs="+", default=["shop", "polling", "broadcast"],
+                        choices=["shop", "polling", "broadcast"], help="Сценарии")
+    parser.set_defaults(func=run)
@@ -0,0 +1,121 @@
+"""
+Бенчмарк шифрования позиций: цена загрузки и покупки с шифрованием и сжатием
+"""
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from ..database import Database
+from ..encryption import generate_master_key
+from . import summarize
+
+
+# Режимы хранения: (сжатие, шифрование)
+MODES = {
+    "plain": ("none", False),
+    "encrypted": ("none", True),
+    "zlib": ("zlib", False),
+    "zlib+encrypted": ("zlib", True),
+}
+
+
+def _items(count: int, seed: int):
+    """Позиции, похожие на реальные: логин, пароль и общий текст инструкции"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield (
+            f"login: user{rng.getrandbits(32)}@example.com password: {rng.getrandbits(48):x} "
+            f"server: https://service.example.com/api — активировать в течение 24 часов"
+        )
+
+
+async def _measure(path: str, mode: str, args) -> dict:
+    compression, encrypted = MODES[mode]
+    db = Database(
+        path, compression=compression,
+        master_key=generate_master_key() if encrypted else None, key_cache_size=args.products
+    )
+    await db.init_db()
+    await db.add_user(1, "bench", "Bench")
+    await db.update_user_balance(1, 10 ** 9)
+    category_id = await db.add_category("bench")
+    products = [await db.add_product(category_id, f"bench-{i}", "", 1.0) for i in range(args.products)]
+
+    # Загрузка: позиции поступают генератором, как из файла
+    started = time.perf_counter()
+    for product_id in products:
+        await db.add_product_items_bulk(product_id, _items(args.items, product_id))
+    import_seconds = time.perf_counter() - started
+
+    # Покупка с выдачей: бронь, списание и расшифровка перед отправкой
+    rng = random.Random(0)
+    purchases = []
+    for _ in range(args.purchases):
+        product_id = rng.choice(products)
+        started = time.perf_counter()
+        await db.reserve_product_items(product_id, 1, args.quantity)
+        result = await db.complete_purchase(1, product_id)
+        await db.reveal_items(result['items'])
+        purchases.append(time.perf_counter() - started)
+
+    # Только расшифровка выдачи: ключи в кэше и после его сброса
+    sold = [item async for item in db.iter_sold_items(1)]
+    raw = [item['data'] for item in sold]
+    warm, cold = [], []
+    for cache in (warm, cold):
+        for _ in range(args.repeat):
+            if db.cipher is not None and cache is cold:
+                db.cipher.clear()
+            items = [{'data': value} for value in raw]
+            started = time.perf_counter()
+            await db.reveal_items(items)
+            cache.append((time.perf_counter() - started) / len(items))
+
+    return {
+        'import_per_sec': args.items * args.products / import_seconds,
+        'purchase': summarize(purchases),
+        'reveal_warm_us': summarize(warm)['p50_ms'] * 1000,
+        'reveal_cold_us': summarize(cold)['p50_ms'] * 1000,
+        'file_mb': Path(path).stat().st_size / 2 ** 20,
+    }
+
+
+async def run(args):
+    """Запуск сценария и вывод результатов"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in args.modes:
+            results[mode] = await _measure(str(Path(tmp) / f"{mode}.db"), mode, args)
+
+    print(
+        f"Товаров: {args.products}, позиций на товар: {args.items}, "
+        f"покупок: {args.purchases} по {args.quantity} шт."
+    )
+    print(f"  {'режим':<16}{'загрузка, поз/с':>17}{'покупка p50':>13}{'p95, мс':>9}"
+          f"{'выдача, мкс/поз':>17}{'без кэша':>10}{'файл, МБ':>10}")
+    for mode, result in results.items():
+        print(
+            f"  {mode:<16}{result['import_per_sec']:>17.0f}{result['purchase']['p50_ms']:>13.3f}"
+            f"{result['purchase']['p95_ms']:>9.3f}{result['reveal_warm_us']:>17.1f}"
+            f"{result['reveal_cold_us']:>10.1f}{result['file_mb']:>10.1f}"
+        )
+
+    if "plain" in results and "encrypted" in results:
+        plain, encrypted = results["plain"], results["encrypted"]
+        print(
+            f"  Шифрование: загрузка ×{plain['import_per_sec'] / encrypted['import_per_sec']:.2f} по времени, "
+            f"покупка {encrypted['purchase']['p50_ms'] - plain['purchase']['p50_ms']:+.3f} мс (p50)"
+        )
+
+
+def register(subparsers):
+    """Регистрация сценария в CLI"""
+    parser = subparsers.add_parser("encryption", help="Цена шифрования позиций при загрузке и покупке")
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=list(MODES))
+    parser.add_argument("--products", type=int, default=20, help="Количество товаров (и ключей данных)")
+    parser.add_argument("--items", type=int, default=5000, help="Позиций на товар")
+    parser.add_argument("--purchases", type=int, default=300, help="Количество покупок")
+    parser.add_argument("--quantity", type=int, default=1, help="Позиций в покупке")
+    parser.add_argument("--repeat", type=int, default=20, help="Повторов замера расшифровки")
+    parser.set_defaults(func=run)
@@ -0,0 +1,68 @@
+"""
+Бенчмарк покупки: N покупок по одной позиции против одной покупки N позиций
+"""
+import tempfile
+import time
+from pathlib import Path
+
+from ..database import Database
+from . import summarize
+
+
+async def _prepare(db_path: str, items_count: int):
+    """Создание базы с одним товаром, покупателем и позициями"""
+    db = Database(db_path)
+    await db.init_db()
+    await db.add_user(1, "bench", "Bench")
+    await db.update_user_balance(1, 10 ** 9)
+    category_id = await db.add_category("bench")
+    product_id = await db.add_product(category_id, "bench", "", 1.0)
+    await db.add_product_items_bulk(product_id, [f"item-{i}" for i in range(items_count)])
+    return db, product_id
+
+
+async def buy_one_by_one(db: Database, product_id: int, quantity: int) -> float:
+    """N покупок по одной позиции (как до появления выбора количества)"""
+    started = time.perf_counter()
+    for _ in range(quantity):
+        await db.reserve_product_items(product_id, 1, 1)
+        result = await db.complete_purchase(1, product_id)
+        assert result['status'] == 'ok'
+    return time.perf_counter() - started
+
+
+async def buy_in_bulk(db: Database, product_id: int, quantity: int) -> float:
+    """Одна покупка N позиций"""
+    started = time.perf_counter()
+    await db.reserve_product_items(product_id, 1, quantity)
+    result = await db.complete_purchase(1, product_id)
+    assert result['status'] == 'ok' and result['quantity'] == quantity
+    return time.perf_counter() - started
+
+
+async def run(args):
+    """Запуск сценария и вывод результатов"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db, product_id = await _prepare(
+            str(Path(tmp) / "bench.db"), args.quantity * args.repeat * 2 + args.stock
+        )
+
+        single = [await buy_one_by_one(db, product_id, args.quantity) for _ in range(args.repeat)]
+        bulk = [await buy_in_bulk(db, product_id, args.quantity) for _ in range(args.repeat)]
+
+    print(f"Покупка {args.quantity} позиций, повторов: {args.repeat}")
+    for name, samples in ((f"{args.quantity}×1", single), (f"1×{args.quantity}", bulk)):
+        stats = summarize(samples)
+        print(f"  {name:>8}: среднее {stats['mean_ms']:.2f} мс, p95 {stats['p95_ms']:.2f} мс")
+
+    speedup = summarize(single)['mean_ms'] / max(summarize(bulk)['mean_ms'], 1e-9)
+    print(f"  Ускорение: ×{speedup:.1f}")
+
+
+def register(subparsers):
+    """Регистрация сценария в CLI"""
+    parser = subparsers.add_parser("purchase", help="N×1 против 1×N при покупке")
+    parser.add_argument("--quantity", type=int, default=50, help="Позиций в покупке")
+    parser.add_argument("--repeat", type=int, default=5, help="Количество повторов")
+    parser.add_argument("--stock", type=int, default=10000, help="Дополнительный остаток товара")
+    parser.set_defaults(func=run)
@@ -0,0 +1,199 @@
+"""
+Рассылки по сегментам аудитории
+"""
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+from aiogram import Bot
+from aiogram.enums import ContentType
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.types import InlineKeyboardMarkup, Message
+
+from .database import Database
+from .keyboards import get_broadcast_buttons_keyboard
+
+
+logger = logging.getLogger(__name__)
+
+# Подписи сегментов для админ-панели (условия — в BROADCAST_SEGMENTS)
+SEGMENT_TITLES = {
+    "all": "Все пользователи",
+    "notblocked": "Не заблокированные администратором",
+    "buyers": "Совершавшие покупки",
+    "category": "Покупавшие в категории",
+    "balance": "С положительным балансом",
+    "active": "Активные за последние дни",
+}
+
+# Периоды сегмента active, дней
+ACTIVE_DAYS = (1, 7, 30, 90)
+
+# Типы сообщений, которые можно разослать копией, и их подписи
+CONTENT_TITLES = {
+    "text": "Текст",
+    "photo": "Фото",
+    "video": "Видео",
+    "animation": "GIF",
+    "document": "Документ",
+    "audio": "Аудио",
+    "voice": "Голосовое сообщение",
+    "video_note": "Видеосообщение",
+    "sticker": "Стикер",
+}
+
+# Ограничения Telegram на inline-кнопки
+MAX_BUTTONS_IN_ROW = 8
+MAX_BUTTONS = 100
+BUTTON_URL_PREFIXES = ("https://", "http://", "tg://")
+
+
+@dataclass
+class BroadcastMessage:
+    """
+    Сообщение рассылки
+
+    Текст отправляется заново (с HTML-разметкой, как его ввел
+    администратор), остальные типы — copy_message из исходного сообщения
+    администратора: медиа уже лежит на серверах Telegram и не загружается
+    для каждого получателя. В обоих случаях — один запрос на получателя.
+    Исходное сообщение нельзя удалять до конца рассылки.
+
+    Args:
+        buttons: Ряды URL-кнопок: [[[текст, ссылка], ...], ...]
+    """
+    content_type: str
+    source_chat_id: int
+    source_message_id: int
+    text: Optional[str] = None
+    buttons: Optional[List[List[List[str]]]] = None
+
+    @classmethod
+    def from_message(cls, message: Message) -> Optional["BroadcastMessage"]:
+        """Сообщение администратора или None, если такой тип не рассылается"""
+        content_type = ContentType(message.content_type).value
+        if content_type not in CONTENT_TITLES:
+            return None
+        return cls(
+            content_type=content_type,
+            source_chat_id=message.chat.id,
+            source_message_id=message.message_id,
+            text=message.text if content_type == "text" else message.caption
+        )
+
+    @property
+    def reply_markup(self) -> Optional[InlineKeyboardMarkup]:
+        return get_broadcast_buttons_keyboard(self.buttons) if self.buttons else None
+
+    @property
+    def buttons_count(self) -> int:
+        return sum(len(row) for row in self.buttons or [])
+
+    async def send(self, bot: Bot, chat_id: int):
+        """Отправка одному получателю"""
+        if self.content_type == "text":
+            return await bot.send_message(chat_id, self.text, reply_markup=self.reply_markup)
+        return await bot.copy_message(
+            chat_id, self.source_chat_id, self.source_message_id, reply_markup=self.reply_markup
+        )
+
+    def buttons_json(self) -> Optional[str]:
+        return json.dumps(self.buttons, ensure_ascii=False) if self.buttons else None
+
+
+def parse_buttons(text: str) -> List[List[List[str]]]:
+    """
+    Кнопки из текста администратора: строка — ряд, кнопки ряда через «|»,
+    кнопка — «Текст - ссылка»
+
+    Raises:
+        ValueError: Описание первой ошибки для администратора
+    """
+    rows = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        row = []
+        for part in line.split("|"):
+            title, separator, url = part.rpartition(" - ")
+            title, url = title.strip(), url.strip()
+            if not separator or not title:
+                raise ValueError(f"Строка {number}: нужен формат «Текст - ссылка»")
+            if not url.startswith(BUTTON_URL_PREFIXES) or " " in url:
+                raise ValueError(f"Строка {number}: ссылка должна начинаться с https://, http:// или tg://")
+            row.append([title, url])
+        if len(row) > MAX_BUTTONS_IN_ROW:
+            raise ValueError(f"Строка {number}: не больше {MAX_BUTTONS_IN_ROW} кнопок в ряду")
+        rows.append(row)
+    if not rows:
+        raise ValueError("Не найдено ни одной кнопки")
+    if sum(len(row) for row in rows) > MAX_BUTTONS:
+        raise ValueError(f"Не больше {MAX_BUTTONS} кнопок")
+    return rows
+
+
+def describe_segment(segment: str, arg: Optional[str] = None, category_name: Optional[str] = None) -> str:
+    """Описание аудитории для подтверждения рассылки"""
+    if segment == "active":
+        return f"Активные за {arg} дн."
+    if segment == "category":
+        return f"Покупавшие в категории «{category_name or arg}»"
+    return SEGMENT_TITLES[segment]
+
+
+async def send_broadcast(bot: Bot, db: Database, broadcast_id: int, message: BroadcastMessage, total: int,
+                         progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+                         progress_interval: float = 5.0, batch_size: int = 100,
+                         delay: float = 0.05) -> Optional[dict]:
+    """
+    Отправка рассылки по сохраненному списку получателей
+
+    Получатели читаются страницами по batch_size, итоги страницы
+    записываются одной транзакцией. Ответ 403 (бот заблокирован)
+    отмечает пользователя, и следующие рассылки его не выбирают.
+    При отмене (остановка бота) итоги записываются, а рассылка получает
+    статус interrupted; неотправленные получатели остаются pending.
+
+    Args:
+        progress: Корутина progress(обработано, всего), вызывается не чаще
+            раза в progress_interval секунд
+        delay: Пауза между сообщениями, сек
+
+    Returns:
+        Итоговая запись рассылки: total, sent, failed, blocked
+    """
+    done = 0
+    last_user_id = 0
+    reported = time.monotonic()
+    results = {}
+    try:
+        while recipients := await db.get_broadcast_recipients(broadcast_id, last_user_id, batch_size):
+            for user_id in recipients:
+                try:
+                    await message.send(bot, user_id)
+                    results[user_id] = "sent"
+                except TelegramForbiddenError:
+                    results[user_id] = "blocked"
+                except Exception as e:
+                    logger.debug("Рассылка #%s: не отправлено пользователю %s: %r", broadcast_id, user_id, e)
+                    results[user_id] = "failed"
+                await asyncio.sleep(delay)
+            await db.record_broadcast_results(broadcast_id, results)
+            results = {}
+
+            done += len(recipients)
+            last_user_id = recipients[-1]
+            if progress and time.monotonic() - reported >= progress_interval:
+                reported = time.monotonic()
+                await progress(done, total)
+    except asyncio.CancelledError:
+        if results:
+            await db.record_broadcast_results(broadcast_id, results)
+        await db.finish_broadcast(broadcast_id, status="interrupted")
+        logger.warning("Рассылка #%s прервана остановкой бота", broadcast_id)
+        raise
+
+    return await db.finish_broadcast(broadcast_id)
@@ -19,6 +19,66 @@ class BotConfig:
     
     # База данных
     database_path: str = "data/shop.db"
+    
+    # Сжатие данных товарных позиций: "none", "zlib" или "zstd" (пакет zstandard)
+    payload_compression: str = "none"
+    
+    # Шифрование данных товарных позиций: мастер-ключ (32 байта в base64, пусто — выключено)
+    # и сколько развернутых ключей данных товаров держать в памяти
+    payload_master_key: Optional[str] = None
+    payload_key_cache: int = 1024
+    
+    # Архив проданных позиций и старых заказов (отдельный файл базы)
+    archive_path: str = "data/archive.db"
+    archive_after_days: int = 90  # 0 — архивирование выключено
+    
+    # Каталог файлов выгрузок (файл удаляется после отправки администратору)
+    export_dir: str = "data/exports"
+    
+    # Резервные копии базы (снимки по расписанию cron, пустое — выключено)
+    backup_dir: str = "data/backups"
+    backup_keep: int = 7
+    backup_cron: str = "0 3 * * *"
+    
+    # Хранилище FSM: "sqlite" (в базе данных) или "memory"
+    fsm_storage: str = "sqlite"
+    fsm_ttl: int = 86400  # Время жизни брошенных диалогов (сек)
+    
+    # Уведомления администраторов об остатках: пороги (пусто — выключено) и задержка
+    # отправки, чтобы серия покупок дала одно сообщение (сек)
+    stock_alert_thresholds: tuple = (10, 3, 0)
+    stock_alert_debounce: float = 60.0
+    hide_out_of_stock: bool = False  # Скрывать закончившиеся товары из каталога до пополнения
+    
+    # Бронирование товара на время оформления покупки (сек)
+    reservation_ttl: int = 300
+    max_purchase_quantity: int = 100  # Максимум позиций в одной покупке
+    
+    # Пополнение баланса
+    payment_provider: Optional[str] = None  # None — пополнение отключено, "fake" — тестовый провайдер
+    payment_poll_interval: float = 10.0  # Интервал проверки ожидающих платежей (сек)
+    payment_ttl: int = 3600  # Время жизни неоплаченного счета (сек)
+    payment_max_amount: float = 100000.0  # Максимальная сумма одного пополнения (руб.)
+    fake_payment_autocomplete: Optional[float] = None  # Автооплата счетов тестового провайдера (сек)
+    
+    # Максимальное время дообработки обновлений при остановке (сек)
+    shutdown_timeout: float = 30.0
+    
+    # Логирование
+    log_level: str = "INFO"
+    log_format: str = "json"  # "json" или "text"
+    log_sample_rate: float = 0.1  # Доля записываемых событий просмотра каталога
+    
+    # Bot API: свой сервер (например, локальный), пул соединений, повторы после 429
+    bot_api_url: Optional[str] = None
+    bot_api_pool_limit: int = 200
+    bot_api_keepalive: float = 30.0
+    bot_api_retry_max: int = 3
+    
+    # Трассировка: медленные обновления пишутся в файл в формате Zipkin JSON
+    trace_enabled: bool = False
+    trace_slow_ms: float = 500.0
+    trace_file: str = "data/traces.jsonl"
 
 
 def load_config() -> BotConfig:
@@ -35,5 +95,42 @@ def load_config() -> BotConfig:
         channel_url=os.getenv("CHANNEL_URL"),
         check_subscription=os.getenv("CHECK_SUBSCRIPTION", "false").lower() == "true",
         database_path=os.getenv("DATABASE_PATH", "data/shop.db"),
+        payload_compression=os.getenv("PAYLOAD_COMPRESSION", "none").lower(),
+        payload_master_key=os.getenv("PAYLOAD_MASTER_KEY") or None,
+        payload_key_cache=int(os.getenv("PAYLOAD_KEY_CACHE", "1024")),
+        archive_path=os.getenv("ARCHIVE_PATH", "data/archive.db"),
+        archive_after_days=int(os.getenv("ARCHIVE_AFTER_DAYS", "90")),
+        export_dir=os.getenv("EXPORT_DIR", "data/exports"),
+        backup_dir=os.getenv("BACKUP_DIR", "data/backups"),
+        backup_keep=int(os.getenv("BACKUP_KEEP", "7")),
+        backup_cron=os.getenv("BACKUP_CRON", "0 3 * * *"),
+        fsm_storage=os.getenv("FSM_STORAGE", "sqlite").lower(),
+        fsm_ttl=int(os.getenv("FSM_TTL", "86400")),
+        stock_alert_thresholds=tuple(
+            int(value) for value in os.getenv("STOCK_ALERT_THRESHOLDS", "10,3,0").split(",") if value.strip()
+        ),
+        stock_alert_debounce=float(os.getenv("STOCK_ALERT_DEBOUNCE", "60")),
+        hide_out_of_stock=os.getenv("HIDE_OUT_OF_STOCK", "false").lower() == "true",
+        reservation_ttl=int(os.getenv("RESERVATION_TTL", "300")),
+        max_purchase_quantity=int(os.getenv("MAX_PURCHASE_QUANTITY", "100")),
+        payment_provider=os.getenv("PAYMENT_PROVIDER") or None,
+        payment_poll_interval=float(os.getenv("PAYMENT_POLL_INTERVAL", "10")),
+        payment_ttl=int(os.getenv("PAYMENT_TTL", "3600")),
+        payment_max_amount=float(os.getenv("PAYMENT_MAX_AMOUNT", "100000")),
+        fake_payment_autocomplete=(
+            float(os.getenv("FAKE_PAYMENT_AUTOCOMPLETE"))
+            if os.getenv("FAKE_PAYMENT_AUTOCOMPLETE") else None
+        ),
+        shutdown_timeout=float(os.getenv("SHUTDOWN_TIMEOUT", "30")),
+        log_level=os.getenv("LOG_LEVEL", "INFO"),
+        log_format=os.getenv("LOG_FORMAT", "json").lower(),
+        log_sample_rate=float(os.getenv("LOG_SAMPLE_RATE", "0.1")),
+        bot_api_url=os.getenv("BOT_API_URL") or None,
+        bot_api_pool_limit=int(os.getenv("BOT_API_POOL_LIMIT", "200")),
+        bot_api_keepalive=float(os.getenv("BOT_API_KEEPALIVE", "30")),
+        bot_api_retry_max=int(os.getenv("BOT_API_RETRY_MAX", "3")),
+        trace_enabled=os.getenv("TRACE_ENABLED", "false").lower() == "true",
+        trace_slow_ms=float(os.getenv("TRACE_SLOW_MS", "500")),
+        trace_file=os.getenv("TRACE_FILE", "data/traces.jsonl"),
     )
 
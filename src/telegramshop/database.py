@@ -2,113 +2,703 @@
 Модуль для работы с базой данных
 """
 import aiosqlite
+import itertools
+import logging
+import os
 from datetime import datetime
-from typing import Optional
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
 
+from . import encryption, payload
+from .tracing import trace_methods
 
+
+logger = logging.getLogger(__name__)
+
+# Подписчик на изменения остатков: {product_id: новый stock_count}
+StockListener = Callable[[Dict[int, int]], Awaitable[None]]
+
+
+# Версия схемы базы данных (PRAGMA user_version), увеличивается при каждом изменении схемы
+SCHEMA_VERSION = 9
+
+# Сколько соединение ждет освобождения блокировки записи, прежде чем
+# вернуть "database is locked" (сек). Каждый метод открывает свое
+# соединение, поэтому при всплеске обновлений писатели стоят в очереди
+BUSY_TIMEOUT = 30.0
+
+
+def connect(db_path: str, **kwargs) -> aiosqlite.Connection:
+    """Соединение с базой с ожиданием блокировки BUSY_TIMEOUT секунд"""
+    return aiosqlite.connect(db_path, timeout=BUSY_TIMEOUT, **kwargs)
+
+
+# Таблицы (все выражения идемпотентны, скрипт выполняется одной транзакцией).
+# auto_vacuum действует только для новой базы: существующую переводит
+# в этот режим VACUUM (telegramshop archive --vacuum). Журнал WAL
+# сохраняется в файле базы: чтение не блокирует запись и наоборот
+SCHEMA_TABLES = """
+PRAGMA auto_vacuum = INCREMENTAL;
+PRAGMA journal_mode = WAL;
+
+BEGIN;
+
+-- Таблица пользователей
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    balance REAL DEFAULT 0,
+    purchases_count INTEGER DEFAULT 0,
+    is_blocked BOOLEAN DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_active_at TIMESTAMP,
+    bot_blocked_at TIMESTAMP
+);
+
+-- Таблица заказов
+CREATE TABLE IF NOT EXISTS orders (
+    order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    product_name TEXT,
+    amount REAL,
+    status TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    product_id INTEGER,
+    quantity INTEGER DEFAULT 1,
+    FOREIGN KEY (user_id) REFERENCES users (user_id)
+);
+
+-- Таблица пополнений
+CREATE TABLE IF NOT EXISTS payments (
+    payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    amount REAL,
+    status TEXT,
+    payment_method TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    external_id TEXT,
+    completed_at TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (user_id)
+);
+
+-- Таблица настроек
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- Таблица категорий
+CREATE TABLE IF NOT EXISTS categories (
+    category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    description TEXT,
+    is_active BOOLEAN DEFAULT 1,
+    position INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Таблица товаров
+CREATE TABLE IF NOT EXISTS products (
+    product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    category_id INTEGER,
+    name TEXT NOT NULL,
+    description TEXT,
+    price REAL NOT NULL,
+    stock_count INTEGER DEFAULT 0,
+    is_active BOOLEAN DEFAULT 1,
+    position INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (category_id) REFERENCES categories (category_id)
+);
+
+-- Таблица товарных позиций (данные для выдачи)
+CREATE TABLE IF NOT EXISTS product_items (
+    item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER,
+    data TEXT NOT NULL,
+    is_sold BOOLEAN DEFAULT 0,
+    sold_to_user_id INTEGER,
+    sold_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    reserved_by INTEGER,
+    reserved_until TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products (product_id)
+);
+
+-- Журнал изменений баланса (только добавление записей)
+CREATE TABLE IF NOT EXISTS balance_ledger (
+    entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    balance_after REAL NOT NULL,
+    reason TEXT NOT NULL,
+    reference_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (user_id)
+);
+
+-- Состояния FSM (диалоги админки переживают перезапуск)
+CREATE TABLE IF NOT EXISTS fsm_states (
+    storage_key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Словари сжатия данных товарных позиций (не изменяются после создания)
+CREATE TABLE IF NOT EXISTS payload_dicts (
+    dict_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER,
+    codec TEXT NOT NULL,
+    data BLOB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Ключи данных товаров, обернутые мастер-ключом (не изменяются после создания)
+CREATE TABLE IF NOT EXISTS data_keys (
+    key_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    wrapped BLOB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Продажи и просмотры товаров по часам, дням и неделям
+-- (обновляются в транзакции покупки, аналитика не читает orders)
+CREATE TABLE IF NOT EXISTS sales_rollup (
+    granularity TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    category_id INTEGER,
+    orders INTEGER NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    views INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket, product_id)
+) WITHOUT ROWID;
+
+-- Рассылки и их получатели (аудитория сегмента фиксируется при запуске)
+CREATE TABLE IF NOT EXISTS broadcasts (
+    broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    segment TEXT NOT NULL,
+    segment_arg TEXT,
+    text TEXT,
+    content_type TEXT DEFAULT 'text',
+    source_chat_id INTEGER,
+    source_message_id INTEGER,
+    buttons TEXT,
+    status TEXT DEFAULT 'sending',
+    total INTEGER DEFAULT 0,
+    sent INTEGER DEFAULT 0,
+    failed INTEGER DEFAULT 0,
+    blocked INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    broadcast_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    PRIMARY KEY (broadcast_id, user_id)
+) WITHOUT ROWID;
+
+-- Отложенные задачи планировщика (переживают перезапуск)
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    payload TEXT,
+    run_at REAL NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMIT;
+"""
+
+# Колонки, добавленные в существующие таблицы после первых версий: (таблица, колонка, определение)
+SCHEMA_ADDED_COLUMNS = [
+    ("payments", "external_id", "TEXT"),
+    ("payments", "completed_at", "TIMESTAMP"),
+    ("orders", "product_id", "INTEGER"),
+    ("orders", "quantity", "INTEGER DEFAULT 1"),
+    ("product_items", "reserved_by", "INTEGER"),
+    ("product_items", "reserved_until", "TIMESTAMP"),
+    ("users", "last_active_at", "TIMESTAMP"),
+    ("users", "bot_blocked_at", "TIMESTAMP"),
+    ("broadcasts", "content_type", "TEXT DEFAULT 'text'"),
+    ("broadcasts", "source_chat_id", "INTEGER"),
+    ("broadcasts", "source_message_id", "INTEGER"),
+    ("broadcasts", "buttons", "TEXT"),
+]
+
+# Начало периода сводки продаж (UTC, как CURRENT_TIMESTAMP) от момента {ts};
+# неделя начинается с понедельника
+SALES_BUCKETS = {
+    "hour": "strftime('%Y-%m-%d %H:00', {ts})",
+    "day": "date({ts})",
+    "week": "date({ts}, 'weekday 0', '-6 days')",
+}
+
+# Периоды сводки, в которые попадает текущий момент
+_SALES_NOW = "\n    UNION ALL ".join(
+    f"SELECT '{name}' AS granularity, {expr.format(ts=repr('now'))} AS bucket"
+    for name, expr in SALES_BUCKETS.items()
+)
+
+# Учет покупки во всех периодах сводки (в транзакции покупки)
+SALES_ROLLUP_UPSERT = f"""
+INSERT INTO sales_rollup (granularity, bucket, product_id, category_id, orders, units, revenue)
+SELECT granularity, bucket, :product_id, :category_id, 1, :units, :revenue FROM (
+    {_SALES_NOW}
+) WHERE true
+ON CONFLICT (granularity, bucket, product_id) DO UPDATE SET
+    orders = orders + excluded.orders,
+    units = units + excluded.units,
+    revenue = revenue + excluded.revenue
+"""
+
+# Учет просмотров карточки товара
+SALES_VIEWS_UPSERT = f"""
+INSERT INTO sales_rollup (granularity, bucket, product_id, category_id, views)
+SELECT b.granularity, b.bucket, p.product_id, p.category_id, :views FROM (
+    {_SALES_NOW}
+) b JOIN products p ON p.product_id = :product_id
+WHERE true
+ON CONFLICT (granularity, bucket, product_id) DO UPDATE SET
+    views = views + excluded.views
+"""
+
+# Окно отчета по сводке: начало первого периода (аргументы функции даты)
+SALES_WINDOWS = {
+    "hour": "'now', '-23 hours'",
+    "day": "'now', '-29 days'",
+    "week": "'now', '-77 days'",
+}
+
+# Сводка продаж по уже накопленным заказам (только если сводка пуста)
+SALES_ROLLUP_BACKFILL = """
+INSERT INTO sales_rollup (granularity, bucket, product_id, category_id, orders, units, revenue)
+SELECT * FROM ({selects}
+) WHERE NOT EXISTS (SELECT 1 FROM sales_rollup);
+""".format(selects="\n    UNION ALL".join(
+    f"""
+    SELECT '{name}', {expr.format(ts='o.created_at')} AS bucket, o.product_id, p.category_id,
+           COUNT(*), SUM(o.quantity), SUM(o.amount)
+    FROM orders o LEFT JOIN products p ON p.product_id = o.product_id
+    WHERE o.status = 'completed' AND o.product_id IS NOT NULL AND o.created_at IS NOT NULL
+    GROUP BY bucket, o.product_id"""
+    for name, expr in SALES_BUCKETS.items()
+))
+
+# Индексы и перенос данных; версия схемы записывается в той же транзакции
+SCHEMA_INDEXES = f"""
+BEGIN;
+
+-- Выписки по пользователю и сверка балансов
+CREATE INDEX IF NOT EXISTS idx_balance_ledger_user
+ON balance_ledger (user_id, entry_id);
+
+-- Фоновая обработка платежей
+CREATE INDEX IF NOT EXISTS idx_payments_status_created
+ON payments (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_payments_external
+ON payments (payment_method, external_id);
+
+-- Выборка непроданных позиций и работа с бронями
+CREATE INDEX IF NOT EXISTS idx_product_items_product_unsold
+ON product_items (product_id, is_sold);
+CREATE INDEX IF NOT EXISTS idx_product_items_reserved_until
+ON product_items (reserved_until) WHERE reserved_until IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_product_items_reserved_by
+ON product_items (product_id, reserved_by) WHERE reserved_by IS NOT NULL;
+
+-- Повторная выдача купленных позиций
+CREATE INDEX IF NOT EXISTS idx_product_items_sold_to
+ON product_items (sold_to_user_id, item_id) WHERE sold_to_user_id IS NOT NULL;
+
+-- Выборка кандидатов на перенос в архив
+CREATE INDEX IF NOT EXISTS idx_product_items_sold_at
+ON product_items (sold_at) WHERE is_sold = 1;
+CREATE INDEX IF NOT EXISTS idx_orders_created
+ON orders (created_at);
+
+-- История заказов пользователя (та же форма, что и в архиве)
+CREATE INDEX IF NOT EXISTS idx_orders_user
+ON orders (user_id, created_at);
+
+-- Сегменты рассылок (см. BROADCAST_SEGMENTS)
+CREATE INDEX IF NOT EXISTS idx_orders_product_user
+ON orders (product_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_users_last_active
+ON users (last_active_at);
+CREATE INDEX IF NOT EXISTS idx_users_buyers
+ON users (user_id) WHERE purchases_count > 0;
+CREATE INDEX IF NOT EXISTS idx_users_positive_balance
+ON users (user_id) WHERE balance > 0;
+
+-- Выгрузки за период (постранично по created_at)
+CREATE INDEX IF NOT EXISTS idx_users_created
+ON users (created_at);
+CREATE INDEX IF NOT EXISTS idx_payments_created
+ON payments (created_at);
+
+-- Ключ данных товара при загрузке позиций
+CREATE INDEX IF NOT EXISTS idx_data_keys_product
+ON data_keys (product_id, key_id);
+
+-- Очистка устаревших FSM-сессий
+CREATE INDEX IF NOT EXISTS idx_fsm_states_updated
+ON fsm_states (updated_at);
+
+-- Перенос уже существующих балансов в журнал одной начальной записью
+INSERT INTO balance_ledger (user_id, amount, balance_after, reason)
+SELECT user_id, balance, balance, 'opening' FROM users
+WHERE balance != 0
+  AND NOT EXISTS (
+      SELECT 1 FROM balance_ledger l WHERE l.user_id = users.user_id
+  );
+
+-- Сводка продаж по заказам, сделанным до ее появления
+{SALES_ROLLUP_BACKFILL}
+PRAGMA user_version = {SCHEMA_VERSION};
+
+COMMIT;
+"""
+
+# Заказы вместе с архивом (при подключенном архиве вместо main.orders)
+ORDERS_WITH_ARCHIVE = """(
+    SELECT user_id, product_id, amount, status FROM main.orders
+    UNION ALL
+    SELECT user_id, product_id, amount, status FROM archive.orders
+)"""
+
+# Условия отбора получателей рассылки по сегменту (users u, параметр :arg,
+# {orders} — заказы с архивом). Пользователи, заблокировавшие бота, исключаются всегда
+BROADCAST_SEGMENTS = {
+    "all": "1",
+    "notblocked": "u.is_blocked = 0",
+    "buyers": "u.purchases_count > 0",
+    "balance": "u.balance > 0",
+    "active": "u.last_active_at >= datetime('now', '-' || :arg || ' days')",
+    "category": """u.user_id IN (
+        SELECT o.user_id FROM products p
+        JOIN {orders} o ON o.product_id = p.product_id
+        WHERE p.category_id = :arg AND o.status = 'completed'
+    )""",
+}
+
+# Колонки архивируемых таблиц (одинаковые в основной базе и в архиве)
+ORDER_COLUMNS = "order_id, user_id, product_name, amount, status, created_at, product_id, quantity"
+ITEM_COLUMNS = (
+    "item_id, product_id, data, is_sold, sold_to_user_id, sold_at, created_at, reserved_by, reserved_until"
+)
+
+# Выгрузки для администратора: таблица -> (первичный ключ, колонки)
+EXPORT_TABLES = {
+    "orders": ("order_id", ORDER_COLUMNS),
+    "users": ("user_id", "user_id, username, first_name, balance, purchases_count, is_blocked, created_at"),
+    "payments": (
+        "payment_id",
+        "payment_id, user_id, amount, status, payment_method, external_id, created_at, completed_at"
+    ),
+}
+
+# Схема архива (база подключается как archive)
+ARCHIVE_SCHEMA = """
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS archive.orders (
+    order_id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    product_name TEXT,
+    amount REAL,
+    status TEXT,
+    created_at TIMESTAMP,
+    product_id INTEGER,
+    quantity INTEGER DEFAULT 1,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS archive.idx_archive_orders_user
+ON orders (user_id, created_at);
+CREATE INDEX IF NOT EXISTS archive.idx_archive_orders_created
+ON orders (created_at);
+CREATE INDEX IF NOT EXISTS archive.idx_archive_orders_product_user
+ON orders (product_id, user_id);
+
+CREATE TABLE IF NOT EXISTS archive.product_items (
+    item_id INTEGER PRIMARY KEY,
+    product_id INTEGER,
+    data TEXT NOT NULL,
+    is_sold BOOLEAN DEFAULT 1,
+    sold_to_user_id INTEGER,
+    sold_at TIMESTAMP,
+    created_at TIMESTAMP,
+    reserved_by INTEGER,
+    reserved_until TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS archive.idx_archive_items_sold_to
+ON product_items (sold_to_user_id, item_id);
+
+COMMIT;
+"""
+
+
+@trace_methods("db")
 class Database:
     """Класс для работы с базой данных"""
     
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, archive_path: Optional[str] = None, compression: str = "none",
+                 master_key: Optional[str] = None, key_cache_size: int = 1024):
         self.db_path = db_path
+        self.archive_path = archive_path
+        self.codec = payload.PayloadCodec(compression)
+        self._dictionaries = {}  # Словари сжатия по ID (неизменяемые, кэшируются навсегда)
+        # Шифрование позиций: развернутые ключи данных — в LRU-кэше шифра
+        self.cipher = encryption.PayloadCipher(master_key, key_cache_size) if master_key else None
+        self._product_keys = {}  # ID текущего ключа данных товара
+        self._stock_listeners: List[StockListener] = []
+    
+    def subscribe_stock(self, listener: StockListener):
+        """Подписка на изменения остатков (покупка, загрузка позиций, пересчет)"""
+        self._stock_listeners.append(listener)
+    
+    async def _emit_stock(self, changes: Dict[int, int]):
+        """Рассылка новых остатков подписчикам (после фиксации транзакции)"""
+        for listener in self._stock_listeners:
+            try:
+                await listener(changes)
+            except Exception:
+                logger.exception("Ошибка обработки изменения остатков")
         
     async def init_db(self):
-        """Инициализация базы данных"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Таблица пользователей
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    balance REAL DEFAULT 0,
-                    purchases_count INTEGER DEFAULT 0,
-                    is_blocked BOOLEAN DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Таблица заказов
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS orders (
-                    order_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    product_name TEXT,
-                    amount REAL,
-                    status TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            """)
-            
-            # Таблица пополнений
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS payments (
-                    payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    amount REAL,
-                    status TEXT,
-                    payment_method TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            """)
-            
-            # Таблица настроек
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )
-            """)
-            
-            # Таблица категорий
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS categories (
-                    category_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    is_active BOOLEAN DEFAULT 1,
-                    position INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Таблица товаров
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS products (
-                    product_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    category_id INTEGER,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    price REAL NOT NULL,
-                    stock_count INTEGER DEFAULT 0,
-                    is_active BOOLEAN DEFAULT 1,
-                    position INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (category_id) REFERENCES categories (category_id)
-                )
-            """)
+        """
+        Инициализация базы данных
+        
+        Если версия схемы (PRAGMA user_version) уже актуальна, проверки
+        пропускаются целиком: холодный старт стоит одного запроса.
+        Иначе схема создается пакетными скриптами, старые базы дополняются
+        недостающими колонками, а версия записывается в конце.
+        """
+        async with connect(self.db_path) as db:
+            async with db.execute("PRAGMA user_version") as cursor:
+                version = (await cursor.fetchone())[0]
+            if version >= SCHEMA_VERSION:
+                return
             
-            # Таблица товарных позиций (данные для выдачи)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS product_items (
-                    item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    product_id INTEGER,
-                    data TEXT NOT NULL,
-                    is_sold BOOLEAN DEFAULT 0,
-                    sold_to_user_id INTEGER,
-                    sold_at TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (product_id) REFERENCES products (product_id)
-                )
-            """)
+            await db.executescript(SCHEMA_TABLES)
             
+            # Миграция баз, созданных до появления этих колонок
+            for table, column, definition in SCHEMA_ADDED_COLUMNS:
+                await self._add_column_if_missing(db, table, column, definition)
             await db.commit()
+            
+            await db.executescript(SCHEMA_INDEXES)
+    
+    async def close(self):
+        """
+        Завершение работы с базой (вызывается последним при остановке)
+        
+        Соединения открываются на время каждого метода, поэтому держать
+        открытым нечего; обновляем статистику планировщика запросов.
+        """
+        async with connect(self.db_path) as db:
+            await db.execute("PRAGMA optimize")
+    
+    async def _attach_archive(self, db: aiosqlite.Connection) -> bool:
+        """
+        Подключение архива только для чтения (для истории покупок и заказов)
+        
+        Соединение должно быть открыто с uri=True. Возвращает False, если
+        архива нет.
+        """
+        if not self.archive_path or not os.path.exists(self.archive_path):
+            return False
+        uri = Path(self.archive_path).resolve().as_uri() + "?mode=ro"
+        await db.execute("ATTACH DATABASE ? AS archive", (uri,))
+        return True
+    
+    async def _load_dictionaries(self, db: aiosqlite.Connection, values):
+        """Подгрузка словарей сжатия, нужных для распаковки values"""
+        missing = payload.dictionary_ids(values) - self._dictionaries.keys()
+        if missing:
+            placeholders = ", ".join("?" * len(missing))
+            async with db.execute(
+                f"SELECT dict_id, data FROM main.payload_dicts WHERE dict_id IN ({placeholders})",
+                tuple(missing)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            self._dictionaries.update(await self._open_dictionaries(db, rows))
+    
+    async def _open_dictionaries(self, db: aiosqlite.Connection, rows) -> Dict[int, bytes]:
+        """Словари из строк (dict_id, data) payload_dicts; зашифрованные расшифровываются ключом товара"""
+        key_ids = encryption.key_ids([data for _, data in rows])
+        if not key_ids:
+            return dict(rows)
+        if self.cipher is None:
+            raise encryption.EncryptionError("Словари сжатия зашифрованы: задайте PAYLOAD_MASTER_KEY")
+        keys, missing = self.cipher.lookup(key_ids)
+        if missing:
+            keys.update(await self._load_keys(db, missing))
+        return {
+            dict_id: self.cipher.decrypt_dictionary(data, keys) if encryption.is_encrypted(data) else data
+            for dict_id, data in rows
+        }
+    
+    async def _decode_items(self, db: aiosqlite.Connection, items: list):
+        """
+        Распаковка поля data у строк товарных позиций (словари подгружаются по мере надобности)
+        
+        Зашифрованные позиции остаются как есть до выдачи (см. reveal_items).
+        """
+        await self._load_dictionaries(db, [item['data'] for item in items])
+        for item in items:
+            if not encryption.is_encrypted(item['data']):
+                item['data'] = payload.decode(item['data'], self._dictionaries)
+        return items
+    
+    async def _load_keys(self, db: aiosqlite.Connection, key_ids) -> dict:
+        """Разворачивание ключей данных из базы (попадают в кэш шифра)"""
+        placeholders = ", ".join("?" * len(key_ids))
+        async with db.execute(
+            f"SELECT key_id, wrapped FROM main.data_keys WHERE key_id IN ({placeholders})",
+            tuple(key_ids)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        if len(rows) < len(key_ids):
+            raise encryption.EncryptionError(f"Нет ключей данных: {sorted(set(key_ids) - {row[0] for row in rows})}")
+        return {row[0]: self.cipher.remember(row[0], self.cipher.unwrap(row[1])) for row in rows}
+    
+    async def _product_key(self, db: aiosqlite.Connection, product_id: int, created: dict):
+        """
+        Ключ данных товара: (key_id, ключ)
+        
+        Новый ключ вставляется в транзакции вызывающего без фиксации и
+        записывается в created; в кэши он попадает только после фиксации
+        (_remember_created), чтобы ID откаченного ключа не остался в кэше.
+        """
+        if product_id in created['keys']:
+            key_id, key = created['keys'][product_id]
+            return key_id, self.cipher.data_key(key)
+        
+        key_id = self._product_keys.get(product_id)
+        if key_id is None:
+            async with db.execute("""
+                SELECT key_id FROM data_keys WHERE product_id = ?
+                ORDER BY key_id DESC LIMIT 1
+            """, (product_id,)) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                key, wrapped = self.cipher.new_data_key()
+                cursor = await db.execute("""
+                    INSERT INTO data_keys (product_id, wrapped) VALUES (?, ?)
+                """, (product_id, wrapped))
+                created['keys'][product_id] = (cursor.lastrowid, key)
+                return cursor.lastrowid, self.cipher.data_key(key)
+            key_id = self._product_keys[product_id] = row[0]
+        
+        keys, missing = self.cipher.lookup([key_id])
+        if missing:
+            keys = await self._load_keys(db, missing)
+        return key_id, keys[key_id]
+    
+    def _remember_created(self, created: dict):
+        """Кэширование ключей и словарей, созданных транзакцией (после ее фиксации)"""
+        for product_id, (key_id, key) in created['keys'].items():
+            self._product_keys[product_id] = key_id
+            self.cipher.remember(key_id, key)
+        self._dictionaries.update(created['dicts'])
+    
+    async def _encode_items(self, db: aiosqlite.Connection, product_id: int, items: list, created: dict) -> list:
+        """
+        Сжатие и шифрование данных позиций товара
+        
+        Используется последний словарь товара; если его нет и образцов
+        достаточно, словарь обучается по этим позициям и сохраняется.
+        Сжатые данные затем шифруются ключом данных товара. Новые словари
+        и ключи вставляются в транзакции вызывающего и собираются в created
+        ({'keys': {}, 'dicts': {}}): после фиксации вызывающий передает его
+        в _remember_created.
+        """
+        values = await self._compress_items(db, product_id, items, created)
+        if self.cipher is None:
+            return values
+        key_id, key = await self._product_key(db, product_id, created)
+        return [self.cipher.encrypt(key_id, key, value) for value in values]
+    
+    async def _compress_items(self, db: aiosqlite.Connection, product_id: int, items: list, created: dict) -> list:
+        if not self.codec.enabled:
+            return items
+        
+        async with db.execute("""
+            SELECT dict_id, data FROM payload_dicts
+            WHERE product_id = ? AND codec = ?
+            ORDER BY dict_id DESC LIMIT 1
+        """, (product_id, self.codec.algorithm)) as cursor:
+            row = await cursor.fetchone()
+        
+        dict_id, dictionary = 0, None
+        if row and row[0] in created['dicts']:
+            # Словарь, обученный предыдущей пачкой этой же загрузки
+            dict_id, dictionary = row[0], created['dicts'][row[0]]
+        elif row:
+            dict_id, dictionary = row[0], (await self._open_dictionaries(db, [row]))[row[0]]
+            if self.cipher is not None and not encryption.is_encrypted(row[1]):
+                # Словарь, сохраненный до включения шифрования
+                await db.execute("""
+                    UPDATE payload_dicts SET data = ? WHERE dict_id = ?
+                """, (await self._seal_dictionary(db, product_id, dictionary, created), dict_id))
+        if dictionary is None and len(items) >= payload.MIN_TRAIN_SAMPLES:
+            dictionary = self.codec.train(items[:1000])
+            cursor = await db.execute("""
+                INSERT INTO payload_dicts (product_id, codec, data) VALUES (?, ?, ?)
+            """, (product_id, self.codec.algorithm, await self._seal_dictionary(db, product_id, dictionary, created)))
+            dict_id = cursor.lastrowid
+            created['dicts'][dict_id] = dictionary
+        elif dictionary is not None and dict_id not in created['dicts']:
+            self._dictionaries[dict_id] = dictionary
+        
+        return [self.codec.encode(item, dict_id, dictionary) for item in items]
+    
+    async def _seal_dictionary(self, db: aiosqlite.Connection, product_id: int, dictionary: bytes,
+                               created: dict) -> bytes:
+        """
+        Словарь для записи в payload_dicts
+        
+        Словарь собран из самих позиций, поэтому при включенном шифровании
+        он шифруется ключом данных товара, как и позиции.
+        """
+        if self.cipher is None:
+            return dictionary
+        key_id, key = await self._product_key(db, product_id, created)
+        return self.cipher.encrypt_dictionary(key_id, key, dictionary)
+    
+    @staticmethod
+    async def _add_column_if_missing(db: aiosqlite.Connection, table: str, column: str, definition: str):
+        """Добавление колонки в существующую таблицу (миграция старых баз)"""
+        async with db.execute(f"PRAGMA table_info({table})") as cursor:
+            columns = [row[1] for row in await cursor.fetchall()]
+        if column not in columns:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
+    @staticmethod
+    async def _apply_balance_change(db: aiosqlite.Connection, user_id: int, amount: float, reason: str,
+                                    reference_id: Optional[int] = None) -> bool:
+        """Изменение баланса с записью в журнал внутри уже открытой транзакции"""
+        cursor = await db.execute("""
+            UPDATE users SET balance = balance + ? WHERE user_id = ?
+        """, (amount, user_id))
+        if not cursor.rowcount:
+            return False
+        await db.execute("""
+            INSERT INTO balance_ledger (user_id, amount, balance_after, reason, reference_id)
+            SELECT user_id, ?, balance, ?, ? FROM users WHERE user_id = ?
+        """, (amount, reason, reference_id, user_id))
+        return True
     
     async def add_user(self, user_id: int, username: Optional[str], first_name: str):
         """Добавление нового пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             await db.execute("""
                 INSERT OR IGNORE INTO users (user_id, username, first_name)
                 VALUES (?, ?, ?)
@@ -117,7 +707,7 @@ class Database:
     
     async def get_user(self, user_id: int):
         """Получение информации о пользователе"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM users WHERE user_id = ?
@@ -125,17 +715,69 @@ class Database:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
     
-    async def update_user_balance(self, user_id: int, amount: float):
-        """Обновление баланса пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                UPDATE users SET balance = balance + ? WHERE user_id = ?
-            """, (amount, user_id))
+    async def update_user_balance(self, user_id: int, amount: float, reason: str = "adjustment",
+                                  reference_id: Optional[int] = None):
+        """
+        Обновление баланса пользователя
+        
+        Изменение баланса и запись в журнал выполняются в одной транзакции.
+        
+        Args:
+            user_id: ID пользователя
+            amount: Сумма изменения (отрицательная для списания)
+            reason: Причина изменения (purchase, admin, payment, adjustment)
+            reference_id: ID связанного объекта (заказа, платежа, администратора)
+        """
+        async with connect(self.db_path) as db:
+            await self._apply_balance_change(db, user_id, amount, reason, reference_id)
             await db.commit()
     
+    async def get_balance_ledger(self, user_id: int, limit: int = 20, before_entry_id: Optional[int] = None):
+        """Получение выписки по балансу пользователя (от новых записей к старым)"""
+        async with connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            query = "SELECT * FROM balance_ledger WHERE user_id = ?"
+            params = [user_id]
+            if before_entry_id is not None:
+                query += " AND entry_id < ?"
+                params.append(before_entry_id)
+            query += " ORDER BY entry_id DESC LIMIT ?"
+            params.append(limit)
+            
+            async with db.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+    
+    async def verify_balances(self, tolerance: float = 0.005):
+        """
+        Сверка кэшированных балансов с журналом
+        
+        Пересчитывает суммы по журналу для всех пользователей одним запросом.
+        
+        Returns:
+            Список расхождений: user_id, balance, ledger_total, drift
+        """
+        async with connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("""
+                SELECT u.user_id, u.balance,
+                       COALESCE(l.total, 0) AS ledger_total,
+                       u.balance - COALESCE(l.total, 0) AS drift
+                FROM users u
+                LEFT JOIN (
+                    SELECT user_id, SUM(amount) AS total
+                    FROM balance_ledger
+                    GROUP BY user_id
+                ) l ON l.user_id = u.user_id
+                WHERE ABS(u.balance - COALESCE(l.total, 0)) > ?
+                ORDER BY ABS(u.balance - COALESCE(l.total, 0)) DESC
+            """, (tolerance,)) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+    
     async def increment_purchases(self, user_id: int):
         """Увеличение счетчика покупок"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             await db.execute("""
                 UPDATE users SET purchases_count = purchases_count + 1 WHERE user_id = ?
             """, (user_id,))
@@ -143,7 +785,7 @@ class Database:
     
     async def add_order(self, user_id: int, product_name: str, amount: float, status: str = "completed"):
         """Добавление заказа"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             await db.execute("""
                 INSERT INTO orders (user_id, product_name, amount, status)
                 VALUES (?, ?, ?, ?)
@@ -151,31 +793,152 @@ class Database:
             await db.commit()
     
     async def get_user_orders(self, user_id: int, limit: int = 10):
-        """Получение истории заказов пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        """Получение истории заказов пользователя (включая перенесенные в архив)"""
+        async with connect(self.db_path, uri=True) as db:
             db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM orders 
-                WHERE user_id = ? 
-                ORDER BY created_at DESC 
-                LIMIT ?
-            """, (user_id, limit)) as cursor:
+            if await self._attach_archive(db):
+                query = f"""
+                    SELECT {ORDER_COLUMNS} FROM main.orders WHERE user_id = ?
+                    UNION ALL
+                    SELECT {ORDER_COLUMNS} FROM archive.orders WHERE user_id = ?
+                    ORDER BY created_at DESC
+                    LIMIT ?
+                """
+                params = (user_id, user_id, limit)
+            else:
+                query = f"""
+                    SELECT {ORDER_COLUMNS} FROM orders 
+                    WHERE user_id = ? 
+                    ORDER BY created_at DESC 
+                    LIMIT ?
+                """
+                params = (user_id, limit)
+            
+            async with db.execute(query, params) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
     
-    async def add_payment(self, user_id: int, amount: float, payment_method: str, status: str = "pending"):
+    async def add_payment(self, user_id: int, amount: float, payment_method: str, status: str = "pending",
+                          external_id: Optional[str] = None):
         """Добавление записи о пополнении"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             cursor = await db.execute("""
-                INSERT INTO payments (user_id, amount, payment_method, status)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, amount, payment_method, status))
+                INSERT INTO payments (user_id, amount, payment_method, status, external_id)
+                VALUES (?, ?, ?, ?, ?)
+            """, (user_id, amount, payment_method, status, external_id))
             await db.commit()
             return cursor.lastrowid
     
+    async def get_payment(self, payment_id: int):
+        """Получение платежа по ID"""
+        async with connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("""
+                SELECT * FROM payments WHERE payment_id = ?
+            """, (payment_id,)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+    
+    async def get_payment_by_external_id(self, payment_method: str, external_id: str):
+        """Получение платежа по ID во внешней платежной системе"""
+        async with connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("""
+                SELECT * FROM payments WHERE payment_method = ? AND external_id = ?
+            """, (payment_method, external_id)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+    
+    async def set_payment_external_id(self, payment_id: int, external_id: str):
+        """Сохранение ID счета во внешней платежной системе"""
+        async with connect(self.db_path) as db:
+            await db.execute("""
+                UPDATE payments SET external_id = ? WHERE payment_id = ?
+            """, (external_id, payment_id))
+            await db.commit()
+    
+    async def get_pending_payments(self, limit: int = 100, after: Optional[tuple] = None):
+        """
+        Получение ожидающих оплаты платежей (от старых к новым)
+        
+        Args:
+            limit: Размер пачки
+            after: Пара (created_at, payment_id) последнего платежа предыдущей пачки
+        """
+        async with connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            query = "SELECT * FROM payments WHERE status = 'pending'"
+            params = []
+            if after is not None:
+                query += " AND (created_at, payment_id) > (?, ?)"
+                params.extend(after)
+            query += " ORDER BY created_at, payment_id LIMIT ?"
+            params.append(limit)
+            
+            async with db.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+    
+    async def complete_payment(self, payment_id: int):
+        """
+        Зачисление оплаченного платежа на баланс
+        
+        Смена статуса, изменение баланса и запись в журнал выполняются
+        в одной транзакции. Повторный вызов для того же платежа ничего не меняет.
+        
+        Returns:
+            Данные платежа, если он был зачислен этим вызовом, иначе None
+        """
+        async with connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("""
+                UPDATE payments SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+                WHERE payment_id = ? AND status = 'pending'
+            """, (payment_id,))
+            if not cursor.rowcount:
+                await db.rollback()
+                return None
+            
+            async with db.execute("""
+                SELECT * FROM payments WHERE payment_id = ?
+            """, (payment_id,)) as cursor:
+                payment = dict(await cursor.fetchone())
+            
+            await self._apply_balance_change(
+                db, payment['user_id'], payment['amount'], "payment", payment_id
+            )
+            await db.commit()
+            return payment
+    
+    async def cancel_stale_payments(self, max_age_seconds: int, payment_ids: Optional[Iterable[int]] = None) -> int:
+        """
+        Отмена платежей, не оплаченных за отведенное время
+        
+        Args:
+            payment_ids: Отменять только эти платежи (например, те, что провайдер
+                еще считает неоплаченными); None — все просроченные
+        """
+        query = """
+            UPDATE payments SET status = 'cancelled'
+            WHERE status = 'pending' AND created_at < datetime('now', ?)
+        """
+        params = [f"-{int(max_age_seconds)} seconds"]
+        if payment_ids is not None:
+            payment_ids = list(payment_ids)
+            if not payment_ids:
+                return 0
+            query += f" AND payment_id IN ({', '.join('?' * len(payment_ids))})"
+            params.extend(payment_ids)
+        
+        async with connect(self.db_path) as db:
+            cursor = await db.execute(query, params)
+            await db.commit()
+            return cursor.rowcount
+    
     async def get_user_payments(self, user_id: int, limit: int = 10):
         """Получение истории пополнений пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM payments 
@@ -186,17 +949,26 @@ class Database:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
     
-    async def update_payment_status(self, payment_id: int, status: str):
-        """Обновление статуса платежа"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                UPDATE payments SET status = ? WHERE payment_id = ?
-            """, (status, payment_id))
+    async def update_payment_status(self, payment_id: int, status: str, expected_status: Optional[str] = None):
+        """
+        Обновление статуса платежа
+        
+        Если указан expected_status, статус меняется только из этого состояния.
+        Зачисление средств выполняет complete_payment.
+        """
+        async with connect(self.db_path) as db:
+            query = "UPDATE payments SET status = ? WHERE payment_id = ?"
+            params = [status, payment_id]
+            if expected_status is not None:
+                query += " AND status = ?"
+                params.append(expected_status)
+            cursor = await db.execute(query, params)
             await db.commit()
+            return cursor.rowcount > 0
     
     async def get_setting(self, key: str) -> Optional[str]:
         """Получение настройки"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             async with db.execute("""
                 SELECT value FROM settings WHERE key = ?
             """, (key,)) as cursor:
@@ -205,7 +977,7 @@ class Database:
     
     async def set_setting(self, key: str, value: str):
         """Установка настройки"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             await db.execute("""
                 INSERT OR REPLACE INTO settings (key, value)
                 VALUES (?, ?)
@@ -216,7 +988,7 @@ class Database:
     
     async def get_active_categories(self):
         """Получение всех активных категорий"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM categories 
@@ -228,7 +1000,7 @@ class Database:
     
     async def get_category(self, category_id: int):
         """Получение категории по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM categories WHERE category_id = ?
@@ -238,7 +1010,7 @@ class Database:
     
     async def add_category(self, name: str, description: str = "", is_active: bool = True, position: int = 0):
         """Добавление новой категории"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             cursor = await db.execute("""
                 INSERT INTO categories (name, description, is_active, position)
                 VALUES (?, ?, ?, ?)
@@ -249,7 +1021,7 @@ class Database:
     async def update_category(self, category_id: int, name: str = None, description: str = None, 
                             is_active: bool = None, position: int = None):
         """Обновление категории"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             fields = []
             values = []
             
@@ -275,15 +1047,16 @@ class Database:
     
     async def delete_category(self, category_id: int):
         """Удаление категории"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             await db.execute("DELETE FROM categories WHERE category_id = ?", (category_id,))
             await db.commit()
     
     # Методы для работы с товарами
     
-    async def get_products_by_category(self, category_id: int, active_only: bool = True):
-        """Получение товаров по категории"""
-        async with aiosqlite.connect(self.db_path) as db:
+    async def get_products_by_category(self, category_id: int, active_only: bool = True,
+                                       in_stock_only: bool = False):
+        """Получение товаров по категории (in_stock_only — без закончившихся)"""
+        async with connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             query = """
                 SELECT * FROM products 
@@ -291,6 +1064,8 @@ class Database:
             """
             if active_only:
                 query += " AND is_active = 1"
+            if in_stock_only:
+                query += " AND stock_count > 0"
             query += " ORDER BY position ASC, name ASC"
             
             async with db.execute(query, (category_id,)) as cursor:
@@ -299,7 +1074,7 @@ class Database:
     
     async def get_product(self, product_id: int):
         """Получение товара по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM products WHERE product_id = ?
@@ -310,7 +1085,7 @@ class Database:
     async def add_product(self, category_id: int, name: str, description: str, price: float,
                          is_active: bool = True, position: int = 0):
         """Добавление нового товара"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             cursor = await db.execute("""
                 INSERT INTO products (category_id, name, description, price, is_active, position)
                 VALUES (?, ?, ?, ?, ?, ?)
@@ -320,7 +1095,7 @@ class Database:
     
     async def update_product(self, product_id: int, **kwargs):
         """Обновление товара"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             fields = []
             values = []
             
@@ -339,34 +1114,79 @@ class Database:
     
     async def delete_product(self, product_id: int):
         """Удаление товара"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             await db.execute("DELETE FROM products WHERE product_id = ?", (product_id,))
             await db.commit()
     
-    async def update_product_stock(self, product_id: int):
-        """Обновление количества товара в наличии"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+    async def update_product_stock(self, product_id: int) -> Optional[int]:
+        """Обновление количества товара в наличии. Возвращает новый остаток"""
+        async with connect(self.db_path) as db:
+            async with db.execute("""
                 UPDATE products 
                 SET stock_count = (
                     SELECT COUNT(*) FROM product_items 
                     WHERE product_id = ? AND is_sold = 0
                 )
                 WHERE product_id = ?
-            """, (product_id, product_id))
+                RETURNING stock_count
+            """, (product_id, product_id)) as cursor:
+                row = await cursor.fetchone()
             await db.commit()
+        
+        if row is None:
+            return None
+        await self._emit_stock({product_id: row[0]})
+        return row[0]
+    
+    async def get_stock_counts(self) -> Dict[int, int]:
+        """Остатки активных товаров: {product_id: stock_count}"""
+        async with connect(self.db_path) as db:
+            async with db.execute("""
+                SELECT product_id, stock_count FROM products WHERE is_active = 1
+            """) as cursor:
+                return dict(await cursor.fetchall())
+    
+    async def reconcile_stock(self) -> int:
+        """
+        Пересчет остатков всех товаров по непроданным позициям
+        
+        Returns:
+            Количество товаров, у которых остаток был исправлен
+        """
+        async with connect(self.db_path) as db:
+            async with db.execute("""
+                UPDATE products
+                SET stock_count = (
+                    SELECT COUNT(*) FROM product_items i
+                    WHERE i.product_id = products.product_id AND i.is_sold = 0
+                )
+                WHERE stock_count != (
+                    SELECT COUNT(*) FROM product_items i
+                    WHERE i.product_id = products.product_id AND i.is_sold = 0
+                )
+                RETURNING product_id, stock_count
+            """) as cursor:
+                changes = dict(await cursor.fetchall())
+            await db.commit()
+        
+        if changes:
+            await self._emit_stock(changes)
+        return len(changes)
     
     # Методы для работы с товарными позициями
     
     async def add_product_item(self, product_id: int, data: str):
         """Добавление товарной позиции"""
-        async with aiosqlite.connect(self.db_path) as db:
+        created = {'keys': {}, 'dicts': {}}
+        async with connect(self.db_path) as db:
+            data, = await self._encode_items(db, product_id, [data], created)
             cursor = await db.execute("""
                 INSERT INTO product_items (product_id, data)
                 VALUES (?, ?)
             """, (product_id, data))
             await db.commit()
             item_id = cursor.lastrowid
+        self._remember_created(created)
             
         # Обновляем количество товара
         await self.update_product_stock(product_id)
@@ -374,7 +1194,7 @@ class Database:
     
     async def get_available_product_item(self, product_id: int):
         """Получение доступной товарной позиции"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM product_items 
@@ -382,11 +1202,14 @@ class Database:
                 LIMIT 1
             """, (product_id,)) as cursor:
                 row = await cursor.fetchone()
-                return dict(row) if row else None
+            if not row:
+                return None
+            item, = await self._decode_items(db, [dict(row)])
+            return item
     
     async def mark_item_as_sold(self, item_id: int, user_id: int):
         """Отметить товар как проданный"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             await db.execute("""
                 UPDATE product_items 
                 SET is_sold = 1, sold_to_user_id = ?, sold_at = CURRENT_TIMESTAMP
@@ -394,11 +1217,276 @@ class Database:
             """, (user_id, item_id))
             await db.commit()
     
+    async def count_sold_items(self, user_id: int) -> int:
+        """Количество позиций, купленных пользователем (включая архив)"""
+        async with connect(self.db_path, uri=True) as db:
+            query = "SELECT COUNT(*) FROM main.product_items WHERE sold_to_user_id = ?"
+            params = [user_id]
+            if await self._attach_archive(db):
+                query = f"SELECT ({query}) + (SELECT COUNT(*) FROM archive.product_items WHERE sold_to_user_id = ?)"
+                params.append(user_id)
+            
+            async with db.execute(query, params) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
+    
+    async def iter_sold_items(self, user_id: int, batch_size: int = 500):
+        """
+        Постраничное чтение позиций, купленных пользователем
+        
+        Каждая страница читается отдельным коротким запросом по индексу
+        (sold_to_user_id, item_id), чтобы не держать транзакцию на время отправки.
+        Позиции из архива идут вместе с остальными в порядке item_id.
+        """
+        last_item_id = 0
+        while True:
+            async with connect(self.db_path, uri=True) as db:
+                db.row_factory = aiosqlite.Row
+                items = """
+                    SELECT item_id, product_id, data, sold_at FROM main.product_items
+                    WHERE sold_to_user_id = :user_id AND item_id > :after
+                """
+                if await self._attach_archive(db):
+                    items += """
+                        UNION ALL
+                        SELECT item_id, product_id, data, sold_at FROM archive.product_items
+                        WHERE sold_to_user_id = :user_id AND item_id > :after
+                    """
+                async with db.execute(f"""
+                    SELECT i.item_id, i.product_id, i.data, i.sold_at, p.name AS product_name
+                    FROM ({items}) i
+                    LEFT JOIN products p ON p.product_id = i.product_id
+                    ORDER BY i.item_id
+                    LIMIT :limit
+                """, {"user_id": user_id, "after": last_item_id, "limit": batch_size}) as cursor:
+                    rows = [dict(row) for row in await cursor.fetchall()]
+                await self._decode_items(db, rows)
+            
+            for row in rows:
+                yield row
+            
+            if len(rows) < batch_size:
+                break
+            last_item_id = rows[-1]['item_id']
+    
+    async def reveal_items(self, items: list) -> list:
+        """
+        Расшифровка данных позиций перед выдачей покупателю
+        
+        Ключи данных и словари берутся из кэша, база открывается только
+        при промахе. Незашифрованные позиции возвращаются как есть.
+        """
+        values = [item['data'] for item in items]
+        key_ids = encryption.key_ids(values)
+        if not key_ids:
+            return items
+        if self.cipher is None:
+            raise encryption.EncryptionError("Позиции зашифрованы: задайте PAYLOAD_MASTER_KEY")
+        
+        keys, missing = self.cipher.lookup(key_ids)
+        if missing:
+            async with connect(self.db_path) as db:
+                keys.update(await self._load_keys(db, missing))
+        values = [
+            self.cipher.decrypt(value, keys) if encryption.is_encrypted(value) else value
+            for value in values
+        ]
+        if payload.dictionary_ids(values) - self._dictionaries.keys():
+            async with connect(self.db_path) as db:
+                await self._load_dictionaries(db, values)
+        
+        for item, value in zip(items, values):
+            item['data'] = payload.decode(value, self._dictionaries)
+        return items
+    
+    # Методы для бронирования и покупки
+    
+    async def get_available_stock(self, product_id: int) -> int:
+        """Количество позиций, доступных для покупки (в наличии минус активные брони)"""
+        async with connect(self.db_path) as db:
+            async with db.execute("""
+                SELECT p.stock_count - (
+                    SELECT COUNT(*) FROM product_items i
+                    WHERE i.product_id = p.product_id
+                      AND i.reserved_by IS NOT NULL
+                      AND i.is_sold = 0
+                      AND i.reserved_until >= CURRENT_TIMESTAMP
+                )
+                FROM products p WHERE p.product_id = ?
+            """, (product_id,)) as cursor:
+                row = await cursor.fetchone()
+                return max(row[0], 0) if row else 0
+    
+    async def reserve_product_items(self, product_id: int, user_id: int, quantity: int = 1,
+                                    ttl_seconds: int = 300) -> int:
+        """
+        Бронирование товарных позиций для пользователя
+        
+        Прежняя бронь пользователя на этот товар заменяется новой: нужное
+        количество свободных позиций (или позиций с истекшей бронью)
+        захватывается одним запросом. Если свободных позиций не хватает,
+        ничего не меняется.
+        
+        Returns:
+            Количество забронированных позиций (quantity или 0)
+        """
+        async with connect(self.db_path) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.execute("""
+                UPDATE product_items SET reserved_by = NULL, reserved_until = NULL
+                WHERE product_id = ? AND reserved_by = ? AND is_sold = 0
+            """, (product_id, user_id))
+            
+            cursor = await db.execute("""
+                UPDATE product_items
+                SET reserved_by = ?, reserved_until = datetime('now', ?)
+                WHERE item_id IN (
+                    SELECT item_id FROM product_items
+                    WHERE product_id = ? AND is_sold = 0
+                      AND (reserved_by IS NULL OR reserved_until < CURRENT_TIMESTAMP)
+                    LIMIT ?
+                )
+            """, (user_id, f"+{int(ttl_seconds)} seconds", product_id, quantity))
+            
+            if cursor.rowcount < quantity:
+                await db.rollback()
+                return 0
+            
+            await db.commit()
+            return cursor.rowcount
+    
+    async def release_reservation(self, product_id: int, user_id: int):
+        """Снятие брони пользователя с товара"""
+        async with connect(self.db_path) as db:
+            await db.execute("""
+                UPDATE product_items SET reserved_by = NULL, reserved_until = NULL
+                WHERE product_id = ? AND reserved_by = ? AND is_sold = 0
+            """, (product_id, user_id))
+            await db.commit()
+    
+    async def release_expired_reservations(self, batch_size: int = 500) -> int:
+        """
+        Снятие пачки истекших броней
+        
+        Returns:
+            Количество освобожденных позиций (меньше batch_size — истекших больше нет)
+        """
+        async with connect(self.db_path) as db:
+            cursor = await db.execute("""
+                UPDATE product_items SET reserved_by = NULL, reserved_until = NULL
+                WHERE item_id IN (
+                    SELECT item_id FROM product_items
+                    WHERE reserved_until < CURRENT_TIMESTAMP
+                    LIMIT ?
+                )
+            """, (batch_size,))
+            await db.commit()
+            return cursor.rowcount
+    
+    async def complete_purchase(self, user_id: int, product_id: int):
+        """
+        Покупка всех забронированных пользователем позиций товара
+        
+        Отметка о продаже (одним запросом), одно списание средств, заказ
+        и пересчет остатка выполняются в одной транзакции.
+        
+        Returns:
+            Словарь с ключом status: ok, not_found, no_reservation или
+            insufficient_funds. Для ok также items, product, quantity, total,
+            order_id, new_balance
+        """
+        async with connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            await db.execute("BEGIN IMMEDIATE")
+            
+            async with db.execute("""
+                SELECT * FROM products WHERE product_id = ?
+            """, (product_id,)) as cursor:
+                product = await cursor.fetchone()
+            async with db.execute("""
+                SELECT balance FROM users WHERE user_id = ?
+            """, (user_id,)) as cursor:
+                user = await cursor.fetchone()
+            
+            if not product or not user:
+                await db.rollback()
+                return {'status': 'not_found'}
+            product = dict(product)
+            
+            async with db.execute("""
+                SELECT item_id, data FROM product_items
+                WHERE product_id = ? AND reserved_by = ? AND is_sold = 0
+                  AND reserved_until >= CURRENT_TIMESTAMP
+                ORDER BY item_id
+            """, (product_id, user_id)) as cursor:
+                items = [dict(row) for row in await cursor.fetchall()]
+            
+            if not items:
+                await db.rollback()
+                return {'status': 'no_reservation', 'product': product}
+            
+            quantity = len(items)
+            total = round(product['price'] * quantity, 2)
+            
+            if user['balance'] < total:
+                await db.rollback()
+                return {
+                    'status': 'insufficient_funds',
+                    'product': product,
+                    'quantity': quantity,
+                    'total': total,
+                    'balance': user['balance']
+                }
+            
+            await db.execute("""
+                UPDATE product_items
+                SET is_sold = 1, sold_to_user_id = ?, sold_at = CURRENT_TIMESTAMP,
+                    reserved_by = NULL, reserved_until = NULL
+                WHERE product_id = ? AND reserved_by = ? AND is_sold = 0
+                  AND reserved_until >= CURRENT_TIMESTAMP
+            """, (user_id, product_id, user_id))
+            
+            cursor = await db.execute("""
+                INSERT INTO orders (user_id, product_id, product_name, quantity, amount, status)
+                VALUES (?, ?, ?, ?, ?, 'completed')
+            """, (user_id, product_id, product['name'], quantity, total))
+            order_id = cursor.lastrowid
+            
+            await self._apply_balance_change(db, user_id, -total, "purchase", order_id)
+            await db.execute("""
+                UPDATE users SET purchases_count = purchases_count + 1 WHERE user_id = ?
+            """, (user_id,))
+            async with db.execute("""
+                UPDATE products SET stock_count = stock_count - ? WHERE product_id = ?
+                RETURNING stock_count
+            """, (quantity, product_id)) as cursor:
+                stock = (await cursor.fetchone())[0]
+            await db.execute(SALES_ROLLUP_UPSERT, {
+                'product_id': product_id,
+                'category_id': product['category_id'],
+                'units': quantity,
+                'revenue': total,
+            })
+            await db.commit()
+            
+            # Распаковка после фиксации транзакции, чтобы не держать блокировку
+            await self._decode_items(db, items)
+            await self._emit_stock({product_id: stock})
+            return {
+                'status': 'ok',
+                'items': items,
+                'product': product,
+                'quantity': quantity,
+                'total': total,
+                'order_id': order_id,
+                'new_balance': user['balance'] - total
+            }
+    
     # Методы для админки
     
     async def get_all_users(self, limit: int = 50, offset: int = 0):
         """Получение всех пользователей с пагинацией"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM users 
@@ -410,14 +1498,14 @@ class Database:
     
     async def get_users_count(self):
         """Получение общего количества пользователей"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             async with db.execute("SELECT COUNT(*) FROM users") as cursor:
                 row = await cursor.fetchone()
                 return row[0] if row else 0
     
     async def search_users(self, query: str):
         """Поиск пользователей по ID или username"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             
             # Проверяем, является ли query числом (поиск по ID)
@@ -438,26 +1526,26 @@ class Database:
     
     async def set_user_blocked(self, user_id: int, is_blocked: bool):
         """Блокировка/разблокировка пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             await db.execute("""
                 UPDATE users SET is_blocked = ? WHERE user_id = ?
             """, (is_blocked, user_id))
             await db.commit()
     
     async def get_statistics(self):
-        """Получение общей статистики"""
-        async with aiosqlite.connect(self.db_path) as db:
+        """Получение общей статистики (продажи и выручка — включая архив заказов)"""
+        async with connect(self.db_path, uri=True) as db:
             # Количество пользователей
             async with db.execute("SELECT COUNT(*) FROM users") as cursor:
                 users_count = (await cursor.fetchone())[0]
             
-            # Количество продаж
-            async with db.execute("SELECT COUNT(*) FROM orders WHERE status = 'completed'") as cursor:
-                orders_count = (await cursor.fetchone())[0]
-            
-            # Общая выручка
-            async with db.execute("SELECT SUM(amount) FROM orders WHERE status = 'completed'") as cursor:
-                revenue = (await cursor.fetchone())[0] or 0
+            # Количество продаж и общая выручка
+            orders = ORDERS_WITH_ARCHIVE if await self._attach_archive(db) else "main.orders"
+            async with db.execute(f"""
+                SELECT COUNT(*), SUM(amount) FROM {orders} WHERE status = 'completed'
+            """) as cursor:
+                orders_count, revenue = await cursor.fetchone()
+                revenue = revenue or 0
             
             # Количество активных категорий
             async with db.execute("SELECT COUNT(*) FROM categories WHERE is_active = 1") as cursor:
@@ -480,9 +1568,118 @@ class Database:
                 'items_in_stock': items_in_stock
             }
     
+    async def add_product_views(self, views: Dict[int, int]):
+        """Учет просмотров карточек товаров: {product_id: просмотров}"""
+        if not views:
+            return
+        async with connect(self.db_path) as db:
+            await db.executemany(SALES_VIEWS_UPSERT, [
+                {'product_id': product_id, 'views': count} for product_id, count in views.items()
+            ])
+            await db.commit()
+    
+    async def get_sales_report(self, granularity: str = "day", limit: int = 10):
+        """
+        Продажи за окно отчета из сводки sales_rollup
+        
+        Окно: 24 часа, 30 дней или 12 недель. Запросы читают только строки
+        сводки за окно (по первичному ключу), поэтому их стоимость зависит от
+        размера каталога, а не от истории заказов.
+        
+        Returns:
+            Словарь: since, totals, series (по периодам), products (лучшие по
+            выручке, limit штук) и categories. Строки содержат orders, units,
+            revenue и views
+        """
+        if granularity not in SALES_BUCKETS:
+            raise ValueError(f"Неизвестный период: {granularity}")
+        since = SALES_BUCKETS[granularity].format(ts=SALES_WINDOWS[granularity])
+        totals = "SUM(orders) AS orders, SUM(units) AS units, ROUND(SUM(revenue), 2) AS revenue, SUM(views) AS views"
+        window = f"FROM sales_rollup WHERE granularity = ? AND bucket >= {since}"
+        
+        async with connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(f"SELECT {since}") as cursor:
+                since_value = (await cursor.fetchone())[0]
+            async with db.execute(f"""
+                SELECT bucket, {totals} {window}
+                GROUP BY bucket ORDER BY bucket
+            """, (granularity,)) as cursor:
+                series = [dict(row) for row in await cursor.fetchall()]
+            async with db.execute(f"""
+                SELECT s.*, COALESCE(p.name, '#' || s.product_id) AS name, p.stock_count
+                FROM (
+                    SELECT product_id, {totals} {window}
+                    GROUP BY product_id HAVING SUM(orders) > 0
+                    ORDER BY revenue DESC LIMIT ?
+                ) s
+                LEFT JOIN products p ON p.product_id = s.product_id
+                ORDER BY s.revenue DESC
+            """, (granularity, limit)) as cursor:
+                products = [dict(row) for row in await cursor.fetchall()]
+            async with db.execute(f"""
+                SELECT s.*, COALESCE(c.name, 'Без категории') AS name
+                FROM (
+                    SELECT category_id, {totals} {window}
+                    GROUP BY category_id
+                ) s
+                LEFT JOIN categories c ON c.category_id = s.category_id
+                ORDER BY s.revenue DESC
+            """, (granularity,)) as cursor:
+                categories = [dict(row) for row in await cursor.fetchall()]
+        
+        return {
+            'granularity': granularity,
+            'since': since_value,
+            'totals': {
+                'orders': sum(row['orders'] for row in series),
+                'units': sum(row['units'] for row in series),
+                'revenue': round(sum(row['revenue'] for row in series), 2),
+                'views': sum(row['views'] for row in series),
+            },
+            'series': series,
+            'products': products,
+            'categories': categories,
+        }
+    
+    async def get_stockout_forecast(self, days: int = 7, limit: int = 10):
+        """
+        Прогноз окончания остатков по средним продажам за days дней (из сводки)
+        
+        Returns:
+            Активные товары с продажами, раньше всех заканчивающиеся: product_id,
+            name, stock_count, units (продано за период), days_left
+        """
+        async with connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("""
+                SELECT p.product_id, p.name, p.stock_count, s.units,
+                       p.stock_count * ? * 1.0 / s.units AS days_left
+                FROM (
+                    SELECT product_id, SUM(units) AS units FROM sales_rollup
+                    WHERE granularity = 'day' AND bucket >= date('now', ?)
+                    GROUP BY product_id
+                ) s
+                JOIN products p ON p.product_id = s.product_id
+                WHERE p.is_active = 1 AND s.units > 0
+                ORDER BY days_left, s.units DESC
+                LIMIT ?
+            """, (days, f"-{days - 1} days", limit)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+    
+    async def prune_sales_rollup(self, keep_hours_days: int = 14) -> int:
+        """Удаление почасовой сводки старше keep_hours_days дней (дни и недели хранятся)"""
+        async with connect(self.db_path) as db:
+            cursor = await db.execute(f"""
+                DELETE FROM sales_rollup
+                WHERE granularity = 'hour' AND bucket < {SALES_BUCKETS['hour'].format(ts="'now', ?")}
+            """, (f"-{keep_hours_days} days",))
+            await db.commit()
+            return cursor.rowcount
+    
     async def get_all_categories(self, limit: int = 100, offset: int = 0):
         """Получение всех категорий (включая неактивные)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM categories 
@@ -494,7 +1691,7 @@ class Database:
     
     async def get_all_products(self, limit: int = 100, offset: int = 0):
         """Получение всех товаров (включая неактивные)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT p.*, c.name as category_name 
@@ -506,19 +1703,392 @@ class Database:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
     
-    async def add_product_items_bulk(self, product_id: int, items_list: list):
-        """Массовая загрузка товарных позиций"""
-        async with aiosqlite.connect(self.db_path) as db:
-            for item_data in items_list:
-                await db.execute("""
+    async def add_product_items_bulk(self, product_id: int, items_list: Iterable[str], batch_size: int = 1000):
+        """
+        Массовая загрузка товарных позиций (со сжатием и шифрованием, если они включены)
+        
+        items_list может быть генератором: позиции читаются, кодируются и
+        вставляются пачками по batch_size, в памяти держится одна пачка.
+        Вся загрузка — одна транзакция. Пустые строки пропускаются.
+        
+        Returns:
+            Количество загруженных позиций
+        """
+        count = 0
+        items = (item for item in (line.strip() for line in items_list) if item)
+        created = {'keys': {}, 'dicts': {}}
+        async with connect(self.db_path) as db:
+            while batch := list(itertools.islice(items, batch_size)):
+                values = await self._encode_items(db, product_id, batch, created)
+                await db.executemany("""
                     INSERT INTO product_items (product_id, data)
                     VALUES (?, ?)
-                """, (product_id, item_data.strip()))
+                """, ((product_id, value) for value in values))
+                count += len(batch)
             await db.commit()
+        self._remember_created(created)
         
         # Обновляем количество товара
         await self.update_product_stock(product_id)
-        return len(items_list)
+        return count
+    
+    # Выгрузки
+    
+    async def _export_sources(self, db: aiosqlite.Connection, table: str) -> list:
+        """Схемы с таблицей выгрузки: заказы сначала читаются из архива (они старше)"""
+        if table == "orders" and await self._attach_archive(db):
+            return ["archive", "main"]
+        return ["main"]
+    
+    async def count_export_rows(self, table: str, date_from: Optional[str] = None,
+                                date_to: Optional[str] = None) -> int:
+        """Количество строк выгрузки за период [date_from, date_to) (ГГГГ-ММ-ДД, включая архив)"""
+        async with connect(self.db_path, uri=True) as db:
+            total = 0
+            for schema in await self._export_sources(db, table):
+                async with db.execute(f"""
+                    SELECT COUNT(*) FROM {schema}.{table}
+                    WHERE created_at >= ? AND created_at < ?
+                """, (date_from or "", date_to or "9999-12-31")) as cursor:
+                    total += (await cursor.fetchone())[0]
+            return total
+    
+    async def iter_export_rows(self, table: str, date_from: Optional[str] = None,
+                               date_to: Optional[str] = None, batch_size: int = 1000):
+        """
+        Постраничное чтение строк orders, users или payments за период
+        
+        Каждая страница — отдельный короткий запрос по индексу created_at
+        с продолжением от последней строки (created_at, ключ): без
+        OFFSET и без открытого на всю выгрузку курсора, который держал бы
+        блокировку чтения и мешал покупкам. Строки без created_at не
+        выгружаются.
+        
+        Yields:
+            Списки кортежей в порядке колонок EXPORT_TABLES[table]
+        """
+        key, columns = EXPORT_TABLES[table]
+        params = {"date_from": date_from or "", "date_to": date_to or "9999-12-31", "limit": batch_size}
+        
+        async with connect(self.db_path, uri=True) as db:
+            sources = await self._export_sources(db, table)
+        
+        for schema in sources:
+            # Продолжение заменяет нижнюю границу: с двумя границами SQLite
+            # начинает поиск по индексу от date_from и каждая страница дороже
+            lower = "created_at >= :date_from"
+            while True:
+                async with connect(self.db_path, uri=True) as db:
+                    if schema == "archive":
+                        await self._attach_archive(db)
+                    async with db.execute(f"""
+                        SELECT {columns}, created_at FROM {schema}.{table}
+                        WHERE {lower} AND created_at < :date_to
+                        ORDER BY created_at, {key}
+                        LIMIT :limit
+                    """, params) as cursor:
+                        rows = await cursor.fetchall()
+                
+                if rows:
+                    yield [row[:-1] for row in rows]
+                if len(rows) < batch_size:
+                    break
+                last = rows[-1]
+                params.update(last_created=last[-1], last_key=last[0])
+                lower = f"(created_at, {key}) > (:last_created, :last_key)"
+    
+    # Рассылки
+    
+    async def touch_users(self, user_ids: Iterable[int]):
+        """
+        Отметка активности пользователей (пачкой)
+        
+        Написавший боту пользователь снова доступен для рассылок, даже если
+        раньше блокировал бота.
+        """
+        async with connect(self.db_path) as db:
+            await db.executemany("""
+                UPDATE users SET last_active_at = CURRENT_TIMESTAMP, bot_blocked_at = NULL
+                WHERE user_id = ?
+            """, ((user_id,) for user_id in user_ids))
+            await db.commit()
+    
+    async def _segment_query(self, db: aiosqlite.Connection, segment: str) -> str:
+        """
+        FROM и WHERE выборки получателей сегмента
+        
+        Соединение должно быть открыто с uri=True: покупки в категории
+        ищутся и среди заказов, перенесенных в архив.
+        """
+        if segment not in BROADCAST_SEGMENTS:
+            raise ValueError(f"Неизвестный сегмент: {segment}")
+        condition = BROADCAST_SEGMENTS[segment]
+        if "{orders}" in condition:
+            orders = ORDERS_WITH_ARCHIVE if await self._attach_archive(db) else "main.orders"
+            condition = condition.format(orders=orders)
+        return f"""
+            FROM users u
+            WHERE ({condition}) AND u.bot_blocked_at IS NULL
+        """
+    
+    async def count_broadcast_audience(self, segment: str, arg: Optional[str] = None) -> int:
+        """Число получателей рассылки по сегменту (включая архив заказов)"""
+        async with connect(self.db_path, uri=True) as db:
+            async with db.execute(
+                f"SELECT COUNT(*) {await self._segment_query(db, segment)}", {"arg": arg}
+            ) as cursor:
+                return (await cursor.fetchone())[0]
+    
+    async def create_broadcast(self, segment: str, text: Optional[str], arg: Optional[str] = None,
+                               content_type: str = "text", source_chat_id: Optional[int] = None,
+                               source_message_id: Optional[int] = None, buttons: Optional[str] = None) -> dict:
+        """
+        Создание рассылки и выборка ее получателей в broadcast_recipients
+        
+        Аудитория считается один раз по индексам сегмента; дальше отправка
+        идет по сохраненному списку.
+        
+        Args:
+            text: Текст или подпись сообщения
+            content_type: Тип сообщения (text, photo, document...)
+            source_chat_id: Чат исходного сообщения, которое копируется получателям
+            source_message_id: ID исходного сообщения
+            buttons: Кнопки под сообщением (JSON)
+        
+        Returns:
+            Словарь: broadcast_id, total
+        """
+        async with connect(self.db_path, uri=True) as db:
+            query = await self._segment_query(db, segment)
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("""
+                INSERT INTO broadcasts (
+                    segment, segment_arg, text, content_type, source_chat_id, source_message_id, buttons
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (segment, arg, text, content_type, source_chat_id, source_message_id, buttons))
+            broadcast_id = cursor.lastrowid
+            cursor = await db.execute(f"""
+                INSERT INTO broadcast_recipients (broadcast_id, user_id)
+                SELECT :broadcast_id, u.user_id {query}
+            """, {"broadcast_id": broadcast_id, "arg": arg})
+            total = cursor.rowcount
+            await db.execute("""
+                UPDATE broadcasts SET total = ? WHERE broadcast_id = ?
+            """, (total, broadcast_id))
+            await db.commit()
+            return {'broadcast_id': broadcast_id, 'total': total}
+    
+    async def get_broadcast_recipients(self, broadcast_id: int, after_user_id: int = 0,
+                                       limit: int = 500) -> List[int]:
+        """Следующая страница неотправленных получателей (по возрастанию user_id)"""
+        async with connect(self.db_path) as db:
+            async with db.execute("""
+                SELECT user_id FROM broadcast_recipients
+                WHERE broadcast_id = ? AND user_id > ? AND status = 'pending'
+                ORDER BY user_id
+                LIMIT ?
+            """, (broadcast_id, after_user_id, limit)) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+    
+    async def record_broadcast_results(self, broadcast_id: int, results: Dict[int, str]):
+        """
+        Итоги отправки страницы: {user_id: sent, failed или blocked}
+        
+        Заблокировавшие бота получают отметку bot_blocked_at и не попадают
+        в следующие рассылки.
+        """
+        counts = {status: 0 for status in ("sent", "failed", "blocked")}
+        for status in results.values():
+            counts[status] += 1
+        blocked = [(user_id,) for user_id, status in results.items() if status == "blocked"]
+        
+        async with connect(self.db_path) as db:
+            await db.executemany("""
+                UPDATE broadcast_recipients SET status = ? WHERE broadcast_id = ? AND user_id = ?
+            """, ((status, broadcast_id, user_id) for user_id, status in results.items()))
+            if blocked:
+                await db.executemany("""
+                    UPDATE users SET bot_blocked_at = CURRENT_TIMESTAMP WHERE user_id = ?
+                """, blocked)
+            await db.execute("""
+                UPDATE broadcasts SET sent = sent + ?, failed = failed + ?, blocked = blocked + ?
+                WHERE broadcast_id = ?
+            """, (counts["sent"], counts["failed"], counts["blocked"], broadcast_id))
+            await db.commit()
+    
+    async def finish_broadcast(self, broadcast_id: int, status: str = "done") -> Optional[dict]:
+        """Завершение рассылки. Возвращает ее итоговую запись"""
+        async with connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("""
+                UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE broadcast_id = ?
+                RETURNING *
+            """, (status, broadcast_id)) as cursor:
+                row = await cursor.fetchone()
+            await db.commit()
+            return dict(row) if row else None
+    
+    # Методы для работы с отложенными задачами
+    
+    async def add_scheduled_job(self, name: str, payload: str, run_at: float) -> int:
+        """Сохранение отложенной задачи. run_at — unix-время запуска"""
+        async with connect(self.db_path) as db:
+            cursor = await db.execute("""
+                INSERT INTO scheduled_jobs (name, payload, run_at)
+                VALUES (?, ?, ?)
+            """, (name, payload, run_at))
+            await db.commit()
+            return cursor.lastrowid
+    
+    async def delete_scheduled_job(self, job_id: int) -> bool:
+        """Удаление отложенной задачи (выполненной или отмененной)"""
+        async with connect(self.db_path) as db:
+            cursor = await db.execute(
+                "DELETE FROM scheduled_jobs WHERE job_id = ?", (job_id,)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    async def get_scheduled_jobs(self):
+        """Все сохраненные отложенные задачи"""
+        async with connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("""
+                SELECT job_id, name, payload, run_at FROM scheduled_jobs
+                ORDER BY run_at
+            """) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+    
+    # Методы для архивирования
+    
+    async def init_archive(self, archive_path: str):
+        """Создание файла архива и его таблиц"""
+        async with connect(self.db_path) as db:
+            await db.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+            await db.executescript(ARCHIVE_SCHEMA)
+    
+    async def _archive_batch(self, archive_path: str, table: str, key: str, columns: str,
+                             condition: str, params: tuple, batch_size: int) -> int:
+        """
+        Перенос одной пачки строк table в архив
+        
+        Копирование и удаление выполняются в одной короткой транзакции;
+        INSERT OR IGNORE делает повтор пачки после сбоя безопасным.
+        """
+        async with connect(self.db_path) as db:
+            await db.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+            await db.execute(f"CREATE TEMP TABLE archive_batch ({key} INTEGER PRIMARY KEY)")
+            await db.execute("BEGIN IMMEDIATE")
+            await db.execute(f"""
+                INSERT INTO temp.archive_batch
+                SELECT {key} FROM main.{table} WHERE {condition}
+                LIMIT ?
+            """, (*params, batch_size))
+            await db.execute(f"""
+                INSERT OR IGNORE INTO archive.{table} ({columns})
+                SELECT {columns} FROM main.{table}
+                WHERE {key} IN (SELECT {key} FROM temp.archive_batch)
+            """)
+            cursor = await db.execute(f"""
+                DELETE FROM main.{table}
+                WHERE {key} IN (SELECT {key} FROM temp.archive_batch)
+            """)
+            await db.commit()
+            return cursor.rowcount
+    
+    async def archive_sold_items(self, archive_path: str, older_than_days: int, batch_size: int = 1000) -> int:
+        """Перенос пачки позиций, проданных раньше older_than_days дней назад. Возвращает их количество"""
+        return await self._archive_batch(
+            archive_path, "product_items", "item_id", ITEM_COLUMNS,
+            "is_sold = 1 AND sold_at < datetime('now', ?)", (f"-{int(older_than_days)} days",), batch_size
+        )
+    
+    async def archive_orders(self, archive_path: str, older_than_days: int, batch_size: int = 1000) -> int:
+        """Перенос пачки заказов старше older_than_days дней. Возвращает их количество"""
+        return await self._archive_batch(
+            archive_path, "orders", "order_id", ORDER_COLUMNS,
+            "created_at < datetime('now', ?)", (f"-{int(older_than_days)} days",), batch_size
+        )
+    
+    async def compress_payloads(self, after_item_id: int = 0, batch_size: int = 500):
+        """
+        Сжатие (и шифрование, если задан мастер-ключ) пачки ранее
+        сохраненных открытых позиций (миграция)
+        
+        Позиции перебираются по item_id; словари товаров обучаются по
+        позициям пачки, если их еще нет. Страницы таблицы после этого
+        остаются полупустыми: файл уменьшается только после VACUUM.
+        
+        Returns:
+            Словарь: scanned, compressed, raw_bytes и stored_bytes (размер
+            сжатых позиций до и после), last_item_id (0 — позиции закончились)
+        """
+        async with connect(self.db_path) as db:
+            async with db.execute("""
+                SELECT item_id, product_id, data FROM product_items
+                WHERE item_id > ?
+                ORDER BY item_id
+                LIMIT ?
+            """, (after_item_id, batch_size)) as cursor:
+                rows = await cursor.fetchall()
+            if not rows:
+                return {'scanned': 0, 'compressed': 0, 'raw_bytes': 0, 'stored_bytes': 0, 'last_item_id': 0}
+            
+            by_product = {}
+            for item_id, product_id, data in rows:
+                if isinstance(data, str) and (self.cipher or len(data) >= self.codec.min_size):
+                    by_product.setdefault(product_id, []).append((item_id, data))
+            
+            updates = []
+            raw_bytes = 0
+            created = {'keys': {}, 'dicts': {}}
+            for product_id, items in by_product.items():
+                values = await self._encode_items(db, product_id, [data for _, data in items], created)
+                for (item_id, data), value in zip(items, values):
+                    if isinstance(value, bytes):
+                        updates.append((value, item_id))
+                        raw_bytes += len(data.encode("utf-8"))
+            
+            await db.executemany("""
+                UPDATE product_items SET data = ? WHERE item_id = ? AND typeof(data) = 'text'
+            """, updates)
+            await db.commit()
+            self._remember_created(created)
+            return {
+                'scanned': len(rows),
+                'compressed': len(updates),
+                'raw_bytes': raw_bytes,
+                'stored_bytes': sum(len(value) for value, _ in updates),
+                'last_item_id': rows[-1][0]
+            }
+    
+    async def get_storage_info(self):
+        """Размер базы в страницах, свободные страницы и режим auto_vacuum (0 — NONE, 2 — INCREMENTAL)"""
+        async with connect(self.db_path) as db:
+            info = {}
+            for pragma in ("page_size", "page_count", "freelist_count", "auto_vacuum"):
+                async with db.execute(f"PRAGMA {pragma}") as cursor:
+                    info[pragma] = (await cursor.fetchone())[0]
+            return info
+    
+    async def incremental_vacuum(self, pages: int = 1000) -> int:
+        """
+        Возврат до pages свободных страниц файловой системе
+        
+        Работает только в режиме auto_vacuum = INCREMENTAL. Возвращает
+        количество освобожденных страниц.
+        """
+        async with connect(self.db_path) as db:
+            async with db.execute("PRAGMA freelist_count") as cursor:
+                before = (await cursor.fetchone())[0]
+            # Прагма освобождает по странице на каждый шаг выполнения: execute
+            # модуля sqlite3 делает один шаг, executescript — до конца
+            await db.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            async with db.execute("PRAGMA freelist_count") as cursor:
+                after = (await cursor.fetchone())[0]
+            return before - after
     
     # Методы для работы с информационными текстами
     
@@ -567,9 +2137,12 @@ class Database:
             )
         }
         
-        # Устанавливаем тексты только если их еще нет
-        for key, default_text in default_texts.items():
-            existing_text = await self.get_info_text(key)
-            if not existing_text:
-                await self.set_info_text(key, default_text)
+        # Устанавливаем тексты только если их еще нет (одним соединением)
+        async with connect(self.db_path) as db:
+            await db.executemany("""
+                INSERT INTO settings (key, value) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+                WHERE settings.value IS NULL OR settings.value = ''
+            """, [(f"info_{key}", text) for key, text in default_texts.items()])
+            await db.commit()
 
@@ -0,0 +1,279 @@
+"""
+Генератор синтетических данных для нагрузочного тестирования
+
+Заполняет базу, созданную Database.init_db, правдоподобными данными:
+популярность товаров распределена по закону Ципфа, доля проданных
+позиций, число заказов и платежей на пользователя задаются параметрами.
+Один и тот же seed (и момент now, по умолчанию фиксированный) дает одну
+и ту же базу.
+
+Запуск: telegramshop generate --db data/scale.db --users 500000 --items 5000000
+"""
+import asyncio
+import itertools
+import random
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from .database import SALES_ROLLUP_BACKFILL, Database
+
+
+@dataclass
+class DataSpec:
+    """Параметры генерируемых данных"""
+    users: int = 10_000
+    categories: int = 20
+    products: int = 200
+    items: int = 100_000
+    sold_ratio: float = 0.3
+    orders_per_user: float = 2.0
+    payments_per_user: float = 1.0
+    zero_balance_ratio: float = 0.3
+    balance_mean: float = 500.0
+    price_median: float = 20.0
+    popularity_skew: float = 1.0
+    days: int = 365
+    # Конец периода истории; фиксированный, чтобы seed однозначно задавал базу
+    now: datetime = datetime(2025, 1, 1)
+    seed: int = 42
+    batch_size: int = 50_000
+
+
+class _Generator:
+    """Потоковая генерация строк таблиц; счетчики для зависимых таблиц копятся по ходу"""
+
+    def __init__(self, spec: DataSpec):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+
+        # Метки времени с точностью до часа за spec.days дней до spec.now (формат CURRENT_TIMESTAMP)
+        now = spec.now.replace(minute=0, second=0, microsecond=0)
+        self.timestamps = [
+            (now - timedelta(hours=hour)).strftime("%Y-%m-%d %H:%M:%S")
+            for hour in range(max(spec.days, 1) * 24)
+        ]
+
+        # Популярность товаров: вес товара с рангом r пропорционален 1 / r^skew
+        ranks = list(range(1, spec.products + 1))
+        self.rng.shuffle(ranks)
+        self.product_cum_weights = list(itertools.accumulate(
+            1 / rank ** spec.popularity_skew for rank in ranks
+        ))
+        self.prices = [
+            round(self.rng.lognormvariate(0, 1) * spec.price_median, 2) or 1.0
+            for _ in range(spec.products)
+        ]
+
+        self.unsold: List[int] = [0] * (spec.products + 1)
+        self.purchases: List[int] = [0] * (spec.users + 1)
+        self.balances: Dict[int, float] = {}
+
+    def _batches(self, total: int) -> Iterator[int]:
+        for start in range(0, total, self.spec.batch_size):
+            yield min(self.spec.batch_size, total - start)
+
+    def _products(self, count: int) -> List[int]:
+        return self.rng.choices(range(1, self.spec.products + 1), cum_weights=self.product_cum_weights, k=count)
+
+    def _users(self, count: int) -> List[int]:
+        return [int(value * self.spec.users) + 1 for value in (self.rng.random() for _ in range(count))]
+
+    def _times(self, count: int) -> List[str]:
+        return self.rng.choices(self.timestamps, k=count)
+
+    def product_items(self) -> Iterator[tuple]:
+        spec = self.spec
+        item_id = 0
+        for count in self._batches(spec.items):
+            products = self._products(count)
+            buyers = self._users(count)
+            times = self._times(count)
+            for product_id, buyer, sold_at in zip(products, buyers, times):
+                item_id += 1
+                if self.rng.random() < spec.sold_ratio:
+                    yield item_id, product_id, f"item-{item_id:08d}", 1, buyer, sold_at, sold_at
+                else:
+                    self.unsold[product_id] += 1
+                    yield item_id, product_id, f"item-{item_id:08d}", 0, None, None, sold_at
+
+    def orders(self) -> Iterator[tuple]:
+        spec = self.spec
+        for count in self._batches(int(spec.users * spec.orders_per_user)):
+            users = self._users(count)
+            products = self._products(count)
+            times = self._times(count)
+            for user_id, product_id, created_at in zip(users, products, times):
+                quantity = 1 if self.rng.random() < 0.9 else self.rng.randint(2, 5)
+                self.purchases[user_id] += 1
+                yield (user_id, product_id, f"Товар {product_id}", quantity,
+                       round(self.prices[product_id - 1] * quantity, 2), "completed", created_at)
+
+    def payments(self) -> Iterator[tuple]:
+        spec = self.spec
+        payment_id = 0
+        for count in self._batches(int(spec.users * spec.payments_per_user)):
+            for user_id, created_at in zip(self._users(count), self._times(count)):
+                payment_id += 1
+                roll = self.rng.random()
+                status = "completed" if roll < 0.9 else "pending" if roll < 0.95 else "cancelled"
+                yield (payment_id, user_id, float(self.rng.choice((100, 250, 500, 1000, 5000))), status,
+                       self.rng.choice(("cryptobot", "yoomoney", "manual")), f"gen-{payment_id}",
+                       created_at, created_at if status == "completed" else None)
+
+    def users(self) -> Iterator[tuple]:
+        spec = self.spec
+        for user_id in range(1, spec.users + 1):
+            balance = 0.0
+            if self.rng.random() >= spec.zero_balance_ratio:
+                balance = round(self.rng.expovariate(1 / spec.balance_mean), 2)
+                self.balances[user_id] = balance
+            yield (user_id, f"user{user_id}", f"User {user_id}", balance,
+                   self.purchases[user_id], self.timestamps[-1 - (user_id - 1) % len(self.timestamps)])
+
+    def ledger(self) -> Iterator[tuple]:
+        """Начальные записи журнала, чтобы verify_balances не находил расхождений"""
+        for user_id, balance in self.balances.items():
+            yield user_id, balance, balance, "opening"
+
+    def categories(self) -> Iterator[tuple]:
+        for category_id in range(1, self.spec.categories + 1):
+            yield category_id, f"Категория {category_id}", "", category_id
+
+    def products(self) -> Iterator[tuple]:
+        for product_id in range(1, self.spec.products + 1):
+            yield (product_id, (product_id - 1) % self.spec.categories + 1, f"Товар {product_id}", "",
+                   self.prices[product_id - 1], self.unsold[product_id], product_id)
+
+
+# Порядок важен: остатки товаров и счетчики покупок считаются при генерации позиций и заказов
+TABLES = [
+    ("product_items", "item_id, product_id, data, is_sold, sold_to_user_id, sold_at, created_at",
+     _Generator.product_items),
+    ("orders", "user_id, product_id, product_name, quantity, amount, status, created_at",
+     _Generator.orders),
+    ("payments", "payment_id, user_id, amount, status, payment_method, external_id, created_at, completed_at",
+     _Generator.payments),
+    ("users", "user_id, username, first_name, balance, purchases_count, created_at", _Generator.users),
+    ("balance_ledger", "user_id, amount, balance_after, reason", _Generator.ledger),
+    ("categories", "category_id, name, description, position", _Generator.categories),
+    ("products", "product_id, category_id, name, description, price, stock_count, position",
+     _Generator.products),
+]
+
+
+def generate(db_path: str, spec: DataSpec) -> Dict[str, int]:
+    """
+    Генерация данных в новую базу
+
+    Схема создается Database.init_db. На время загрузки индексы удаляются
+    (и строятся заново в конце вместе со сводкой продаж), журнал и fsync отключаются, каждая
+    таблица вставляется одной транзакцией через executemany. В конце база
+переводится в режим WAL, как после init_db.
+
+    Returns:
+        Количество строк по таблицам
+    """
+    asyncio.run(Database(db_path).init_db())
+
+    counts = {}
+    db = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        for table, _, _ in TABLES:
+            if db.execute(f"SELECT EXISTS (SELECT 1 FROM {table})").fetchone()[0]:
+                raise ValueError(f"Таблица {table} уже содержит данные, нужна пустая база")
+
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute("PRAGMA cache_size = -262144")
+        indexes = db.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+        ).fetchall()
+        for name, _ in indexes:
+            db.execute(f"DROP INDEX {name}")
+
+        generator = _Generator(spec)
+        for table, columns, rows in TABLES:
+            placeholders = ", ".join("?" * len(columns.split(",")))
+            db.execute("BEGIN")
+            cursor = db.executemany(
+                f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows(generator)
+            )
+            db.execute("COMMIT")
+            counts[table] = cursor.rowcount
+
+        db.execute("BEGIN")
+        for _, sql in indexes:
+            db.execute(sql)
+        db.execute(SALES_ROLLUP_BACKFILL)
+        db.execute("COMMIT")
+        db.execute("ANALYZE")
+        # init_db для уже созданной схемы ничего не меняет, поэтому режим журнала возвращается здесь
+        db.execute("PRAGMA journal_mode = WAL")
+    finally:
+        db.close()
+    return counts
+
+
+def command(args) -> int:
+    """Подкоманда generate"""
+    path = Path(args.db)
+    if path.exists():
+        if not args.force:
+            print(f"{path} уже существует (--force, чтобы перезаписать)")
+            return 2
+        path.unlink()
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    spec = DataSpec(
+        users=args.users, categories=args.categories, products=args.products, items=args.items,
+        sold_ratio=args.sold_ratio, orders_per_user=args.orders_per_user,
+        payments_per_user=args.payments_per_user, zero_balance_ratio=args.zero_balance_ratio,
+        balance_mean=args.balance_mean, price_median=args.price_median,
+        popularity_skew=args.popularity_skew, days=args.days, now=args.now, seed=args.seed,
+        batch_size=args.batch_size,
+    )
+    started = time.perf_counter()
+    counts = generate(str(path), spec)
+    elapsed = time.perf_counter() - started
+
+    total = sum(counts.values())
+    for table, count in counts.items():
+        print(f"  {table:<15} {count:>12,}".replace(",", " "))
+    print(f"{total:,} строк за {elapsed:.1f} с ({total / elapsed:,.0f} строк/с) → {path}".replace(",", " "))
+    return 0
+
+
+def register(subparsers):
+    """Регистрация подкоманды generate"""
+    defaults = DataSpec()
+    parser = subparsers.add_parser("generate", help="Сгенерировать базу с синтетическими данными")
+    parser.add_argument("--db", required=True, help="Путь к создаваемой базе")
+    parser.add_argument("--force", action="store_true", help="Перезаписать существующий файл")
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--categories", type=int, default=defaults.categories)
+    parser.add_argument("--products", type=int, default=defaults.products)
+    parser.add_argument("--items", type=int, default=defaults.items, help="Товарных позиций")
+    parser.add_argument("--sold-ratio", type=float, default=defaults.sold_ratio,
+                        help="Доля проданных позиций")
+    parser.add_argument("--orders-per-user", type=float, default=defaults.orders_per_user,
+                        help="Среднее число заказов на пользователя")
+    parser.add_argument("--payments-per-user", type=float, default=defaults.payments_per_user,
+                        help="Среднее число пополнений на пользователя")
+    parser.add_argument("--zero-balance-ratio", type=float, default=defaults.zero_balance_ratio,
+                        help="Доля пользователей с нулевым балансом")
+    parser.add_argument("--balance-mean", type=float, default=defaults.balance_mean,
+                        help="Средний ненулевой баланс (экспоненциальное распределение)")
+    parser.add_argument("--price-median", type=float, default=defaults.price_median,
+                        help="Медианная цена товара (логнормальное распределение)")
+    parser.add_argument("--popularity-skew", type=float, default=defaults.popularity_skew,
+                        help="Показатель закона Ципфа для популярности товаров (0 — равномерно)")
+    parser.add_argument("--days", type=int, default=defaults.days, help="Глубина истории в днях")
+    parser.add_argument("--now", type=datetime.fromisoformat, default=defaults.now,
+                        help="Конец периода истории, ISO 8601 (по умолчанию %(default)s)")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--batch-size", type=int, default=defaults.batch_size)
+    parser.set_defaults(func=command)
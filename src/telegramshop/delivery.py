@@ -0,0 +1,127 @@
+"""
+Выдача купленных товарных позиций
+"""
+import html
+from typing import AsyncIterable, Callable, Iterable, Optional, Union
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile, InputFile, Message
+
+
+# Максимальная длина выдачи одним сообщением (лимит Telegram — 4096 символов)
+INLINE_DELIVERY_LIMIT = 3500
+
+# Максимальная длина подписи к документу (лимит Telegram — 1024 символа)
+CAPTION_LIMIT = 1024
+
+
+class ItemsInputFile(InputFile):
+    """
+    Документ из товарных позиций, формируемый потоково
+
+    Позиции кодируются и отдаются кусками по chunk_size байт по мере
+    отправки запроса, поэтому весь файл никогда не собирается в памяти.
+
+    Запрос может отправляться повторно (после 429), и каждый раз файл
+    читается заново. Поэтому источник — либо коллекция (список), либо
+    фабрика, которая создает новый, в том числе асинхронный, генератор
+    (например, постраничное чтение из базы). Одноразовый итератор
+    отклоняется: при повторе он отдал бы пустой файл.
+    """
+
+    def __init__(self, items: Union[Iterable[str], Callable[[], Union[Iterable[str], AsyncIterable[str]]]],
+                 filename: str, chunk_size: int = 64 * 1024):
+        if not callable(items) and (hasattr(items, "__anext__") or iter(items) is items):
+            raise TypeError("Одноразовый итератор позиций: передайте список или фабрику генератора")
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.items = items
+
+    async def _iter_items(self):
+        items = self.items() if callable(self.items) else self.items
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                yield item
+        else:
+            for item in items:
+                yield item
+
+    async def read(self, bot: Bot):
+        buffer = bytearray()
+        async for item in self._iter_items():
+            buffer += item.encode("utf-8")
+            buffer += b"\n"
+            if len(buffer) >= self.chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+
+def _telegram_length(text: str) -> int:
+    """Длина текста так, как ее считает Telegram (в единицах UTF-16)"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _truncate(text: str, limit: int) -> str:
+    """Простой текст, укороченный до limit символов Telegram с многоточием"""
+    if _telegram_length(text) <= limit:
+        return text
+    text = text[:max(limit - 1, 0)]
+    while text and _telegram_length(text) > limit - 1:
+        text = text[:-1]
+    return text + "…"
+
+
+def _render_inline(items: list, budget: int) -> Optional[str]:
+    """Текст позиций для сообщения или None, если он не укладывается в budget символов"""
+    parts = []
+    length = 0
+    for item in items:
+        part = f"<code>{html.escape(item)}</code>"
+        length += len(part) + 1
+        if length > budget:
+            return None
+        parts.append(part)
+    return "\n".join(parts)
+
+
+async def deliver_items(message: Message, header: str, items: list, footer: str = "",
+                        filename: str = "items.txt"):
+    """
+    Выдать позиции пользователю в чат сообщения
+
+    Если позиции укладываются в лимит сообщения, они отправляются текстом.
+    Одна большая позиция отправляется документом из памяти, несколько —
+    потоковым документом без склейки в одну строку.
+
+    Заголовок и подпись — простой текст: они экранируются здесь, а для
+    подписи к документу укорачиваются до экранирования, чтобы обрезка не
+    разрезала HTML-сущность.
+
+    Args:
+        message: Сообщение, в чат которого выполняется выдача
+        header: Заголовок (простой текст)
+        items: Данные позиций
+        footer: Подпись после позиций (простой текст)
+        filename: Имя файла при выдаче документом
+    """
+    budget = INLINE_DELIVERY_LIMIT - len(header) - len(footer) - 32
+    body = _render_inline(items, budget)
+
+    if body is not None:
+        await message.answer(
+            f"{html.escape(header)}\n📦 Ваш товар:\n\n{body}\n{html.escape(footer)}",
+            parse_mode="HTML"
+        )
+        return
+
+    if len(items) == 1:
+        document = BufferedInputFile(items[0].encode("utf-8"), filename=filename)
+    else:
+        document = ItemsInputFile(items, filename=filename)
+
+    note = "\n📦 Ваш товар во вложении.\n"
+    footer = _truncate(footer, CAPTION_LIMIT - _telegram_length(note))
+    header = _truncate(header, CAPTION_LIMIT - _telegram_length(note) - _telegram_length(footer))
+    caption = html.escape(f"{header}{note}{footer}")
+    await message.answer_document(document, caption=caption, parse_mode="HTML")
@@ -0,0 +1,163 @@
+"""
+Шифрование данных товарных позиций (конвертное, AES-256-GCM)
+
+Данные каждого товара шифруются своим ключом данных (DEK), который
+хранится в таблице data_keys обернутым мастер-ключом из настроек
+(PAYLOAD_MASTER_KEY). Мастер-ключ в базу и резервные копии не попадает.
+
+Зашифрованное значение — BLOB:
+1 байт маркера, 4 байта ID ключа, 12 байт nonce, затем шифротекст.
+Внутри лежит результат сжатия (см. payload): сжатый BLOB или текст
+с нулевым байтом впереди. Маркер не пересекается с ID алгоритмов сжатия.
+Словари сжатия (payload_dicts) собраны из самих позиций и шифруются
+тем же ключом данных товара, с байтом 0x01 впереди.
+"""
+import base64
+import os
+import struct
+from collections import OrderedDict
+from typing import Dict, Tuple, Union
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:  # шифрование необязательно, без него данные хранятся открыто
+    AESGCM = None
+    InvalidTag = None
+
+
+MARKER = 0x80
+_HEADER = struct.Struct(">BI")
+_NONCE_SIZE = 12
+_TEXT = b"\x00"
+_DICTIONARY = b"\x01"
+# Связывает обернутый ключ с его назначением (AAD)
+_WRAP_AAD = b"telegramshop-dek"
+
+
+class EncryptionError(Exception):
+    """Неверный мастер-ключ или поврежденные данные"""
+
+
+def generate_master_key() -> str:
+    """Новый мастер-ключ для PAYLOAD_MASTER_KEY"""
+    return base64.urlsafe_b64encode(os.urandom(32)).decode()
+
+
+def is_encrypted(value) -> bool:
+    return isinstance(value, bytes) and len(value) > _HEADER.size and value[0] == MARKER
+
+
+def key_ids(values) -> set:
+    """ID ключей данных, нужных для расшифровки значений"""
+    return {_HEADER.unpack_from(value)[1] for value in values if is_encrypted(value)}
+
+
+class PayloadCipher:
+    """
+    Шифрование позиций ключами данных товаров
+
+    Развернутые ключи данных держатся в LRU-кэше на cache_size ключей:
+    при попадании в кэш расшифровка позиции — одна операция AES-GCM без
+    обращения к базе. Ключ товара не меняется, поэтому кэш не устаревает.
+
+    Args:
+        master_key: Мастер-ключ (32 байта в base64)
+        cache_size: Сколько развернутых ключей данных держать в памяти
+    """
+
+    def __init__(self, master_key: str, cache_size: int = 1024):
+        if AESGCM is None:
+            raise ValueError("Для PAYLOAD_MASTER_KEY установите пакет cryptography")
+        try:
+            key = base64.urlsafe_b64decode(master_key)
+        except ValueError:
+            key = b""
+        if len(key) != 32:
+            raise ValueError("PAYLOAD_MASTER_KEY должен быть 32 байтами в base64")
+        self._master = AESGCM(key)
+        self.cache_size = cache_size
+        self._keys: "OrderedDict[int, AESGCM]" = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def new_data_key(self) -> Tuple[bytes, bytes]:
+        """Новый ключ данных: (ключ, обернутый ключ для хранения в базе)"""
+        key = AESGCM.generate_key(bit_length=256)
+        nonce = os.urandom(_NONCE_SIZE)
+        return key, nonce + self._master.encrypt(nonce, key, _WRAP_AAD)
+
+    def unwrap(self, wrapped: bytes) -> bytes:
+        try:
+            return self._master.decrypt(wrapped[:_NONCE_SIZE], wrapped[_NONCE_SIZE:], _WRAP_AAD)
+        except InvalidTag:
+            raise EncryptionError("Ключ данных не разворачивается: неверный PAYLOAD_MASTER_KEY") from None
+
+    def lookup(self, key_ids) -> Tuple[Dict[int, AESGCM], set]:
+        """
+        Развернутые ключи по ID
+
+        Returns:
+            (ключи из кэша по ID, ID ключей, которые нужно загрузить из базы)
+        """
+        keys, missing = {}, set()
+        for key_id in key_ids:
+            aead = self._keys.get(key_id)
+            if aead is None:
+                missing.add(key_id)
+            else:
+                self._keys.move_to_end(key_id)
+                keys[key_id] = aead
+        self.stats['hits'] += len(keys)
+        self.stats['misses'] += len(missing)
+        return keys, missing
+
+    @staticmethod
+    def data_key(key: bytes) -> AESGCM:
+        """Развернутый ключ данных без кэша (например, еще не зафиксированный в базе)"""
+        return AESGCM(key)
+
+    def remember(self, key_id: int, key: bytes) -> AESGCM:
+        """Положить развернутый ключ в кэш, вытеснив самый давний"""
+        aead = self._keys[key_id] = self.data_key(key)
+        while len(self._keys) > self.cache_size:
+            self._keys.popitem(last=False)
+        return aead
+
+    def clear(self):
+        """Сброс кэша развернутых ключей"""
+        self._keys.clear()
+
+    @staticmethod
+    def encrypt(key_id: int, aead: AESGCM, value: Union[str, bytes]) -> bytes:
+        """Шифрование значения (текста или сжатого BLOB) ключом данных"""
+        inner = _TEXT + value.encode("utf-8") if isinstance(value, str) else value
+        header = _HEADER.pack(MARKER, key_id)
+        nonce = os.urandom(_NONCE_SIZE)
+        return header + nonce + aead.encrypt(nonce, inner, header)
+
+    @staticmethod
+    def decrypt(value: bytes, keys: Dict[int, AESGCM]) -> Union[str, bytes]:
+        """
+        Расшифровка значения (см. lookup)
+
+        Returns:
+            Текст или сжатый BLOB для payload.decode
+        """
+        header = value[:_HEADER.size]
+        key_id = _HEADER.unpack(header)[1]
+        nonce = value[_HEADER.size:_HEADER.size + _NONCE_SIZE]
+        try:
+            inner = keys[key_id].decrypt(nonce, value[_HEADER.size + _NONCE_SIZE:], header)
+        except InvalidTag:
+            raise EncryptionError(f"Позиция не расшифровывается ключом {key_id}") from None
+        return inner[1:].decode("utf-8") if inner[:1] == _TEXT else inner
+
+    @classmethod
+    def encrypt_dictionary(cls, key_id: int, aead: AESGCM, dictionary: bytes) -> bytes:
+        """Шифрование словаря сжатия (байт типа впереди, чтобы словарь не приняли за текст)"""
+        return cls.encrypt(key_id, aead, _DICTIONARY + dictionary)
+
+    @classmethod
+    def decrypt_dictionary(cls, value: bytes, keys: Dict[int, AESGCM]) -> bytes:
+        """Расшифровка словаря сжатия"""
+        return cls.decrypt(value, keys)[len(_DICTIONARY):]
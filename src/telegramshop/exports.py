@@ -0,0 +1,174 @@
+"""
+Выгрузка заказов, пользователей и платежей в CSV или JSON
+"""
+import asyncio
+import csv
+import gzip
+import io
+import json
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from .database import EXPORT_TABLES, Database
+
+
+FORMATS = ("csv", "json")
+
+# Подписи таблиц для админ-панели
+TABLE_TITLES = {
+    "orders": "Заказы",
+    "users": "Пользователи",
+    "payments": "Платежи",
+}
+
+# Лимит документа для api.telegram.org; локальный сервер Bot API принимает до 2 ГБ
+DOCUMENT_LIMIT = 50 * 1024 * 1024
+LOCAL_DOCUMENT_LIMIT = 2000 * 1024 * 1024
+
+
+def export_filename(table: str, fmt: str, compress: bool,
+                    date_from: Optional[str] = None, date_to: Optional[str] = None) -> str:
+    """Имя файла выгрузки: orders_2025-01-01_2025-02-01.csv.gz"""
+    period = f"{date_from or 'start'}_{date_to or date.today().isoformat()}"
+    return f"{table}_{period}.{fmt}" + (".gz" if compress else "")
+
+
+def period_days(days: int) -> tuple:
+    """Период за последние days дней, включая сегодня: (date_from, date_to)"""
+    today = date.today()
+    return (today - timedelta(days=days - 1)).isoformat(), (today + timedelta(days=1)).isoformat()
+
+
+def parse_period(text: str) -> tuple:
+    """
+    Период из ввода администратора: "01.01.2025-31.01.2025" (обе даты включительно)
+
+    Returns:
+        (date_from, date_to) для выгрузки, date_to — следующий день после конца
+    """
+    start, end = (datetime.strptime(part.strip(), "%d.%m.%Y").date() for part in text.split("-"))
+    if end < start:
+        raise ValueError("Конец периода раньше начала")
+    return start.isoformat(), (end + timedelta(days=1)).isoformat()
+
+
+class _Writer:
+    """Запись страниц строк в CSV или массив JSON (файл открыт на все время выгрузки)"""
+
+    def __init__(self, path: Path, fmt: str, columns: list, compress: bool):
+        self.columns = columns
+        self.fmt = fmt
+        raw = gzip.open(path, "wb", compresslevel=6) if compress else open(path, "wb")
+        self.file = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        self.rows = 0
+        if fmt == "csv":
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(columns)
+        else:
+            self.file.write("[")
+
+    def write(self, rows: list):
+        if self.fmt == "csv":
+            self.csv.writerows(rows)
+        else:
+            for index, row in enumerate(rows):
+                self.file.write(",\n" if self.rows or index else "\n")
+                self.file.write(json.dumps(dict(zip(self.columns, row)), ensure_ascii=False))
+        self.rows += len(rows)
+
+    def close(self):
+        if self.fmt == "json":
+            self.file.write("\n]\n")
+        self.file.close()
+
+
+async def export_table(db: Database, table: str, path: Path, fmt: str = "csv", compress: bool = False,
+                       date_from: Optional[str] = None, date_to: Optional[str] = None,
+                       progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+                       progress_interval: float = 3.0, batch_size: int = 1000) -> dict:
+    """
+    Потоковая выгрузка таблицы в файл
+
+    Строки читаются страницами по batch_size и сразу дописываются в файл
+    (запись и сжатие — в отдельном потоке), поэтому память не зависит от
+    размера выгрузки. Файл пишется во временный path.partial и
+    переименовывается в конце; при ошибке или отмене path.partial удаляется.
+
+    Args:
+        table: orders, users или payments
+        path: Итоговый файл
+        fmt: csv или json (массив объектов)
+        compress: Сжимать gzip
+        date_from, date_to: Период [date_from, date_to) в формате ГГГГ-ММ-ДД
+        progress: Корутина progress(выгружено, всего), вызывается не чаще
+            раза в progress_interval секунд
+
+    Returns:
+        Словарь: path, rows, size, duration
+    """
+    if table not in EXPORT_TABLES or fmt not in FORMATS:
+        raise ValueError(f"Неизвестная выгрузка: {table}.{fmt}")
+
+    started = time.perf_counter()
+    total = await db.count_export_rows(table, date_from, date_to)
+    columns = [column.strip() for column in EXPORT_TABLES[table][1].split(",")]
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + ".partial")
+    writer = await asyncio.to_thread(_Writer, partial, fmt, columns, compress)
+    reported = time.monotonic()
+    try:
+        try:
+            async for rows in db.iter_export_rows(table, date_from, date_to, batch_size):
+                await asyncio.to_thread(writer.write, rows)
+                if progress and time.monotonic() - reported >= progress_interval:
+                    reported = time.monotonic()
+                    await progress(writer.rows, total)
+        finally:
+            await asyncio.to_thread(writer.close)
+        partial.replace(path)
+    except BaseException:
+        # Недописанный файл с персональными данными не остается на диске (в том числе при отмене)
+        partial.unlink(missing_ok=True)
+        raise
+
+    return {
+        'path': path,
+        'rows': writer.rows,
+        'size': path.stat().st_size,
+        'duration': time.perf_counter() - started,
+    }
+
+
+def command(args) -> int:
+    """Подкоманда export"""
+    path = Path(args.output or export_filename(args.table, args.format, args.gzip, args.date_from, args.date_to))
+
+    async def report(done: int, total: int):
+        print(f"  {done}/{total}")
+
+    db = Database(args.db, archive_path=args.archive)
+    result = asyncio.run(export_table(
+        db, args.table, path, args.format, args.gzip, args.date_from, args.date_to, progress=report
+    ))
+    print(
+        f"{result['path']}: {result['rows']} строк, {result['size'] / 2 ** 20:.1f} МБ "
+        f"за {result['duration']:.1f} с"
+    )
+    return 0
+
+
+def register(subparsers):
+    """Регистрация подкоманды export"""
+    parser = subparsers.add_parser("export", help="Выгрузить заказы, пользователей или платежи в CSV/JSON")
+    parser.add_argument("table", choices=sorted(EXPORT_TABLES))
+    parser.add_argument("--db", default="data/shop.db", help="База данных")
+    parser.add_argument("--archive", default="data/archive.db", help="Архив (для заказов)")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--gzip", action="store_true", help="Сжать gzip")
+    parser.add_argument("--from", dest="date_from", metavar="ГГГГ-ММ-ДД", help="Начало периода")
+    parser.add_argument("--to", dest="date_to", metavar="ГГГГ-ММ-ДД", help="Конец периода (не включая)")
+    parser.add_argument("--output", help="Файл выгрузки")
+    parser.set_defaults(func=command)
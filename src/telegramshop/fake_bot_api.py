@@ -0,0 +1,293 @@
+"""
+Локальный сервер, имитирующий Telegram Bot API (для бенчмарков и отладки)
+"""
+import asyncio
+import itertools
+import json
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    """
+    Имитация Bot API на aiohttp
+
+    Поддерживаются методы, которыми пользуется бот: getMe, getUpdates
+    (long polling), sendMessage, sendDocument, copyMessage, editMessageText,
+    deleteMessage, getChatMember, getFile с загрузкой файла и
+    answerCallbackQuery. Вызовы считаются в calls, параметры последних
+    вызовов лежат в requests. Отправка в чаты из blocked_chats отвечает
+    403, как пользователю, заблокировавшему бота.
+
+    Args:
+        latency: Задержка ответа на каждый метод, кроме getUpdates (сек)
+        retry_after_every: Каждый N-й вызов отвечает 429 с retry_after (0 — выключено)
+        retry_after: Значение retry_after в ответах 429
+        member_status: Статус пользователя в getChatMember по умолчанию
+    """
+
+    BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+    SEND_METHODS = {"sendMessage", "sendDocument", "sendPhoto", "copyMessage"}
+
+    def __init__(self, latency: float = 0.0, retry_after_every: int = 0, retry_after: int = 1,
+                 member_status: str = "member", keep_requests: int = 1000):
+        self.latency = latency
+        self.retry_after_every = retry_after_every
+        self.retry_after = retry_after
+        self.member_status = member_status
+        self.keep_requests = keep_requests
+
+        self.calls: Counter = Counter()
+        self.requests: List[tuple] = []
+        self.chat_members: Dict[tuple, str] = {}
+        self.files: Dict[str, bytes] = {}
+        self.blocked_chats: Set[int] = set()
+
+        self._updates: List[dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._has_updates = asyncio.Event()
+        self._call_event = asyncio.Event()
+        self._injected: List[Optional[str]] = []
+        self._total_calls = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.url: Optional[str] = None
+
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self._handle)
+        self.app.router.add_get("/file/bot{token}/{path:.+}", self._download)
+
+        self._methods = {
+            "getMe": self._get_me,
+            "getUpdates": self._get_updates,
+            "deleteWebhook": self._true,
+            "sendMessage": self._send_message,
+            "sendDocument": self._send_message,
+            "sendPhoto": self._send_message,
+            "copyMessage": self._copy_message,
+            "editMessageText": self._send_message,
+            "editMessageReplyMarkup": self._send_message,
+            "deleteMessage": self._true,
+            "answerCallbackQuery": self._true,
+            "getChatMember": self._get_chat_member,
+            "getFile": self._get_file,
+        }
+
+    # Запуск и остановка
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запуск сервера. Возвращает базовый адрес для BOT_API_URL"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        """Остановка сервера (открытые long polling запросы завершаются сразу)"""
+        self._has_updates.set()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # Управление из тестов
+
+    def inject_retry_after(self, method: Optional[str] = None, count: int = 1):
+        """Следующие count вызовов method (или любых методов) ответят 429"""
+        self._injected.extend([method] * count)
+
+    def add_file(self, content: bytes, file_path: Optional[str] = None) -> str:
+        """Регистрация файла для getFile. Возвращает file_id"""
+        file_id = uuid.uuid4().hex
+        self.files[file_id] = content
+        self.files[file_path or f"documents/{file_id}"] = content
+        return file_id
+
+    def push_update(self, update: dict) -> int:
+        """Добавление обновления в очередь getUpdates"""
+        update = dict(update)
+        update.setdefault("update_id", next(self._update_ids))
+        self._updates.append(update)
+        self._has_updates.set()
+        return update["update_id"]
+
+    def message_update(self, user_id: int, text: Optional[str], **fields) -> dict:
+        """Обновление с сообщением от пользователя (text=None — без текста, например фото в fields)"""
+        if text is not None:
+            fields["text"] = text
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                **fields
+            }
+        }
+
+    def callback_update(self, user_id: int, data: str, message_id: Optional[int] = None) -> dict:
+        """Обновление с нажатием inline-кнопки под сообщением бота"""
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": uuid.uuid4().hex,
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id or next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": self.BOT_USER,
+                    "text": "..."
+                }
+            }
+        }
+
+    async def wait_calls(self, method: str, count: int, timeout: float = 30.0):
+        """Ожидание, пока method будет вызван не менее count раз"""
+        deadline = time.monotonic() + timeout
+        while self.calls[method] < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"{method}: {self.calls[method]} из {count} вызовов")
+            self._call_event.clear()
+            try:
+                await asyncio.wait_for(self._call_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    # Обработка запросов
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._read_params(request)
+
+        if method != "getUpdates":
+            self._total_calls += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self._should_limit(method):
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after}
+                })
+
+        if method in self.SEND_METHODS and params.get("chat_id") in self.blocked_chats:
+            self.calls[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 403,
+                "description": "Forbidden: bot was blocked by the user"
+            }, status=403)
+
+        handler = self._methods.get(method)
+        if handler is None:
+            return web.json_response(
+                {"ok": False, "error_code": 404, "description": "Not Found: method not found"}
+            )
+
+        result = await handler(params)
+        self.calls[method] += 1
+        self.requests.append((method, params))
+        if len(self.requests) > self.keep_requests:
+            del self.requests[:len(self.requests) - self.keep_requests]
+        self._call_event.set()
+        return web.json_response({"ok": True, "result": result})
+
+    def _should_limit(self, method: str) -> bool:
+        for index, target in enumerate(self._injected):
+            if target is None or target == method:
+                del self._injected[index]
+                return True
+        return bool(self.retry_after_every) and self._total_calls % self.retry_after_every == 0
+
+    @staticmethod
+    async def _read_params(request: web.Request) -> Dict[str, Any]:
+        """Параметры запроса: сложные значения aiogram передает JSON-строками"""
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            else:
+                value = value.file.read()
+            params[key] = value
+        return params
+
+    async def _download(self, request: web.Request) -> web.Response:
+        content = self.files.get(request.match_info["path"])
+        if content is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=content)
+
+    # Методы Bot API
+
+    async def _true(self, params: dict):
+        return True
+
+    async def _get_me(self, params: dict):
+        return self.BOT_USER
+
+    async def _get_updates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        # Обновления с id меньше offset подтверждены клиентом
+        if offset:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+
+        if not self._updates and timeout:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return self._updates[:limit]
+
+    def _message(self, chat_id: int, **fields) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self.BOT_USER,
+            **fields
+        }
+
+    async def _send_message(self, params: dict):
+        fields = {"text": params["text"]} if isinstance(params.get("text"), str) else {}
+        return self._message(params.get("chat_id", 0), **fields)
+
+    async def _copy_message(self, params: dict):
+        return {"message_id": next(self._message_ids)}
+
+    async def _get_chat_member(self, params: dict):
+        user_id = params["user_id"]
+        status = self.chat_members.get((params["chat_id"], user_id), self.member_status)
+        return {
+            "status": status,
+            "user": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+        }
+
+    async def _get_file(self, params: dict):
+        file_id = params["file_id"]
+        content = self.files.get(file_id, b"")
+        return {
+            "file_id": file_id,
+            "file_unique_id": file_id[:16],
+            "file_size": len(content),
+            "file_path": f"documents/{file_id}"
+        }
@@ -0,0 +1,152 @@
+"""
+Буферизованный FSM-контекст: одна запись в хранилище на обновление
+"""
+import copy
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType
+from aiogram.types import TelegramObject
+
+
+class FSMStats:
+    """
+    Счетчики обращений к хранилищу FSM
+
+    requested_ops — сколько операций с хранилищем сделали бы обработчики
+    с обычным FSMContext, storage_ops — сколько выполнено на самом деле.
+    """
+
+    def __init__(self):
+        self.updates = 0
+        self.requested_ops = 0
+        self.storage_ops = 0
+
+    def per_update(self) -> Dict[str, float]:
+        """Среднее количество операций на одно обновление"""
+        updates = self.updates or 1
+        return {
+            'updates': self.updates,
+            'before': self.requested_ops / updates,
+            'after': self.storage_ops / updates
+        }
+
+
+class BufferedFSMContext(FSMContext):
+    """
+    FSM-контекст, накапливающий изменения в памяти
+
+    Состояние берется из уже загруженного raw_state, данные читаются из
+    хранилища не более одного раза, а все изменения за обновление
+    записываются одной операцией в flush().
+    """
+
+    def __init__(self, context: FSMContext, raw_state: Optional[str], stats: FSMStats):
+        super().__init__(storage=context.storage, key=context.key)
+        self._stats = stats
+        self._state = raw_state
+        self._data: Optional[Dict[str, Any]] = None
+        self._state_dirty = False
+        self._data_dirty = False
+
+    async def _load_data(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = await self.storage.get_data(key=self.key)
+            self._stats.storage_ops += 1
+        return self._data
+
+    async def set_state(self, state: StateType = None) -> None:
+        self._stats.requested_ops += 1
+        self._state = state.state if isinstance(state, State) else state
+        self._state_dirty = True
+
+    async def get_state(self) -> Optional[str]:
+        self._stats.requested_ops += 1
+        return self._state
+
+    async def set_data(self, data: Mapping[str, Any]) -> None:
+        self._stats.requested_ops += 1
+        self._data = dict(data)
+        self._data_dirty = True
+
+    async def get_data(self) -> Dict[str, Any]:
+        self._stats.requested_ops += 1
+        # Копия, как у обычного хранилища: изменения вне update_data не должны попадать в буфер
+        return copy.deepcopy(await self._load_data())
+
+    async def get_value(self, key: str, default: Any = None) -> Any:
+        self._stats.requested_ops += 1
+        return copy.deepcopy((await self._load_data()).get(key, default))
+
+    async def update_data(self, data: Optional[Mapping[str, Any]] = None, **kwargs: Any) -> Dict[str, Any]:
+        self._stats.requested_ops += 1
+        if data:
+            kwargs.update(data)
+        current = await self._load_data()
+        current.update(kwargs)
+        self._data_dirty = True
+        return copy.deepcopy(current)
+
+    async def clear(self) -> None:
+        self._stats.requested_ops += 2
+        self._state = None
+        self._data = {}
+        self._state_dirty = True
+        self._data_dirty = True
+
+    async def flush(self):
+        """Запись накопленных изменений в хранилище"""
+        if not (self._state_dirty or self._data_dirty):
+            return
+
+        if self._state_dirty and self._data_dirty and hasattr(self.storage, "set_record"):
+            await self.storage.set_record(self.key, self._state, self._data)
+            self._stats.storage_ops += 1
+        else:
+            if self._state_dirty:
+                await self.storage.set_state(key=self.key, state=self._state)
+                self._stats.storage_ops += 1
+            if self._data_dirty:
+                await self.storage.set_data(key=self.key, data=self._data)
+                self._stats.storage_ops += 1
+
+        self._state_dirty = False
+        self._data_dirty = False
+
+
+class BufferedFSMMiddleware(BaseMiddleware):
+    """
+    Подменяет FSMContext буферизованным и сбрасывает изменения в конце обновления
+
+    Регистрируется как outer middleware на update после встроенного
+    FSMContextMiddleware диспетчера, поэтому запись выполняется внутри
+    изоляции событий того же ключа. flush записывает состояние и данные
+    целиком, поэтому диспетчер должен быть создан с
+    events_isolation=SimpleEventIsolation(): со стандартной
+    DisabledEventIsolation два параллельных обновления одного чата
+    прочитали бы одну запись, и изменения первого затерла бы запись второго.
+    """
+
+    def __init__(self, stats: Optional[FSMStats] = None):
+        self.stats = stats or FSMStats()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        context = data.get("state")
+        data["fsm_stats"] = self.stats
+        if context is None:
+            return await handler(event, data)
+
+        self.stats.updates += 1
+        buffered = BufferedFSMContext(context, data.get("raw_state"), self.stats)
+        data["state"] = buffered
+        try:
+            return await handler(event, data)
+        finally:
+            await buffered.flush()
@@ -0,0 +1,227 @@
+"""
+Хранилище FSM в базе данных SQLite с отложенной записью
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Mapping, Optional, Set
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from .database import connect
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Record:
+    """Состояние и данные одного ключа в памяти"""
+
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.touched = time.monotonic()
+
+    @property
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в таблице fsm_states
+
+    Чтения обслуживаются из памяти после первой загрузки ключа. Записи
+    (set_state, set_data, update_data) только меняют запись в памяти и
+    помечают ключ измененным; фоновая задача раз в flush_interval секунд
+    сбрасывает все измененные ключи одной транзакцией. Так несколько
+    update_data за одно обновление превращаются в одну запись в базу.
+
+    Сессии, не менявшиеся дольше ttl секунд, удаляются из базы и памяти.
+    """
+
+    def __init__(self, db_path: str, key_builder: Optional[KeyBuilder] = None,
+                 flush_interval: float = 1.0, ttl: int = 86400, sweep_interval: float = 600.0):
+        self.db_path = db_path
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+
+        self._records: Dict[str, _Record] = {}
+        self._dirty: Set[str] = set()
+        self._flush_lock = asyncio.Lock()
+        self._tasks: list = []
+
+        # Счетчики обращений к базе
+        self.stats = {'reads': 0, 'writes': 0, 'flushes': 0, 'swept': 0}
+
+    def _key(self, key: StorageKey) -> str:
+        return self.key_builder.build(key)
+
+    async def _load(self, key: StorageKey) -> _Record:
+        """Получение записи из памяти или из базы"""
+        storage_key = self._key(key)
+        record = self._records.get(storage_key)
+        if record is not None:
+            record.touched = time.monotonic()
+            return record
+
+        async with connect(self.db_path) as db:
+            async with db.execute("""
+                SELECT state, data FROM fsm_states WHERE storage_key = ?
+            """, (storage_key,)) as cursor:
+                row = await cursor.fetchone()
+        self.stats['reads'] += 1
+
+        # Пока ждали базу, ключ мог загрузить другой обработчик
+        record = self._records.get(storage_key)
+        if record is None:
+            record = _Record(row[0], json.loads(row[1]) if row and row[1] else {}) if row else _Record()
+            self._records[storage_key] = record
+        return record
+
+    def _mark_dirty(self, key: StorageKey, record: _Record):
+        record.touched = time.monotonic()
+        self._dirty.add(self._key(key))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._load(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record = await self._load(key)
+        record.data = dict(data)
+        self._mark_dirty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._load(key)).data)
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        record = await self._load(key)
+        record.data.update(data)
+        self._mark_dirty(key, record)
+        return dict(record.data)
+
+    async def set_record(self, key: StorageKey, state: StateType, data: Mapping[str, Any]) -> None:
+        """Запись состояния и данных одной операцией"""
+        record = await self._load(key)
+        record.state = state.state if isinstance(state, State) else state
+        record.data = dict(data)
+        self._mark_dirty(key, record)
+
+    async def flush(self) -> int:
+        """
+        Сброс измененных ключей в базу одной транзакцией
+
+        Returns:
+            Количество записанных ключей
+        """
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+
+            dirty, self._dirty = self._dirty, set()
+            upserts = []
+            deletes = []
+            for storage_key in dirty:
+                record = self._records.get(storage_key)
+                if record is None or record.is_empty:
+                    deletes.append((storage_key,))
+                else:
+                    upserts.append((
+                        storage_key,
+                        record.state,
+                        json.dumps(record.data, ensure_ascii=False, default=str)
+                    ))
+
+            try:
+                async with connect(self.db_path) as db:
+                    if upserts:
+                        await db.executemany("""
+                            INSERT INTO fsm_states (storage_key, state, data, updated_at)
+                            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                            ON CONFLICT (storage_key) DO UPDATE SET
+                                state = excluded.state,
+                                data = excluded.data,
+                                updated_at = excluded.updated_at
+                        """, upserts)
+                    if deletes:
+                        await db.executemany("""
+                            DELETE FROM fsm_states WHERE storage_key = ?
+                        """, deletes)
+                    await db.commit()
+            except Exception:
+                # Вернем ключи в очередь, чтобы не потерять изменения
+                self._dirty |= dirty
+                raise
+
+            self.stats['writes'] += len(dirty)
+            self.stats['flushes'] += 1
+            return len(dirty)
+
+    async def sweep(self) -> int:
+        """Удаление сессий, не менявшихся дольше ttl. Возвращает число удаленных строк"""
+        async with connect(self.db_path) as db:
+            cursor = await db.execute("""
+                DELETE FROM fsm_states WHERE updated_at < datetime('now', ?)
+            """, (f"-{int(self.ttl)} seconds",))
+            await db.commit()
+            deleted = cursor.rowcount
+
+        # Вытесняем из памяти неизмененные записи, к которым давно не обращались
+        deadline = time.monotonic() - self.ttl
+        for storage_key in [
+            storage_key for storage_key, record in self._records.items()
+            if record.touched < deadline and storage_key not in self._dirty
+        ]:
+            del self._records[storage_key]
+
+        self.stats['swept'] += deleted
+        if deleted:
+            logger.info("Удалено устаревших FSM-сессий: %s", deleted)
+        return deleted
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Ошибка записи FSM-состояний")
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Ошибка очистки FSM-состояний")
+            await asyncio.sleep(self.sweep_interval)
+
+    def start(self):
+        """Запуск фоновых задач записи и очистки"""
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._flush_loop()),
+                asyncio.create_task(self._sweep_loop())
+            ]
+
+    async def close(self) -> None:
+        """Остановка фоновых задач и финальный сброс изменений"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
@@ -1,19 +1,23 @@
 """
 Пакет обработчиков бота
 """
+import importlib
+
 from aiogram import Router
-from . import start, profile, info, shop, admin
+
+
+# Модули обработчиков в порядке подключения. Импортируются при сборке
+# роутера, а не при импорте пакета, чтобы не грузить админку и клавиатуры
+# в процессах, которым обработчики не нужны (бенчмарки, утилиты)
+HANDLER_MODULES = ("start", "admin", "shop", "profile", "info")
 
 
 def get_handlers_router() -> Router:
     """Получение роутера со всеми обработчиками"""
     router = Router()
     
-    router.include_router(start.router)
-    router.include_router(admin.router)
-    router.include_router(shop.router)
-    router.include_router(profile.router)
-    router.include_router(info.router)
+    for name in HANDLER_MODULES:
+        module = importlib.import_module(f".{name}", __name__)
+        router.include_router(module.router)
     
     return router
-
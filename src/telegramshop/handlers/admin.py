@@ -1,14 +1,27 @@
 """
 Обработчики админ-панели
 """
-import asyncio
+import html
+import io
+from dataclasses import asdict
+from pathlib import Path
+from typing import Optional
+
 from aiogram import Router, F
 from aiogram.filters import Command, StateFilter
-from aiogram.types import Message, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.fsm.context import FSMContext
 
+from .. import analytics, broadcasts, exports
+from ..backup import BackupError, BackupService
 from ..config import BotConfig
 from ..database import Database
+from ..fsm_context import FSMStats
+from ..lifecycle import Lifecycle
+from ..scheduler import Scheduler
+from ..logs import count_failure, failures
+from ..utils import delete_messages
 from ..states import (
     AddCategoryStates,
     AddProductStates,
@@ -18,7 +31,8 @@ from ..states import (
     BroadcastStates,
     EditInfoTextStates,
     EditCategoryStates,
-    EditProductStates
+    EditProductStates,
+    ExportStates
 )
 from ..keyboards import (
     get_admin_main_keyboard,
@@ -31,11 +45,19 @@ from ..keyboards import (
     get_admin_users_list_keyboard,
     get_admin_user_actions_keyboard,
     get_broadcast_confirm_keyboard,
+    get_broadcast_buttons_edit_keyboard,
+    get_broadcast_segments_keyboard,
+    get_broadcast_categories_keyboard,
+    get_broadcast_days_keyboard,
     get_admin_select_category_keyboard,
     get_admin_info_texts_keyboard,
     get_admin_info_text_actions_keyboard,
     get_edit_category_fields_keyboard,
-    get_edit_product_fields_keyboard
+    get_edit_product_fields_keyboard,
+    get_admin_export_tables_keyboard,
+    get_admin_export_period_keyboard,
+    get_admin_export_format_keyboard,
+    get_admin_analytics_keyboard
 )
 
 
@@ -54,11 +76,7 @@ async def cancel_operation(callback: CallbackQuery, state: FSMContext, bot):
     
     # Удаляем промежуточные сообщения
     messages_to_delete = data.get('messages_to_delete', [])
-    for msg_id in messages_to_delete:
-        try:
-            await bot.delete_message(callback.message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(bot, callback.message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение
     first_bot_msg = data.get('first_bot_message_id')
@@ -315,11 +333,7 @@ async def admin_edit_category_name_save(message: Message, state: FSMContext, db:
     messages_to_delete = data.get('messages_to_delete', [])
     messages_to_delete.append(message.message_id)
     
-    for msg_id in messages_to_delete:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение бота
     first_bot_msg = data.get('first_bot_message_id')
@@ -388,11 +402,7 @@ async def admin_edit_category_desc_save(message: Message, state: FSMContext, db:
     messages_to_delete = data.get('messages_to_delete', [])
     messages_to_delete.append(message.message_id)
     
-    for msg_id in messages_to_delete:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение бота
     first_bot_msg = data.get('first_bot_message_id')
@@ -470,11 +480,7 @@ async def admin_add_category_description(message: Message, state: FSMContext, db
     messages_to_delete = data.get('messages_to_delete', [])
     messages_to_delete.append(message.message_id)  # Последнее сообщение пользователя
     
-    for msg_id in messages_to_delete:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение бота
     first_bot_msg = data.get('first_bot_message_id')
@@ -693,11 +699,7 @@ async def admin_edit_product_name_save(message: Message, state: FSMContext, db:
     messages_to_delete = data.get('messages_to_delete', [])
     messages_to_delete.append(message.message_id)
     
-    for msg_id in messages_to_delete:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение бота
     first_bot_msg = data.get('first_bot_message_id')
@@ -766,11 +768,7 @@ async def admin_edit_product_desc_save(message: Message, state: FSMContext, db:
     messages_to_delete = data.get('messages_to_delete', [])
     messages_to_delete.append(message.message_id)
     
-    for msg_id in messages_to_delete:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение бота
     first_bot_msg = data.get('first_bot_message_id')
@@ -845,11 +843,7 @@ async def admin_edit_product_price_save(message: Message, state: FSMContext, db:
     # Удаляем промежуточные сообщения
     messages_to_delete.append(message.message_id)
     
-    for msg_id in messages_to_delete:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение бота
     first_bot_msg = data.get('first_bot_message_id')
@@ -992,11 +986,7 @@ async def admin_add_product_price(message: Message, state: FSMContext, db: Datab
     
     # Удаляем промежуточные сообщения
     messages_to_delete.append(message.message_id)
-    for msg_id in messages_to_delete:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение бота
     first_bot_msg = data.get('first_bot_message_id')
@@ -1080,11 +1070,7 @@ async def admin_load_items_text(message: Message, state: FSMContext, db: Databas
     messages_to_delete = data.get('messages_to_delete', [])
     messages_to_delete.append(message.message_id)
     
-    for msg_id in messages_to_delete:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение
     first_bot_msg = data.get('first_bot_message_id')
@@ -1114,25 +1100,18 @@ async def admin_load_items_file(message: Message, state: FSMContext, db: Databas
     file = await bot.get_file(message.document.file_id)
     file_content = await bot.download_file(file.file_path)
     
-    # Читаем содержимое
-    text = file_content.read().decode('utf-8')
-    items = [line.strip() for line in text.split('\n') if line.strip()]
+    # Строки файла читаются и загружаются пачками, без копии всего текста в памяти
+    count = await db.add_product_items_bulk(product_id, io.TextIOWrapper(file_content, encoding='utf-8'))
     
-    if not items:
+    if not count:
         await message.answer("❌ Файл пуст или не содержит данных")
         return
     
-    count = await db.add_product_items_bulk(product_id, items)
-    
     # Удаляем промежуточные сообщения
     messages_to_delete = data.get('messages_to_delete', [])
     messages_to_delete.append(message.message_id)
     
-    for msg_id in messages_to_delete:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение
     first_bot_msg = data.get('first_bot_message_id')
@@ -1310,18 +1289,14 @@ async def admin_change_balance_amount(message: Message, state: FSMContext, db: D
         await state.clear()
         return
     
-    await db.update_user_balance(user_id, amount)
+    await db.update_user_balance(user_id, amount, reason="admin", reference_id=message.from_user.id)
     
     action = "пополнен" if amount > 0 else "списан"
     new_balance = user['balance'] + amount
     
     # Удаляем промежуточные сообщения
     messages_to_delete.append(message.message_id)
-    for msg_id in messages_to_delete:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение
     first_bot_msg = data.get('first_bot_message_id')
@@ -1351,6 +1326,51 @@ async def admin_change_balance_amount(message: Message, state: FSMContext, db: D
     await state.clear()
 
 
+@router.callback_query(F.data.startswith("admin_ledger_"))
+async def admin_user_ledger(callback: CallbackQuery, config: BotConfig, db: Database):
+    """Журнал изменений баланса пользователя"""
+    if not is_admin(callback.from_user.id, config):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    user_id = int(callback.data.split("_")[2])
+    entries = await db.get_balance_ledger(user_id, limit=15)
+    
+    reason_names = {
+        'opening': 'Начальный баланс',
+        'purchase': 'Покупка',
+        'admin': 'Администратор',
+        'payment': 'Пополнение',
+        'adjustment': 'Корректировка'
+    }
+    
+    if not entries:
+        text = "🧾 <b>Журнал баланса</b>\n\nЗаписей нет."
+    else:
+        text = f"🧾 <b>Журнал баланса</b> (ID: <code>{user_id}</code>)\n\n"
+        for entry in entries:
+            reason = reason_names.get(entry['reason'], entry['reason'])
+            text += (
+                f"{entry['created_at']} | {entry['amount']:+.2f} руб. → "
+                f"{entry['balance_after']:.2f} руб. ({reason})\n"
+            )
+    
+    from ..keyboards import InlineKeyboardMarkup, InlineKeyboardButton
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="◀️ Назад",
+                    callback_data=f"admin_user_{user_id}"
+                )
+            ]
+        ]
+    )
+    
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+
 @router.callback_query(F.data == "admin_search_user")
 async def admin_search_user_start(callback: CallbackQuery, config: BotConfig, state: FSMContext):
     """Начало поиска пользователя"""
@@ -1383,11 +1403,7 @@ async def admin_search_user_query(message: Message, state: FSMContext, db: Datab
     messages_to_delete = data.get('messages_to_delete', [])
     messages_to_delete.append(message.message_id)
     
-    for msg_id in messages_to_delete:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
     
     first_bot_msg = data.get('first_bot_message_id')
     
@@ -1484,7 +1500,8 @@ async def admin_search_user_query(message: Message, state: FSMContext, db: Datab
 # Статистика
 
 @router.callback_query(F.data == "admin_stats")
-async def admin_statistics(callback: CallbackQuery, config: BotConfig, db: Database):
+async def admin_statistics(callback: CallbackQuery, config: BotConfig, db: Database, bot,
+                           fsm_stats: Optional[FSMStats] = None):
     """Показ статистики"""
     if not is_admin(callback.from_user.id, config):
         await callback.answer("❌ Нет доступа", show_alert=True)
@@ -1502,6 +1519,27 @@ async def admin_statistics(callback: CallbackQuery, config: BotConfig, db: Datab
         f"📥 Товаров в наличии: {stats['items_in_stock']}"
     )
     
+    if fsm_stats and fsm_stats.updates:
+        fsm = fsm_stats.per_update()
+        text += (
+            f"\n\n🗂 FSM: {fsm['updates']} обновлений, операций с хранилищем на обновление: "
+            f"{fsm['before']:.2f} → {fsm['after']:.2f}"
+        )
+    
+    api_stats = getattr(bot.session, "stats", None)
+    if api_stats and api_stats.requests:
+        latency = api_stats.latency()
+        text += (
+            f"\n\n🌐 Bot API: {api_stats.requests} запросов, в работе {api_stats.in_flight}, "
+            f"ошибок {api_stats.errors}, повторов после 429: {api_stats.retries}\n"
+            f"⏱ Задержка p50/p95/max: {latency['p50']:.0f}/{latency['p95']:.0f}/{latency['max']:.0f} мс"
+        )
+    
+    if failures:
+        text += "\n\n⚠️ Подавленные ошибки: " + ", ".join(
+            f"{kind}: {count}" for kind, count in sorted(failures.items())
+        )
+    
     from ..keyboards import InlineKeyboardMarkup, InlineKeyboardButton
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -1511,6 +1549,18 @@ async def admin_statistics(callback: CallbackQuery, config: BotConfig, db: Datab
                     callback_data="admin_stats"
                 )
             ],
+            [
+                InlineKeyboardButton(
+                    text="📈 Аналитика продаж",
+                    callback_data="admin_analytics_day"
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    text="🧾 Сверка балансов",
+                    callback_data="admin_verify_balances"
+                )
+            ],
             [
                 InlineKeyboardButton(
                     text="◀️ Назад в меню",
@@ -1524,70 +1574,530 @@ async def admin_statistics(callback: CallbackQuery, config: BotConfig, db: Datab
     await callback.answer()
 
 
+@router.callback_query(F.data == "admin_verify_balances")
+async def admin_verify_balances(callback: CallbackQuery, config: BotConfig, db: Database):
+    """Сверка балансов пользователей с журналом"""
+    if not is_admin(callback.from_user.id, config):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    drifts = await db.verify_balances()
+    
+    if not drifts:
+        text = "🧾 <b>Сверка балансов</b>\n\n✅ Расхождений не найдено."
+    else:
+        text = (
+            f"🧾 <b>Сверка балансов</b>\n\n"
+            f"⚠️ Найдено расхождений: {len(drifts)}\n\n"
+        )
+        for row in drifts[:20]:
+            text += (
+                f"ID <code>{row['user_id']}</code>: баланс {row['balance']:.2f}, "
+                f"по журналу {row['ledger_total']:.2f} (Δ {row['drift']:+.2f})\n"
+            )
+    
+    from ..keyboards import InlineKeyboardMarkup, InlineKeyboardButton
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="◀️ Назад к статистике",
+                    callback_data="admin_stats"
+                )
+            ]
+        ]
+    )
+    
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_analytics_"))
+async def admin_analytics(callback: CallbackQuery, config: BotConfig, db: Database):
+    """Продажи по товарам и категориям за период и прогноз окончания остатков"""
+    if not is_admin(callback.from_user.id, config):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    granularity = callback.data.split("_")[2]
+    if granularity not in analytics.GRANULARITIES:
+        await callback.answer("❌ Неизвестный период", show_alert=True)
+        return
+    
+    report = await db.get_sales_report(granularity)
+    forecast = await db.get_stockout_forecast()
+    totals = report['totals']
+    
+    def conversion(row: dict) -> str:
+        return f"{row['orders'] / row['views'] * 100:.1f}%" if row['views'] else "—"
+    
+    text = (
+        f"📈 <b>Аналитика продаж за {analytics.GRANULARITIES[granularity][1]}</b>\n"
+        f"<i>с {report['since']} UTC</i>\n\n"
+        f"📦 Заказов: {totals['orders']}, штук: {totals['units']}\n"
+        f"💰 Выручка: {totals['revenue']:.2f} руб.\n"
+        f"👁 Просмотров: {totals['views']}, конверсия: {conversion(totals)}\n"
+    )
+    
+    if report['series']:
+        text += "\n🕒 <b>По периодам</b> (заказов / выручка):\n"
+        for row in report['series'][-12:]:
+            text += f"{row['bucket']}: {row['orders']} / {row['revenue']:.2f}\n"
+    
+    if report['categories']:
+        text += "\n📂 <b>Категории</b>:\n"
+        for row in report['categories'][:10]:
+            text += (
+                f"{html.escape(row['name'])}: {row['revenue']:.2f} руб., "
+                f"{row['units']} шт., конверсия {conversion(row)}\n"
+            )
+    
+    if report['products']:
+        text += "\n🏆 <b>Лидеры продаж</b>:\n"
+        for index, row in enumerate(report['products'], 1):
+            text += (
+                f"{index}. {html.escape(row['name'])}: {row['revenue']:.2f} руб., "
+                f"{row['units']} шт., конверсия {conversion(row)}\n"
+            )
+    else:
+        text += "\nПродаж за период нет.\n"
+    
+    if forecast:
+        text += "\n⏳ <b>Закончатся скоро</b> (по продажам за 7 дней):\n"
+        for row in forecast:
+            text += (
+                f"{html.escape(row['name'])}: осталось {row['stock_count']} шт., "
+                f"≈{row['days_left']:.1f} дн.\n"
+            )
+    
+    try:
+        await callback.message.edit_text(
+            text, reply_markup=get_admin_analytics_keyboard(
+                {key: titles[0] for key, titles in analytics.GRANULARITIES.items()}, granularity
+            )
+        )
+    except Exception as e:
+        # Тот же период без новых продаж — сообщение не изменилось
+        count_failure("edit_message", e)
+    await callback.answer()
+
+
+# Резервное копирование
+
+@router.message(Command("backup"))
+async def admin_backup(message: Message, config: BotConfig, backups: BackupService):
+    """Внеочередная резервная копия базы"""
+    if not is_admin(message.from_user.id, config):
+        await message.answer("❌ У вас нет доступа к админ-панели")
+        return
+    
+    status = await message.answer("⏳ Создаю резервную копию базы...")
+    try:
+        result = await backups.backup()
+    except BackupError as e:
+        await status.edit_text(f"❌ Копия не прошла проверку целостности:\n<code>{e}</code>")
+        return
+    except Exception:
+        await status.edit_text("❌ Не удалось создать резервную копию, подробности в логах")
+        raise
+    
+    await status.edit_text(
+        "💾 <b>Резервная копия создана</b>\n\n"
+        f"📄 <code>{result['path']}</code>\n"
+        f"📦 Размер: {result['db_size'] / 2 ** 20:.1f} МБ → {result['size'] / 2 ** 20:.1f} МБ (gzip)\n"
+        f"⏱ Время: {result['duration']:.1f} с (копирование {result['copy_duration']:.1f} с)\n"
+        f"✅ integrity_check: ok\n"
+        f"🗂 Хранится снимков: {len(backups.snapshots())}"
+    )
+
+
+# Выгрузка данных
+
+def _export_period_text(date_from: Optional[str], date_to: Optional[str]) -> str:
+    if not date_from and not date_to:
+        return "за все время"
+    return f"с {date_from or 'начала'} по {date_to or 'сегодня'} (не включая)"
+
+
+@router.callback_query(F.data == "admin_export")
+async def admin_export_menu(callback: CallbackQuery, config: BotConfig, state: FSMContext):
+    """Меню выгрузки данных"""
+    if not is_admin(callback.from_user.id, config):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    await state.clear()
+    await callback.message.edit_text(
+        "📤 <b>Выгрузка данных</b>\n\n"
+        "Выберите, что выгрузить:",
+        reply_markup=get_admin_export_tables_keyboard(exports.TABLE_TITLES)
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_export_t_"))
+async def admin_export_table(callback: CallbackQuery, config: BotConfig, state: FSMContext):
+    """Выбор периода выгрузки"""
+    if not is_admin(callback.from_user.id, config):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    await state.clear()
+    table = callback.data.split("_")[3]
+    await callback.message.edit_text(
+        f"📤 <b>Выгрузка: {exports.TABLE_TITLES[table]}</b>\n\n"
+        f"Выберите период:",
+        reply_markup=get_admin_export_period_keyboard(table)
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_export_p_"))
+async def admin_export_period(callback: CallbackQuery, config: BotConfig):
+    """Выбор формата для готового периода"""
+    if not is_admin(callback.from_user.id, config):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    table, days = callback.data.split("_")[3:5]
+    date_from, date_to = exports.period_days(int(days)) if int(days) else (None, None)
+    await callback.message.edit_text(
+        f"📤 <b>Выгрузка: {exports.TABLE_TITLES[table]}</b>\n"
+        f"Период: {_export_period_text(date_from, date_to)}\n\n"
+        f"Выберите формат:",
+        reply_markup=get_admin_export_format_keyboard(table, date_from, date_to)
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_export_c_"))
+async def admin_export_custom_period(callback: CallbackQuery, config: BotConfig, state: FSMContext):
+    """Ввод своего периода выгрузки"""
+    if not is_admin(callback.from_user.id, config):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    table = callback.data.split("_")[3]
+    msg = await callback.message.edit_text(
+        f"📤 <b>Выгрузка: {exports.TABLE_TITLES[table]}</b>\n\n"
+        f"Введите период в формате ДД.ММ.ГГГГ-ДД.ММ.ГГГГ (обе даты включительно).\n"
+        f"Например: <code>01.01.2025-31.01.2025</code>"
+    )
+    await state.update_data(
+        table=table,
+        first_bot_message_id=msg.message_id,
+        messages_to_delete=[]
+    )
+    await state.set_state(ExportStates.entering_period)
+    await callback.answer()
+
+
+@router.message(ExportStates.entering_period)
+async def admin_export_custom_period_save(message: Message, state: FSMContext):
+    """Проверка периода и выбор формата"""
+    data = await state.get_data()
+    messages_to_delete = data.get('messages_to_delete', [])
+    messages_to_delete.append(message.message_id)
+    
+    try:
+        date_from, date_to = exports.parse_period(message.text or "")
+    except ValueError:
+        msg = await message.answer("❌ Неверный период. Пример: <code>01.01.2025-31.01.2025</code>")
+        messages_to_delete.append(msg.message_id)
+        await state.update_data(messages_to_delete=messages_to_delete)
+        return
+    
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
+    await state.clear()
+    
+    table = data['table']
+    text = (
+        f"📤 <b>Выгрузка: {exports.TABLE_TITLES[table]}</b>\n"
+        f"Период: {_export_period_text(date_from, date_to)}\n\n"
+        f"Выберите формат:"
+    )
+    keyboard = get_admin_export_format_keyboard(table, date_from, date_to)
+    try:
+        await message.bot.edit_message_text(
+            chat_id=message.chat.id,
+            message_id=data['first_bot_message_id'],
+            text=text,
+            reply_markup=keyboard
+        )
+    except Exception:
+        await message.answer(text, reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith("admin_export_r_"))
+async def admin_export_run(callback: CallbackQuery, config: BotConfig, db: Database, bot):
+    """Выгрузка в файл с прогрессом и отправка документом"""
+    if not is_admin(callback.from_user.id, config):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    table, date_from, date_to, fmt = callback.data.split("_")[3:7]
+    date_from, date_to = (
+        f"{value[:4]}-{value[4:6]}-{value[6:]}" if value != "0" else None
+        for value in (date_from, date_to)
+    )
+    compress = fmt.endswith("gz")
+    fmt = fmt.removesuffix("gz")
+    title = f"📤 <b>Выгрузка: {exports.TABLE_TITLES[table]}</b> ({_export_period_text(date_from, date_to)})"
+    
+    await callback.answer("⏳ Выгрузка начата")
+    status = await callback.message.edit_text(f"{title}\n\n⏳ Подготовка...")
+    
+    async def report(done: int, total: int):
+        try:
+            await status.edit_text(f"{title}\n\n⏳ Выгружено {done} из {total} ({done * 100 // max(total, 1)}%)")
+        except Exception as e:
+            count_failure("edit_message", e)
+    
+    filename = exports.export_filename(table, fmt, compress, date_from, date_to)
+    path = Path(config.export_dir) / f"{callback.from_user.id}-{filename}"
+    try:
+        result = await exports.export_table(
+            db, table, path, fmt, compress, date_from, date_to, progress=report
+        )
+    except Exception:
+        await status.edit_text(f"{title}\n\n❌ Выгрузка не удалась, подробности в логах")
+        raise
+    
+    summary = (
+        f"{title}\n\n"
+        f"✅ Строк: {result['rows']}, размер: {result['size'] / 2 ** 20:.1f} МБ, "
+        f"время: {result['duration']:.1f} с"
+    )
+    limit = exports.LOCAL_DOCUMENT_LIMIT if config.bot_api_url else exports.DOCUMENT_LIMIT
+    if result['size'] > limit:
+        await status.edit_text(
+            f"{summary}\n\n⚠️ Файл больше лимита Telegram и сохранен на сервере:\n"
+            f"<code>{html.escape(str(path))}</code>\nВыберите меньший период или gzip."
+        )
+        return
+    
+    try:
+        await callback.message.answer_document(FSInputFile(path, filename=filename))
+    finally:
+        path.unlink(missing_ok=True)
+    await status.edit_text(summary, reply_markup=get_admin_export_tables_keyboard(exports.TABLE_TITLES))
+
+
 # Рассылка
 
 @router.callback_query(F.data == "admin_broadcast")
 async def admin_broadcast_start(callback: CallbackQuery, config: BotConfig, state: FSMContext):
-    """Начало рассылки"""
+    """Начало рассылки: выбор получателей"""
     if not is_admin(callback.from_user.id, config):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
+    await state.clear()
+    await callback.message.edit_text(
+        "📢 <b>Рассылка сообщений</b>\n\n"
+        "Выберите получателей.\n"
+        "Пользователи, заблокировавшие бота, исключаются автоматически.",
+        reply_markup=get_broadcast_segments_keyboard(broadcasts.SEGMENT_TITLES)
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_broadcast_seg_"))
+async def admin_broadcast_segment(callback: CallbackQuery, config: BotConfig, state: FSMContext, db: Database):
+    """Выбор сегмента (и его параметра) и запрос текста рассылки"""
+    if not is_admin(callback.from_user.id, config):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    # admin_broadcast_seg_{сегмент}[_{категория или дни}]
+    parts = callback.data.split("_")
+    segment = parts[3]
+    arg = parts[4] if len(parts) > 4 else None
+    if segment not in broadcasts.SEGMENT_TITLES:
+        await callback.answer("❌ Неизвестный сегмент", show_alert=True)
+        return
+    
+    if segment == "category" and arg is None:
+        await callback.message.edit_text(
+            "📢 <b>Рассылка сообщений</b>\n\nВыберите категорию:",
+            reply_markup=get_broadcast_categories_keyboard(await db.get_all_categories())
+        )
+        await callback.answer()
+        return
+    if segment == "active" and arg is None:
+        await callback.message.edit_text(
+            "📢 <b>Рассылка сообщений</b>\n\nАктивные за какой период?",
+            reply_markup=get_broadcast_days_keyboard(broadcasts.ACTIVE_DAYS)
+        )
+        await callback.answer()
+        return
+    
+    category_name = None
+    if segment == "category":
+        category = await db.get_category(int(arg))
+        category_name = category['name'] if category else None
+    audience = broadcasts.describe_segment(segment, arg, category_name)
+    count = await db.count_broadcast_audience(segment, arg)
+    
     msg = await callback.message.edit_text(
         "📢 <b>Рассылка сообщений</b>\n\n"
-        "Введите текст сообщения для рассылки:\n\n"
-        "Поддерживается HTML форматирование."
+        f"Получатели: {html.escape(audience)} ({count})\n\n"
+        "Отправьте сообщение для рассылки: текст, фото, видео, GIF, документ, "
+        "аудио, голосовое или стикер.\n\n"
+        "В тексте поддерживается HTML форматирование, медиа рассылается "
+        "копией вашего сообщения вместе с подписью."
     )
     
     await state.update_data(
         first_bot_message_id=msg.message_id,
-        messages_to_delete=[]
+        messages_to_delete=[],
+        segment=segment,
+        segment_arg=arg,
+        audience=audience
     )
     await state.set_state(BroadcastStates.entering_message)
     await callback.answer()
 
 
+async def _broadcast_review(state: FSMContext, db: Database):
+    """Текст и клавиатура подтверждения рассылки; переводит в состояние confirming"""
+    data = await state.get_data()
+    message = broadcasts.BroadcastMessage(**data['broadcast'])
+    
+    # Аудитория на момент подтверждения
+    users_count = await db.count_broadcast_audience(data.get('segment', 'all'), data.get('segment_arg'))
+    
+    if message.content_type == "text":
+        content = message.text
+    else:
+        content = f"[{broadcasts.CONTENT_TITLES[message.content_type]}]"
+        if message.text:
+            content += f"\n{html.escape(message.text)}"
+    
+    await state.set_state(BroadcastStates.confirming)
+    text = (
+        f"📢 <b>Подтверждение рассылки</b>\n\n"
+        f"Сообщение:\n\n"
+        f"{content}\n\n"
+        f"Кнопок: {message.buttons_count}\n"
+        f"Получатели: {html.escape(data.get('audience', 'все пользователи'))}\n"
+        f"Количество получателей: {users_count}\n\n"
+        f"Подтвердите отправку:"
+    )
+    return text, get_broadcast_confirm_keyboard(bool(message.buttons))
+
+
+async def _send_broadcast_review(bot, chat_id: int, state: FSMContext, db: Database):
+    """Новое сообщение с подтверждением рассылки (удаляется по окончании)"""
+    text, keyboard = await _broadcast_review(state, db)
+    msg = await bot.send_message(chat_id, text, reply_markup=keyboard)
+    data = await state.get_data()
+    await state.update_data(messages_to_delete=data.get('messages_to_delete', []) + [msg.message_id])
+
+
 @router.message(BroadcastStates.entering_message)
-async def admin_broadcast_message(message: Message, state: FSMContext, db: Database):
-    """Получение текста рассылки и подтверждение"""
+async def admin_broadcast_message(message: Message, state: FSMContext, db: Database, bot):
+    """Получение сообщения рассылки (текст или медиа) и подтверждение"""
     data = await state.get_data()
     messages_to_delete = data.get('messages_to_delete', [])
-    messages_to_delete.append(message.message_id)
     
-    await state.update_data(
-        message_text=message.text,
-        messages_to_delete=messages_to_delete
+    broadcast = broadcasts.BroadcastMessage.from_message(message)
+    if broadcast is None:
+        msg = await message.answer(
+            "❌ Такое сообщение нельзя разослать.\n\n"
+            "Отправьте текст, фото, видео, GIF, документ, аудио, голосовое или стикер."
+        )
+        await state.update_data(messages_to_delete=messages_to_delete + [message.message_id, msg.message_id])
+        return
+    
+    # Исходное сообщение не удаляем до конца рассылки: получатели получают его копию
+    await state.update_data(broadcast=asdict(broadcast))
+    await _send_broadcast_review(bot, message.chat.id, state, db)
+
+
+@router.callback_query(BroadcastStates.confirming, F.data == "admin_broadcast_buttons")
+async def admin_broadcast_buttons(callback: CallbackQuery, state: FSMContext):
+    """Запрос кнопок под сообщением рассылки"""
+    data = await state.get_data()
+    await callback.message.edit_text(
+        "🔘 <b>Кнопки рассылки</b>\n\n"
+        "Отправьте кнопки-ссылки, по одному ряду в строке.\n"
+        "Кнопки в ряду разделяются символом «|»:\n\n"
+        "<code>Каталог - https://t.me/your_bot?start=catalog\n"
+        "Канал - https://t.me/your_channel | Поддержка - https://t.me/support</code>",
+        reply_markup=get_broadcast_buttons_edit_keyboard(bool(data['broadcast'].get('buttons')))
     )
+    await state.set_state(BroadcastStates.adding_buttons)
+    await callback.answer()
+
+
+@router.message(BroadcastStates.adding_buttons)
+async def admin_broadcast_buttons_input(message: Message, state: FSMContext, db: Database, bot):
+    """Получение кнопок рассылки"""
+    data = await state.get_data()
+    messages_to_delete = data.get('messages_to_delete', []) + [message.message_id]
     
-    # Получаем количество пользователей
-    users_count = await db.get_users_count()
+    try:
+        buttons = broadcasts.parse_buttons(message.text or "")
+    except ValueError as e:
+        msg = await message.answer(f"❌ {html.escape(str(e))}\n\nИсправьте и отправьте кнопки еще раз.")
+        await state.update_data(messages_to_delete=messages_to_delete + [msg.message_id])
+        return
     
-    msg = await message.answer(
-        f"📢 <b>Подтверждение рассылки</b>\n\n"
-        f"Текст сообщения:\n\n"
-        f"{message.text}\n\n"
-        f"Количество получателей: {users_count}\n\n"
-        f"Подтвердите отправку:",
-        reply_markup=get_broadcast_confirm_keyboard()
+    await state.update_data(
+        broadcast={**data['broadcast'], 'buttons': buttons},
+        messages_to_delete=messages_to_delete
     )
-    messages_to_delete.append(msg.message_id)
-    await state.update_data(messages_to_delete=messages_to_delete)
-    await state.set_state(BroadcastStates.confirming)
+    await _send_broadcast_review(bot, message.chat.id, state, db)
+
 
+@router.callback_query(
+    BroadcastStates.adding_buttons,
+    F.data.in_({"admin_broadcast_buttons_clear", "admin_broadcast_review"})
+)
+async def admin_broadcast_buttons_back(callback: CallbackQuery, state: FSMContext, db: Database):
+    """Возврат к подтверждению рассылки (с удалением кнопок или без)"""
+    if callback.data == "admin_broadcast_buttons_clear":
+        data = await state.get_data()
+        await state.update_data(broadcast={**data['broadcast'], 'buttons': None})
+    
+    text, keyboard = await _broadcast_review(state, db)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+
+@router.callback_query(BroadcastStates.confirming, F.data == "admin_broadcast_preview")
+async def admin_broadcast_preview(callback: CallbackQuery, state: FSMContext, db: Database, bot):
+    """Предпросмотр: сообщение рассылки отправляется администратору"""
+    data = await state.get_data()
+    message = broadcasts.BroadcastMessage(**data['broadcast'])
+    
+    try:
+        preview = await message.send(bot, callback.message.chat.id)
+    except TelegramBadRequest as e:
+        await callback.answer(f"❌ Telegram не принял сообщение: {e.message}", show_alert=True)
+        return
+    
+    # Подтверждение переносится под предпросмотр
+    await delete_messages(bot, callback.message.chat.id, [callback.message.message_id])
+    messages_to_delete = [
+        message_id for message_id in data.get('messages_to_delete', [])
+        if message_id != callback.message.message_id
+    ]
+    await state.update_data(messages_to_delete=messages_to_delete + [preview.message_id])
+    await _send_broadcast_review(bot, callback.message.chat.id, state, db)
+    await callback.answer()
 
 @router.callback_query(BroadcastStates.confirming, F.data == "admin_broadcast_confirm")
-async def admin_broadcast_confirm(callback: CallbackQuery, state: FSMContext, db: Database, bot):
-    """Подтверждение и отправка рассылки"""
+async def admin_broadcast_confirm(callback: CallbackQuery, state: FSMContext, db: Database, bot,
+                                  lifecycle: Lifecycle):
+    """Подтверждение рассылки и запуск отправки в фоне"""
     data = await state.get_data()
-    message_text = data['message_text']
+    message = broadcasts.BroadcastMessage(**data['broadcast'])
     
     # Удаляем промежуточные сообщения
     messages_to_delete = data.get('messages_to_delete', [])
-    for msg_id in messages_to_delete:
-        try:
-            await bot.delete_message(callback.message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(bot, callback.message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение на статус "Идет рассылка"
     first_bot_msg = data.get('first_bot_message_id')
@@ -1598,57 +2108,67 @@ async def admin_broadcast_confirm(callback: CallbackQuery, state: FSMContext, db
                 message_id=first_bot_msg,
                 text="📢 <b>Рассылка начата...</b>\n\nПожалуйста, подождите."
             )
-        except Exception:
-            pass
+        except Exception as e:
+            count_failure("edit_message", e)
     else:
         await callback.message.edit_text(
             "📢 <b>Рассылка начата...</b>\n\nПожалуйста, подождите."
         )
+    msg_id_to_edit = first_bot_msg if first_bot_msg else callback.message.message_id
     
-    # Получаем всех пользователей
-    all_users = []
-    offset = 0
-    limit = 100
-    
-    while True:
-        users = await db.get_all_users(limit=limit, offset=offset)
-        if not users:
-            break
-        all_users.extend(users)
-        offset += limit
+    # Получатели выбираются один раз и сохраняются вместе с рассылкой
+    broadcast = await db.create_broadcast(
+        data.get('segment', 'all'), message.text, data.get('segment_arg'),
+        content_type=message.content_type,
+        source_chat_id=message.source_chat_id,
+        source_message_id=message.source_message_id,
+        buttons=message.buttons_json()
+    )
     
-    # Отправляем сообщения
-    success = 0
-    failed = 0
+    # Отправка идет фоновой задачей: остановка бота ее дождется (или прервет по таймауту)
+    lifecycle.create_task(
+        _run_broadcast(bot, db, callback.message.chat.id, msg_id_to_edit, message, broadcast),
+        name=f"broadcast-{broadcast['broadcast_id']}"
+    )
     
-    for user in all_users:
+    await state.clear()
+    await callback.answer()
+
+
+async def _run_broadcast(bot, db: Database, chat_id: int, status_message_id: int,
+                         message: broadcasts.BroadcastMessage, broadcast: dict):
+    """Отправка рассылки с отчетом о ходе и итогом в сообщении администратора"""
+    async def report(done: int, total: int):
         try:
-            await bot.send_message(user['user_id'], message_text)
-            success += 1
-            await asyncio.sleep(0.05)  # Небольшая задержка между сообщениями
-        except Exception:
-            failed += 1
+            await bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=status_message_id,
+                text=f"📢 <b>Рассылка...</b>\n\n⏳ Обработано {done} из {total}"
+            )
+        except Exception as e:
+            count_failure("edit_message", e)
+    
+    result = await broadcasts.send_broadcast(
+        bot, db, broadcast['broadcast_id'], message, broadcast['total'], progress=report
+    )
+    await delete_messages(bot, message.source_chat_id, [message.source_message_id])
     
     # Редактируем сообщение на результат
-    msg_id_to_edit = first_bot_msg if first_bot_msg else callback.message.message_id
+    summary = (
+        f"✅ <b>Рассылка завершена!</b>\n\n"
+        f"Успешно отправлено: {result['sent']}\n"
+        f"Не удалось отправить: {result['failed']}\n"
+        f"Заблокировали бота: {result['blocked']} (исключены из следующих рассылок)"
+    )
     try:
         await bot.edit_message_text(
-            chat_id=callback.message.chat.id,
-            message_id=msg_id_to_edit,
-            text=f"✅ <b>Рассылка завершена!</b>\n\n"
-                 f"Успешно отправлено: {success}\n"
-                 f"Не удалось отправить: {failed}",
+            chat_id=chat_id,
+            message_id=status_message_id,
+            text=summary,
             reply_markup=get_admin_main_keyboard()
         )
     except Exception:
-        await callback.message.answer(
-            f"✅ <b>Рассылка завершена!</b>\n\n"
-            f"Успешно отправлено: {success}\n"
-            f"Не удалось отправить: {failed}"
-        )
-    
-    await state.clear()
-    await callback.answer()
+        await bot.send_message(chat_id, summary)
 
 
 @router.callback_query(BroadcastStates.confirming, F.data == "admin_broadcast_cancel")
@@ -1656,13 +2176,11 @@ async def admin_broadcast_cancel(callback: CallbackQuery, state: FSMContext, bot
     """Отмена рассылки"""
     data = await state.get_data()
     
-    # Удаляем промежуточные сообщения
+    # Удаляем промежуточные сообщения вместе с исходным сообщением рассылки
     messages_to_delete = data.get('messages_to_delete', [])
-    for msg_id in messages_to_delete:
-        try:
-            await bot.delete_message(callback.message.chat.id, msg_id)
-        except Exception:
-            pass
+    if data.get('broadcast'):
+        messages_to_delete = messages_to_delete + [data['broadcast']['source_message_id']]
+    await delete_messages(bot, callback.message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение
     first_bot_msg = data.get('first_bot_message_id')
@@ -1734,7 +2252,8 @@ async def admin_info_text_detail(callback: CallbackQuery, config: BotConfig, db:
 
 
 @router.callback_query(F.data.startswith("admin_info_preview_"))
-async def admin_info_text_preview(callback: CallbackQuery, config: BotConfig, db: Database, bot):
+async def admin_info_text_preview(callback: CallbackQuery, config: BotConfig, db: Database,
+                                  scheduler: Scheduler):
     """Предпросмотр текста"""
     if not is_admin(callback.from_user.id, config):
         await callback.answer("❌ Нет доступа", show_alert=True)
@@ -1755,9 +2274,10 @@ async def admin_info_text_preview(callback: CallbackQuery, config: BotConfig, db
     await callback.answer("✅ Предпросмотр отправлен")
     
     # Автоудаление через 30 секунд
-    from ..utils import delete_message_after_delay
-    asyncio.create_task(
-        delete_message_after_delay(bot, callback.message.chat.id, preview_msg.message_id, 30)
+    await scheduler.schedule(
+        "delete_message", 30,
+        chat_id=callback.message.chat.id,
+        message_id=preview_msg.message_id
     )
 
 
@@ -1822,11 +2342,7 @@ async def admin_info_text_edit_save(message: Message, state: FSMContext, db: Dat
     messages_to_delete = data.get('messages_to_delete', [])
     messages_to_delete.append(message.message_id)
     
-    for msg_id in messages_to_delete:
-        try:
-            await message.bot.delete_message(message.chat.id, msg_id)
-        except Exception:
-            pass
+    await delete_messages(message.bot, message.chat.id, messages_to_delete)
     
     # Редактируем первое сообщение
     first_bot_msg = data.get('first_bot_message_id')
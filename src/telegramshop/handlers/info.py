@@ -5,6 +5,7 @@ from aiogram import Router, F
 from aiogram.types import Message
 
 from ..database import Database
+from ..utils import safe_delete_message
 
 
 router = Router()
@@ -14,10 +15,7 @@ router = Router()
 async def show_rules(message: Message, db: Database):
     """Показать правила магазина"""
     # Удаляем сообщение пользователя
-    try:
-        await message.delete()
-    except Exception:
-        pass
+    await safe_delete_message(message)
     
     rules_text = await db.get_info_text('rules')
     if not rules_text:
@@ -29,10 +27,7 @@ async def show_rules(message: Message, db: Database):
 async def show_guarantees(message: Message, db: Database):
     """Показать гарантии магазина"""
     # Удаляем сообщение пользователя
-    try:
-        await message.delete()
-    except Exception:
-        pass
+    await safe_delete_message(message)
     
     guarantees_text = await db.get_info_text('guarantees')
     if not guarantees_text:
@@ -44,10 +39,7 @@ async def show_guarantees(message: Message, db: Database):
 async def show_help(message: Message, db: Database):
     """Показать справку"""
     # Удаляем сообщение пользователя
-    try:
-        await message.delete()
-    except Exception:
-        pass
+    await safe_delete_message(message)
     
     help_text = await db.get_info_text('help')
     if not help_text:
@@ -1,12 +1,26 @@
 """
 Обработчики профиля пользователя
 """
+import math
+from typing import Optional
+
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
+from aiogram.fsm.context import FSMContext
 from datetime import datetime
 
+from ..config import BotConfig
 from ..database import Database
-from ..keyboards import get_profile_keyboard, get_back_keyboard
+from ..delivery import ItemsInputFile
+from ..keyboards import (
+    get_profile_keyboard,
+    get_back_keyboard,
+    get_order_history_keyboard,
+    get_payment_keyboard
+)
+from ..payments import PaymentStatus, PaymentWorker
+from ..states import PaymentStates
+from ..utils import safe_delete_message
 
 
 router = Router()
@@ -16,10 +30,7 @@ router = Router()
 async def show_profile(message: Message, db: Database):
     """Показать профиль пользователя"""
     # Удаляем сообщение пользователя
-    try:
-        await message.delete()
-    except Exception:
-        pass
+    await safe_delete_message(message)
     
     user_id = message.from_user.id
     user_data = await db.get_user(user_id)
@@ -71,12 +82,37 @@ async def show_order_history(callback: CallbackQuery, db: Database):
         
         await callback.message.edit_text(
             history_text,
-            reply_markup=get_back_keyboard()
+            reply_markup=get_order_history_keyboard()
         )
     
     await callback.answer()
 
 
+async def _format_sold_items(db: Database, items):
+    """Строки документа с купленными позициями (расшифровываются по одной при отправке)"""
+    async for item in items:
+        item, = await db.reveal_items([item])
+        product_name = item['product_name'] or f"Товар #{item['product_id']}"
+        yield f"[{item['sold_at']}] {product_name}: {item['data']}"
+
+
+@router.callback_query(F.data == "redownload_items")
+async def redownload_items(callback: CallbackQuery, db: Database):
+    """Повторно выдать все купленные позиции одним документом"""
+    user_id = callback.from_user.id
+    count = await db.count_sold_items(user_id)
+    
+    if not count:
+        await callback.answer("📦 У вас пока нет купленных товаров", show_alert=True)
+        return
+    
+    await callback.answer("📥 Готовим файл...")
+    await callback.message.answer_document(
+        ItemsInputFile(lambda: _format_sold_items(db, db.iter_sold_items(user_id)), filename="purchases.txt"),
+        caption=f"📦 Купленные товары: {count} шт."
+    )
+
+
 @router.callback_query(F.data == "payment_history")
 async def show_payment_history(callback: CallbackQuery, db: Database):
     """Показать историю пополнений"""
@@ -117,20 +153,95 @@ async def show_payment_history(callback: CallbackQuery, db: Database):
 
 
 @router.callback_query(F.data == "add_balance")
-async def add_balance(callback: CallbackQuery):
+async def add_balance(callback: CallbackQuery, state: FSMContext, payments: Optional[PaymentWorker] = None):
     """Пополнить баланс"""
+    if payments is None:
+        await callback.message.edit_text(
+            "💰 Пополнение баланса\n\n"
+            "🚧 Эта функция находится в разработке.\n"
+            "Пожалуйста, свяжитесь с администратором для пополнения баланса.",
+            reply_markup=get_back_keyboard()
+        )
+        await callback.answer()
+        return
+    
     await callback.message.edit_text(
         "💰 Пополнение баланса\n\n"
-        "🚧 Эта функция находится в разработке.\n"
-        "Пожалуйста, свяжитесь с администратором для пополнения баланса.",
+        "Введите сумму пополнения в рублях:",
         reply_markup=get_back_keyboard()
     )
+    await state.set_state(PaymentStates.entering_amount)
     await callback.answer()
 
 
+@router.message(PaymentStates.entering_amount)
+async def add_balance_amount(message: Message, state: FSMContext, config: BotConfig,
+                             payments: Optional[PaymentWorker] = None):
+    """Создание счета на введенную сумму"""
+    if payments is None:
+        await state.clear()
+        return
+    
+    # float() принимает и nan, inf, 1e308 — такие суммы отсекаются отдельно
+    try:
+        if not message.text:
+            raise ValueError
+        amount = round(float(message.text.replace(",", ".")), 2)
+        if not math.isfinite(amount) or amount <= 0:
+            raise ValueError
+    except ValueError:
+        await message.answer("❌ Неверная сумма. Введите положительное число:")
+        return
+    if amount > config.payment_max_amount:
+        await message.answer(
+            f"❌ Максимальная сумма пополнения — {config.payment_max_amount:.2f} ₽. Введите сумму меньше:"
+        )
+        return
+    
+    await state.clear()
+    payment_id, invoice = await payments.create_payment(message.from_user.id, amount)
+    
+    await message.answer(
+        f"💳 Счет #{payment_id} на {amount:.2f} ₽ создан\n\n"
+        f"После оплаты средства будут зачислены автоматически.",
+        reply_markup=get_payment_keyboard(payment_id, invoice.pay_url)
+    )
+
+
+@router.callback_query(F.data.startswith("check_payment_"))
+async def check_payment(callback: CallbackQuery, db: Database, payments: Optional[PaymentWorker] = None):
+    """Проверить статус оплаты"""
+    payment_id = int(callback.data.split("_")[2])
+    payment = await db.get_payment(payment_id)
+    
+    if not payment or payment['user_id'] != callback.from_user.id:
+        await callback.answer("❌ Платеж не найден", show_alert=True)
+        return
+    
+    status = payment['status']
+    if payments is not None:
+        status = await payments.check_payment(payment_id)
+    
+    if status == PaymentStatus.COMPLETED:
+        await callback.message.edit_text(
+            f"✅ Пополнение #{payment_id} на {payment['amount']:.2f} ₽ зачислено!",
+            reply_markup=get_back_keyboard()
+        )
+        await callback.answer()
+    elif status == PaymentStatus.CANCELLED:
+        await callback.message.edit_text(
+            f"❌ Счет #{payment_id} отменен",
+            reply_markup=get_back_keyboard()
+        )
+        await callback.answer()
+    else:
+        await callback.answer("⏳ Оплата еще не поступила", show_alert=True)
+
+
 @router.callback_query(F.data == "back_to_profile")
-async def back_to_profile(callback: CallbackQuery, db: Database):
+async def back_to_profile(callback: CallbackQuery, db: Database, state: FSMContext):
     """Вернуться к профилю"""
+    await state.clear()
     user_id = callback.from_user.id
     user_data = await db.get_user(user_id)
     
@@ -155,17 +266,23 @@ async def back_to_profile(callback: CallbackQuery, db: Database):
 
 
 @router.message(F.text == "💰 Пополнить баланс")
-async def add_balance_button(message: Message):
+async def add_balance_button(message: Message, state: FSMContext, payments: Optional[PaymentWorker] = None):
     """Обработчик кнопки пополнения баланса"""
     # Удаляем сообщение пользователя
-    try:
-        await message.delete()
-    except Exception:
-        pass
+    await safe_delete_message(message)
+    
+    if payments is None:
+        await message.answer(
+            "💰 Пополнение баланса\n\n"
+            "🚧 Эта функция находится в разработке.\n"
+            "Пожалуйста, свяжитесь с администратором для пополнения баланса."
+        )
+        return
     
     await message.answer(
         "💰 Пополнение баланса\n\n"
-        "🚧 Эта функция находится в разработке.\n"
-        "Пожалуйста, свяжитесь с администратором для пополнения баланса."
+        "Введите сумму пополнения в рублях:",
+        reply_markup=get_back_keyboard()
     )
+    await state.set_state(PaymentStates.entering_amount)
 
@@ -5,12 +5,17 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
+from ..analytics import ViewCounter
+from ..config import BotConfig
 from ..database import Database
+from ..delivery import deliver_items
 from ..keyboards import (
     get_categories_keyboard,
     get_products_keyboard,
-    get_product_detail_keyboard
+    get_product_detail_keyboard,
+    get_purchase_confirm_keyboard
 )
+from ..utils import safe_delete_message
 
 
 router = Router()
@@ -20,10 +25,7 @@ router = Router()
 async def show_categories(message: Message, db: Database):
     """Показать категории товаров"""
     # Удаляем сообщение пользователя
-    try:
-        await message.delete()
-    except Exception:
-        pass
+    await safe_delete_message(message)
     
     # Проверяем, не заблокирован ли пользователь
     user = await db.get_user(message.from_user.id)
@@ -70,7 +72,7 @@ async def back_to_categories(callback: CallbackQuery, db: Database):
 
 
 @router.callback_query(F.data.startswith("category_"))
-async def show_category_products(callback: CallbackQuery, db: Database):
+async def show_category_products(callback: CallbackQuery, db: Database, config: BotConfig):
     """Показать товары категории"""
     category_id = int(callback.data.split("_")[1])
     
@@ -81,7 +83,9 @@ async def show_category_products(callback: CallbackQuery, db: Database):
         return
     
     # Получаем товары категории
-    products = await db.get_products_by_category(category_id, active_only=True)
+    products = await db.get_products_by_category(
+        category_id, active_only=True, in_stock_only=config.hide_out_of_stock
+    )
     
     if not products:
         await callback.message.edit_text(
@@ -105,17 +109,19 @@ async def show_category_products(callback: CallbackQuery, db: Database):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("product_"))
-async def show_product_detail(callback: CallbackQuery, db: Database):
-    """Показать детали товара"""
-    product_id = int(callback.data.split("_")[1])
-    
+async def render_product_detail(callback: CallbackQuery, db: Database, product_id: int,
+                                quantity: int = 1, max_quantity: int = 1):
+    """Отрисовать карточку товара с учетом забронированных позиций"""
     # Получаем информацию о товаре
     product = await db.get_product(product_id)
     if not product:
         await callback.answer("❌ Товар не найден", show_alert=True)
         return
     
+    available = await db.get_available_stock(product_id)
+    max_quantity = min(available, max_quantity)
+    quantity = max(1, min(quantity, max_quantity))
+    
     # Формируем текст с информацией о товаре
     text = f"🎯 {product['name']}\n\n"
     
@@ -123,28 +129,54 @@ async def show_product_detail(callback: CallbackQuery, db: Database):
         text += f"📝 Описание:\n{product['description']}\n\n"
     
     text += f"💰 Цена: {product['price']} руб.\n"
-    text += f"📦 В наличии: {product['stock_count']} шт.\n"
+    text += f"📦 В наличии: {available} шт.\n"
     
-    if product['stock_count'] == 0:
+    if quantity > 1:
+        text += f"\n🧮 Количество: {quantity} шт. — итого {round(product['price'] * quantity, 2)} руб.\n"
+    
+    if available == 0:
         text += "\n❌ Товар временно отсутствует"
     
-    in_stock = product['stock_count'] > 0
+    in_stock = available > 0
     
     await callback.message.edit_text(
         text,
         reply_markup=get_product_detail_keyboard(
             product_id,
             product['category_id'],
-            in_stock
+            in_stock,
+            quantity,
+            max_quantity
         )
     )
     await callback.answer()
 
 
+@router.callback_query(F.data.startswith("product_"))
+async def show_product_detail(callback: CallbackQuery, db: Database, config: BotConfig, views: ViewCounter):
+    """Показать детали товара"""
+    parts = callback.data.split("_")
+    product_id = int(parts[1])
+    quantity = int(parts[2]) if len(parts) > 2 else 1
+    # Смена количества — не новый просмотр
+    if len(parts) == 2:
+        views.hit(product_id)
+    await render_product_detail(callback, db, product_id, quantity, config.max_purchase_quantity)
+
+
+@router.callback_query(F.data == "noop")
+async def noop(callback: CallbackQuery):
+    """Кнопка без действия (например, счетчик количества)"""
+    await callback.answer()
+
+
 @router.callback_query(F.data.startswith("buy_"))
-async def buy_product(callback: CallbackQuery, db: Database):
-    """Купить товар"""
-    product_id = int(callback.data.split("_")[1])
+async def buy_product(callback: CallbackQuery, db: Database, config: BotConfig):
+    """Забронировать товар и запросить подтверждение покупки"""
+    parts = callback.data.split("_")
+    product_id = int(parts[1])
+    quantity = int(parts[2]) if len(parts) > 2 else 1
+    quantity = max(1, min(quantity, config.max_purchase_quantity))
     user_id = callback.from_user.id
     
     # Получаем информацию о товаре
@@ -153,71 +185,109 @@ async def buy_product(callback: CallbackQuery, db: Database):
         await callback.answer("❌ Товар не найден", show_alert=True)
         return
     
-    # Проверяем наличие товара
-    if product['stock_count'] == 0:
-        await callback.answer("❌ Товар закончился", show_alert=True)
-        return
-    
     # Получаем информацию о пользователе
     user = await db.get_user(user_id)
     if not user:
         await callback.answer("❌ Ошибка получения данных пользователя", show_alert=True)
         return
     
-    # Проверяем баланс
-    if user['balance'] < product['price']:
+    total = round(product['price'] * quantity, 2)
+    
+    # Проверяем баланс до бронирования, чтобы не держать товар впустую
+    if user['balance'] < total:
         await callback.answer(
             f"❌ Недостаточно средств!\n\n"
-            f"Нужно: {product['price']} руб.\n"
+            f"Нужно: {total} руб.\n"
             f"У вас: {user['balance']} руб.\n"
-            f"Не хватает: {product['price'] - user['balance']} руб.",
+            f"Не хватает: {round(total - user['balance'], 2)} руб.",
             show_alert=True
         )
         return
     
-    # Получаем доступный товар
-    item = await db.get_available_product_item(product_id)
-    if not item:
-        await callback.answer("❌ Товар закончился", show_alert=True)
-        # Обновляем количество товара
-        await db.update_product_stock(product_id)
+    # Бронируем позиции
+    reserved = await db.reserve_product_items(product_id, user_id, quantity, config.reservation_ttl)
+    if not reserved:
+        if quantity > 1:
+            await callback.answer("❌ Недостаточно товара в наличии", show_alert=True)
+        else:
+            await callback.answer("❌ Товар закончился", show_alert=True)
         return
     
-    # Списываем средства
-    await db.update_user_balance(user_id, -product['price'])
+    minutes = max(config.reservation_ttl // 60, 1)
+    await callback.message.edit_text(
+        f"🛒 Подтверждение покупки\n\n"
+        f"🎯 Товар: {product['name']}\n"
+        f"🧮 Количество: {quantity} шт.\n"
+        f"💰 К оплате: {total} руб.\n"
+        f"💰 Ваш баланс: {user['balance']} руб.\n\n"
+        f"⏳ Товар забронирован за вами на {minutes} мин.",
+        reply_markup=get_purchase_confirm_keyboard(product_id)
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("confirm_buy_"))
+async def confirm_purchase(callback: CallbackQuery, db: Database):
+    """Подтвердить покупку забронированного товара"""
+    product_id = int(callback.data.split("_")[2])
+    user_id = callback.from_user.id
     
-    # Отмечаем товар как проданный
-    await db.mark_item_as_sold(item['item_id'], user_id)
+    result = await db.complete_purchase(user_id, product_id)
     
-    # Обновляем количество товара
-    await db.update_product_stock(product_id)
+    if result['status'] == 'not_found':
+        await callback.answer("❌ Товар не найден", show_alert=True)
+        return
     
-    # Добавляем запись о покупке
-    await db.add_order(user_id, product['name'], product['price'])
+    if result['status'] == 'no_reservation':
+        await callback.answer("❌ Время брони истекло. Попробуйте снова.", show_alert=True)
+        return
     
-    # Увеличиваем счетчик покупок
-    await db.increment_purchases(user_id)
+    product = result['product']
+    
+    if result['status'] == 'insufficient_funds':
+        await db.release_reservation(product_id, user_id)
+        await callback.answer(
+            f"❌ Недостаточно средств!\n\n"
+            f"Нужно: {result['total']} руб.\n"
+            f"У вас: {result['balance']} руб.",
+            show_alert=True
+        )
+        return
+    
+    new_balance = result['new_balance']
+    # Данные позиций расшифровываются только здесь, непосредственно перед выдачей
+    items = await db.reveal_items(result['items'])
     
     # Отправляем товар пользователю
-    await callback.message.answer(
-        f"✅ Покупка успешно совершена!\n\n"
-        f"🎯 Товар: {product['name']}\n"
-        f"💰 Цена: {product['price']} руб.\n\n"
-        f"📦 Ваш товар:\n\n"
-        f"<code>{item['data']}</code>\n\n"
-        f"💰 Ваш новый баланс: {user['balance'] - product['price']} руб.",
-        parse_mode="HTML"
+    await deliver_items(
+        callback.message,
+        header=(
+            f"✅ Покупка успешно совершена!\n\n"
+            f"🎯 Товар: {product['name']}\n"
+            f"🧮 Количество: {result['quantity']} шт.\n"
+            f"💰 Сумма: {result['total']} руб.\n"
+        ),
+        items=[item['data'] for item in items],
+        footer=f"\n💰 Ваш новый баланс: {new_balance} руб.",
+        filename=f"order_{result['order_id']}.txt"
     )
     
     # Обновляем сообщение с товаром
-    new_balance = user['balance'] - product['price']
     await callback.message.edit_text(
         f"✅ Покупка успешно завершена!\n\n"
         f"🎯 Товар: {product['name']}\n"
-        f"💰 Списано: {product['price']} руб.\n"
+        f"🧮 Количество: {result['quantity']} шт.\n"
+        f"💰 Списано: {result['total']} руб.\n"
         f"💰 Новый баланс: {new_balance} руб.\n\n"
         f"Товар отправлен вам в личные сообщения ⬆️"
     )
     
     await callback.answer("✅ Покупка успешна!")
 
+
+@router.callback_query(F.data.startswith("cancel_buy_"))
+async def cancel_purchase(callback: CallbackQuery, db: Database, config: BotConfig):
+    """Отменить покупку и снять бронь"""
+    product_id = int(callback.data.split("_")[2])
+    await db.release_reservation(product_id, callback.from_user.id)
+    await render_product_detail(callback, db, product_id, max_quantity=config.max_purchase_quantity)
@@ -77,6 +77,29 @@ def get_profile_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
+def get_order_history_keyboard(has_items: bool = True) -> InlineKeyboardMarkup:
+    """Клавиатура истории заказов"""
+    buttons = []
+    
+    if has_items:
+        buttons.append([
+            InlineKeyboardButton(
+                text="📥 Скачать купленные товары",
+                callback_data="redownload_items"
+            )
+        ])
+    
+    buttons.append([
+        InlineKeyboardButton(
+            text="◀️ Назад",
+            callback_data="back_to_profile"
+        )
+    ])
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    return keyboard
+
+
 def get_back_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура с кнопкой назад"""
     keyboard = InlineKeyboardMarkup(
@@ -92,6 +115,35 @@ def get_back_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
+def get_payment_keyboard(payment_id: int, pay_url: str = None) -> InlineKeyboardMarkup:
+    """Клавиатура счета на пополнение"""
+    buttons = []
+    
+    if pay_url:
+        buttons.append([
+            InlineKeyboardButton(
+                text="💳 Оплатить",
+                url=pay_url
+            )
+        ])
+    
+    buttons.append([
+        InlineKeyboardButton(
+            text="🔄 Проверить оплату",
+            callback_data=f"check_payment_{payment_id}"
+        )
+    ])
+    buttons.append([
+        InlineKeyboardButton(
+            text="◀️ Назад",
+            callback_data="back_to_profile"
+        )
+    ])
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    return keyboard
+
+
 def get_cancel_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура с кнопкой отмены"""
     keyboard = InlineKeyboardMarkup(
@@ -148,15 +200,44 @@ def get_products_keyboard(products: list, category_id: int) -> InlineKeyboardMar
     return keyboard
 
 
-def get_product_detail_keyboard(product_id: int, category_id: int, in_stock: bool) -> InlineKeyboardMarkup:
+def get_product_detail_keyboard(product_id: int, category_id: int, in_stock: bool,
+                                quantity: int = 1, max_quantity: int = 1) -> InlineKeyboardMarkup:
     """Клавиатура с действиями для товара"""
     buttons = []
     
     if in_stock:
+        # Выбор количества
+        if max_quantity > 1:
+            selector = []
+            for step, label in ((-10, "−10"), (-1, "➖")):
+                if quantity + step >= 1:
+                    selector.append(
+                        InlineKeyboardButton(
+                            text=label,
+                            callback_data=f"product_{product_id}_{quantity + step}"
+                        )
+                    )
+            selector.append(
+                InlineKeyboardButton(
+                    text=f"{quantity} шт.",
+                    callback_data="noop"
+                )
+            )
+            for step, label in ((1, "➕"), (10, "+10")):
+                if quantity + step <= max_quantity:
+                    selector.append(
+                        InlineKeyboardButton(
+                            text=label,
+                            callback_data=f"product_{product_id}_{quantity + step}"
+                        )
+                    )
+            buttons.append(selector)
+        
+        buy_text = "🛒 Купить" if quantity == 1 else f"🛒 Купить {quantity} шт."
         buttons.append([
             InlineKeyboardButton(
-                text="🛒 Купить",
-                callback_data=f"buy_{product_id}"
+                text=buy_text,
+                callback_data=f"buy_{product_id}_{quantity}"
             )
         ])
     
@@ -171,6 +252,27 @@ def get_product_detail_keyboard(product_id: int, category_id: int, in_stock: boo
     return keyboard
 
 
+def get_purchase_confirm_keyboard(product_id: int) -> InlineKeyboardMarkup:
+    """Подтверждение покупки забронированного товара"""
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="✅ Подтвердить покупку",
+                    callback_data=f"confirm_buy_{product_id}"
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    text="❌ Отменить",
+                    callback_data=f"cancel_buy_{product_id}"
+                )
+            ]
+        ]
+    )
+    return keyboard
+
+
 # Админ клавиатуры
 
 def get_admin_main_keyboard() -> InlineKeyboardMarkup:
@@ -206,6 +308,12 @@ def get_admin_main_keyboard() -> InlineKeyboardMarkup:
                     text="📝 Тексты кнопок",
                     callback_data="admin_info_texts"
                 )
+            ],
+            [
+                InlineKeyboardButton(
+                    text="📤 Выгрузка данных",
+                    callback_data="admin_export"
+                )
             ]
         ]
     )
@@ -458,6 +566,12 @@ def get_admin_user_actions_keyboard(user_id: int, is_blocked: bool) -> InlineKey
                     callback_data=f"admin_change_balance_{user_id}"
                 )
             ],
+            [
+                InlineKeyboardButton(
+                    text="🧾 Журнал баланса",
+                    callback_data=f"admin_ledger_{user_id}"
+                )
+            ],
             [
                 InlineKeyboardButton(
                     text=block_text,
@@ -475,7 +589,7 @@ def get_admin_user_actions_keyboard(user_id: int, is_blocked: bool) -> InlineKey
     return keyboard
 
 
-def get_broadcast_confirm_keyboard() -> InlineKeyboardMarkup:
+def get_broadcast_confirm_keyboard(has_buttons: bool = False) -> InlineKeyboardMarkup:
     """Подтверждение рассылки"""
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -485,6 +599,16 @@ def get_broadcast_confirm_keyboard() -> InlineKeyboardMarkup:
                     callback_data="admin_broadcast_confirm"
                 )
             ],
+            [
+                InlineKeyboardButton(
+                    text="✏️ Изменить кнопки" if has_buttons else "➕ Добавить кнопки",
+                    callback_data="admin_broadcast_buttons"
+                ),
+                InlineKeyboardButton(
+                    text="👁 Предпросмотр",
+                    callback_data="admin_broadcast_preview"
+                )
+            ],
             [
                 InlineKeyboardButton(
                     text="❌ Отменить",
@@ -496,6 +620,89 @@ def get_broadcast_confirm_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
+def get_broadcast_buttons_edit_keyboard(has_buttons: bool = False) -> InlineKeyboardMarkup:
+    """Ввод кнопок рассылки"""
+    buttons = []
+    if has_buttons:
+        buttons.append([
+            InlineKeyboardButton(
+                text="🗑 Убрать кнопки",
+                callback_data="admin_broadcast_buttons_clear"
+            )
+        ])
+    buttons.append([
+        InlineKeyboardButton(
+            text="◀️ Назад",
+            callback_data="admin_broadcast_review"
+        )
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def get_broadcast_buttons_keyboard(rows: list) -> InlineKeyboardMarkup:
+    """URL-кнопки под сообщением рассылки: [[[текст, ссылка], ...], ...]"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text=text, url=url) for text, url in row]
+            for row in rows
+        ]
+    )
+
+
+def get_broadcast_segments_keyboard(titles: dict) -> InlineKeyboardMarkup:
+    """Выбор аудитории рассылки"""
+    buttons = [
+        [InlineKeyboardButton(text=title, callback_data=f"admin_broadcast_seg_{segment}")]
+        for segment, title in titles.items()
+    ]
+    buttons.append([
+        InlineKeyboardButton(
+            text="◀️ Назад в меню",
+            callback_data="admin_menu"
+        )
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def get_broadcast_categories_keyboard(categories: list) -> InlineKeyboardMarkup:
+    """Выбор категории для сегмента «покупавшие в категории»"""
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=category['name'],
+                callback_data=f"admin_broadcast_seg_category_{category['category_id']}"
+            )
+        ]
+        for category in categories
+    ]
+    buttons.append([
+        InlineKeyboardButton(
+            text="◀️ Назад",
+            callback_data="admin_broadcast"
+        )
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def get_broadcast_days_keyboard(days: tuple) -> InlineKeyboardMarkup:
+    """Выбор периода для сегмента «активные за последние дни»"""
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text=f"{count} дн.", callback_data=f"admin_broadcast_seg_active_{count}")
+                for count in days
+            ],
+            [
+                InlineKeyboardButton(
+                    text="◀️ Назад",
+                    callback_data="admin_broadcast"
+                )
+            ]
+        ]
+    )
+    return keyboard
+
+
 def get_admin_select_category_keyboard(categories: list) -> InlineKeyboardMarkup:
     """Выбор категории для товара"""
     buttons = []
@@ -519,6 +726,93 @@ def get_admin_select_category_keyboard(categories: list) -> InlineKeyboardMarkup
     return keyboard
 
 
+def get_admin_export_tables_keyboard(titles: dict) -> InlineKeyboardMarkup:
+    """Выбор данных для выгрузки"""
+    buttons = [
+        [InlineKeyboardButton(text=title, callback_data=f"admin_export_t_{table}")]
+        for table, title in titles.items()
+    ]
+    buttons.append([
+        InlineKeyboardButton(
+            text="◀️ Назад в меню",
+            callback_data="admin_menu"
+        )
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def get_admin_export_period_keyboard(table: str) -> InlineKeyboardMarkup:
+    """Выбор периода выгрузки (0 дней — за все время)"""
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="7 дней", callback_data=f"admin_export_p_{table}_7"),
+                InlineKeyboardButton(text="30 дней", callback_data=f"admin_export_p_{table}_30"),
+                InlineKeyboardButton(text="365 дней", callback_data=f"admin_export_p_{table}_365")
+            ],
+            [
+                InlineKeyboardButton(text="За все время", callback_data=f"admin_export_p_{table}_0")
+            ],
+            [
+                InlineKeyboardButton(text="📅 Указать даты", callback_data=f"admin_export_c_{table}")
+            ],
+            [
+                InlineKeyboardButton(
+                    text="◀️ Назад",
+                    callback_data="admin_export"
+                )
+            ]
+        ]
+    )
+    return keyboard
+
+
+def get_admin_export_format_keyboard(table: str, date_from: str, date_to: str) -> InlineKeyboardMarkup:
+    """Выбор формата выгрузки; даты передаются как ГГГГММДД (0 — без границы)"""
+    period = f"{date_from.replace('-', '') if date_from else 0}_{date_to.replace('-', '') if date_to else 0}"
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="CSV", callback_data=f"admin_export_r_{table}_{period}_csv"),
+                InlineKeyboardButton(text="CSV + gzip", callback_data=f"admin_export_r_{table}_{period}_csvgz")
+            ],
+            [
+                InlineKeyboardButton(text="JSON", callback_data=f"admin_export_r_{table}_{period}_json"),
+                InlineKeyboardButton(text="JSON + gzip", callback_data=f"admin_export_r_{table}_{period}_jsongz")
+            ],
+            [
+                InlineKeyboardButton(
+                    text="◀️ Назад",
+                    callback_data=f"admin_export_t_{table}"
+                )
+            ]
+        ]
+    )
+    return keyboard
+
+
+def get_admin_analytics_keyboard(titles: dict, current: str) -> InlineKeyboardMarkup:
+    """Переключение периода аналитики продаж (текущий отмечен)"""
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text=f"• {title} •" if granularity == current else title,
+                    callback_data=f"admin_analytics_{granularity}"
+                )
+                for granularity, title in titles.items()
+            ],
+            [
+                InlineKeyboardButton(
+                    text="◀️ Назад к статистике",
+                    callback_data="admin_stats"
+                )
+            ]
+        ]
+    )
+    return keyboard
+
+
 def get_admin_info_texts_keyboard() -> InlineKeyboardMarkup:
     """Меню управления информационными текстами"""
     keyboard = InlineKeyboardMarkup(
@@ -0,0 +1,151 @@
+"""
+Жизненный цикл бота: учет фоновых задач и корректная остановка
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Coroutine, Dict, List, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+logger = logging.getLogger(__name__)
+
+
+class Lifecycle(BaseMiddleware):
+    """
+    Менеджер остановки бота
+
+    Считает обновления в обработке (как outer middleware на update) и
+    фоновые задачи, созданные через create_task: задачи планировщика,
+    отложенные уведомления, рассылки. shutdown вызывается один раз, после
+    возврата из polling:
+
+    1. Прием обновлений прекращает сам диспетчер (SIGTERM/SIGINT
+       останавливают polling), уже полученные обновления дообрабатываются.
+    2. Ожидается завершение обработчиков; затем выполняются действия
+       on_drain (например, досрочная отправка отложенного) и ожидаются
+       фоновые задачи. Все вместе — не дольше drain_timeout секунд,
+       оставшиеся задачи отменяются.
+    3. Выполняются зарегистрированные через on_shutdown действия в порядке
+       регистрации (остановка воркеров, сброс буферов, закрытие хранилища
+       FSM, сессии и базы).
+
+    Обновления, пришедшие после завершения остановки, отклоняются.
+    """
+
+    def __init__(self, drain_timeout: float = 30.0):
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        self.closed = False
+
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._drain_callbacks: List[Tuple[str, Callable[[], Awaitable[Any]]]] = []
+        self._callbacks: List[Tuple[str, Callable[[], Awaitable[Any]]]] = []
+        self._shutdown_lock = asyncio.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        """Количество обновлений в обработке"""
+        return self._in_flight
+
+    def create_task(self, coro: Coroutine, name: Optional[str] = None) -> asyncio.Task:
+        """Запуск фоновой задачи, которую остановка дождется"""
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def wait_tasks(self, timeout: Optional[float] = None) -> bool:
+        """Ожидание всех фоновых задач, включая порожденные ими. False — не уложились в timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._tasks:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            await asyncio.wait(set(self._tasks), timeout=remaining)
+        return True
+
+    def on_drain(self, name: str, callback: Callable[[], Awaitable[Any]]):
+        """Действие после завершения обработчиков, до ожидания фоновых задач"""
+        self._drain_callbacks.append((name, callback))
+
+    def on_shutdown(self, name: str, callback: Callable[[], Awaitable[Any]]):
+        """Действие, выполняемое после дренажа (в порядке регистрации)"""
+        self._callbacks.append((name, callback))
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if self.closed:
+            logger.warning("Обновление отклонено: бот остановлен")
+            return None
+
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    async def _drain(self, deadline: float) -> bool:
+        """Ожидание обработчиков и фоновых задач. False — не уложились в срок"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            return False
+
+        for name, callback in self._drain_callbacks:
+            try:
+                await callback()
+            except Exception:
+                logger.exception("Ошибка при остановке: %s", name)
+
+        # Задачи могут порождать новые задачи, поэтому ждем, пока множество не опустеет
+        return await self.wait_tasks(max(deadline - time.monotonic(), 0))
+
+    async def shutdown(self):
+        """Остановка: дренаж, затем действия on_shutdown (выполняется один раз)"""
+        async with self._shutdown_lock:
+            if self.closed:
+                return
+
+            self.draining = True
+            started = time.monotonic()
+            logger.info(
+                "Остановка: в обработке %s обновлений, фоновых задач: %s",
+                self._in_flight, len(self._tasks)
+            )
+
+            drained = await self._drain(started + self.drain_timeout)
+            if not drained:
+                logger.warning(
+                    "Дренаж не завершился за %.1f с: не завершено обновлений %s, отменяется задач %s",
+                    self.drain_timeout, self._in_flight, len(self._tasks)
+                )
+                tasks = list(self._tasks)
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            drain_time = time.monotonic() - started
+            self.closed = True
+
+            for name, callback in self._callbacks:
+                try:
+                    await callback()
+                except Exception:
+                    logger.exception("Ошибка при остановке: %s", name)
+
+            logger.info(
+                "Бот остановлен: дренаж %.2f с, всего %.2f с",
+                drain_time, time.monotonic() - started
+            )
@@ -0,0 +1,201 @@
+"""
+Структурное логирование: JSON-формат, неблокирующий вывод, выборочная
+запись частых событий и счетчики подавленных ошибок
+"""
+import json
+import logging
+import queue
+import random
+import time
+from collections import Counter
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+
+logger = logging.getLogger(__name__)
+
+# Контекст текущего обновления: update_id, user_id, handler
+_log_context: ContextVar[Optional[Dict[str, Any]]] = ContextVar("log_context", default=None)
+
+# Поля контекста, попадающие в каждую запись
+CONTEXT_FIELDS = ("update_id", "user_id", "handler", "duration_ms")
+
+# Обработчики просмотра каталога: самые частые обновления, пишутся выборочно
+SAMPLED_HANDLERS = frozenset({
+    "show_categories",
+    "back_to_categories",
+    "show_category_products",
+    "show_product_detail",
+    "noop",
+})
+
+# Счетчики ошибок, которые сознательно не прерывают обработку
+failures: Counter = Counter()
+
+
+def count_failure(kind: str, error: Optional[BaseException] = None):
+    """Учет подавленной ошибки (например, неудачного удаления сообщения)"""
+    failures[kind] += 1
+    if error is not None:
+        logger.debug("Подавлена ошибка %s: %r", kind, error)
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет в запись поля контекста обновления (выполняется в потоке вызова)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        if context:
+            for field in CONTEXT_FIELDS:
+                if field in context and not hasattr(record, field):
+                    setattr(record, field, context[field])
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Выборочная запись частых событий
+
+    Записи уровня INFO и ниже с полем sampled=True пропускаются с
+    вероятностью rate; предупреждения и ошибки пишутся всегда.
+    """
+
+    def __init__(self, rate: float = 0.1):
+        super().__init__()
+        self.rate = rate
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or not getattr(record, "sampled", False):
+            return True
+        if random.random() < self.rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной JSON-строкой"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """QueueHandler, сохраняющий трассировку исключения отдельным полем"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def setup_logging(level: str = "INFO", log_format: str = "json", sample_rate: float = 0.1,
+                  handlers: Optional[Iterable[logging.Handler]] = None) -> QueueListener:
+    """
+    Настройка логирования
+
+    Корневой логгер пишет в очередь, а форматирование и вывод выполняет
+    QueueListener в отдельном потоке, поэтому запись лога не блокирует
+    цикл событий. Возвращенный listener нужно остановить при выходе,
+    чтобы дописать очередь.
+
+    Args:
+        level: Уровень логирования
+        log_format: "json" или "text"
+        sample_rate: Доля записываемых частых событий (sampled=True)
+        handlers: Обработчики вывода (по умолчанию stderr)
+    """
+    if log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    handlers = list(handlers) if handlers else [logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+class UpdateLoggingMiddleware(BaseMiddleware):
+    """
+    Outer middleware на update: контекст для всех записей обновления и
+    итоговая запись с обработчиком и длительностью
+
+    Имя обработчика заполняет HandlerNameMiddleware (inner middleware).
+    Просмотр каталога (SAMPLED_HANDLERS) пишется выборочно.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        context = {
+            "update_id": event.update_id if isinstance(event, Update) else None,
+            "user_id": user.id if user else None,
+        }
+        token = _log_context.set(context)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            context["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            logger.info(
+                "Обновление обработано",
+                extra={"sampled": context.get("handler") in SAMPLED_HANDLERS}
+            )
+            _log_context.reset(token)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Inner middleware: имя выбранного обработчика в контекст лога"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        context = _log_context.get()
+        handler_object = data.get("handler")
+        if context is not None and handler_object is not None:
+            context["handler"] = getattr(handler_object.callback, "__name__", None)
+        return await handler(event, data)
@@ -1,33 +1,51 @@
 """
 Главный файл бота
 """
+import argparse
 import asyncio
+import importlib
 import logging
 import os
+import sys
+from functools import partial
 from pathlib import Path
+from typing import Optional
 
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.fsm.storage.memory import SimpleEventIsolation
 
-from .config import load_config
+from . import analytics
+from .config import BotConfig, load_config
 from .database import Database
+from .fsm_context import BufferedFSMMiddleware
+from .fsm_storage import SQLiteStorage
+from .lifecycle import Lifecycle
+from .logs import HandlerNameMiddleware, UpdateLoggingMiddleware, setup_logging
 from .handlers import get_handlers_router
+from .payments import PaymentWorker, create_payment_provider
+from .reservations import ReservationSweeper
+from .scheduler import Scheduler
+from .session import create_session
+from .startup import StartupProfiler
+from .stock import StockWatcher
+from .tracing import TracingMiddleware, TracingRequestMiddleware, tracer
+from .utils import delete_message
 
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 
-async def main():
+async def main(config: Optional[BotConfig] = None, profiler: Optional[StartupProfiler] = None):
     """Основная функция запуска бота"""
     
+    # Выключенный профилировщик не делает замеров
+    profiler = profiler or StartupProfiler(enabled=False)
+    
     # Загрузка конфигурации
-    config = load_config()
+    with profiler.phase("Конфигурация"):
+        config = config or load_config()
     
     if not config.token:
         logger.error("BOT_TOKEN не установлен! Проверьте переменные окружения.")
@@ -38,20 +56,110 @@ async def main():
     db_path.parent.mkdir(parents=True, exist_ok=True)
     
     # Инициализация базы данных
-    db = Database(config.database_path)
-    await db.init_db()
+    db = Database(
+        config.database_path,
+        archive_path=config.archive_path,
+        compression=config.payload_compression,
+        master_key=config.payload_master_key,
+        key_cache_size=config.payload_key_cache
+    )
+    with profiler.phase("Схема базы данных"):
+        await db.init_db()
     logger.info("База данных инициализирована")
     
     # Инициализация дефолтных информационных текстов
-    await db.init_default_info_texts()
+    with profiler.phase("Информационные тексты"):
+        await db.init_default_info_texts()
     logger.info("Информационные тексты инициализированы")
     
     # Инициализация бота и диспетчера
     bot = Bot(
         token=config.token,
+        session=create_session(
+            api_url=config.bot_api_url,
+            pool_limit=config.bot_api_pool_limit,
+            keepalive_timeout=config.bot_api_keepalive,
+            retry_max=config.bot_api_retry_max
+        ),
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    dp = Dispatcher()
+    
+    # Хранилище FSM
+    storage = None
+    if config.fsm_storage == "sqlite":
+        storage = SQLiteStorage(config.database_path, ttl=config.fsm_ttl)
+        storage.start()
+    # Обновления одного пользователя в одном чате обрабатываются по очереди:
+    # буферизованный FSM записывает запись целиком (см. BufferedFSMMiddleware)
+    dp = Dispatcher(storage=storage, events_isolation=SimpleEventIsolation())
+    
+    # Трассировка: корневой span на обновление, дочерние на запросы к Bot API и базе
+    tracer.configure(config.trace_enabled, config.trace_slow_ms, config.trace_file)
+    dp.update.outer_middleware(TracingMiddleware())
+    bot.session.middleware(TracingRequestMiddleware())
+    
+    # Контекст логов обновления (update_id, user_id, обработчик, длительность)
+    dp.update.outer_middleware(UpdateLoggingMiddleware())
+    dp.message.middleware(HandlerNameMiddleware())
+    dp.callback_query.middleware(HandlerNameMiddleware())
+    
+    # Учет обновлений в обработке для корректной остановки
+    lifecycle = Lifecycle(drain_timeout=config.shutdown_timeout)
+    dp.update.outer_middleware(lifecycle)
+    
+    # Отметки активности пользователей для сегментов рассылок (пишутся пачкой)
+    activity = analytics.ActivityTracker(db)
+    dp.update.outer_middleware(activity)
+    
+    # Одна запись FSM на обновление (регистрируется после встроенного FSM middleware)
+    dp.update.outer_middleware(BufferedFSMMiddleware())
+    
+    # Фоновое снятие истекших броней
+    reservation_sweeper = ReservationSweeper(db)
+    reservation_sweeper.start()
+    
+    # Планировщик отложенных и периодических задач
+    scheduler = Scheduler(db, create_task=lifecycle.create_task)
+    scheduler.register("delete_message", partial(delete_message, bot))
+    scheduler.cron("reconcile_stock", "*/10 * * * *", db.reconcile_stock)
+    views = analytics.ViewCounter(db)
+    scheduler.every("product_views", 60, views.flush)
+    scheduler.every("user_activity", 60, activity.flush)
+    scheduler.cron("prune_sales_rollup", "15 4 * * *", db.prune_sales_rollup)
+    # Модули подкоманд archive и backup нужны боту, но не остальным подкомандам
+    from . import archive, backup
+    if config.archive_after_days:
+        archiver = archive.Archiver(db, config.archive_path, older_than_days=config.archive_after_days)
+        scheduler.cron("archive", "30 4 * * *", archiver.archive)
+    backups = backup.BackupService(config.database_path, config.backup_dir, keep=config.backup_keep)
+    if config.backup_cron:
+        scheduler.cron("backup", config.backup_cron, backups.backup)
+    scheduler.start()
+    
+    # Уведомления об остатках по событиям покупки и загрузки позиций
+    stock_watcher = None
+    if config.stock_alert_thresholds and config.admin_ids:
+        stock_watcher = StockWatcher(
+            db, bot, config.admin_ids,
+            thresholds=config.stock_alert_thresholds,
+            debounce=config.stock_alert_debounce,
+            create_task=lifecycle.create_task
+        )
+        await stock_watcher.start()
+    
+    # Платежная подсистема (None, если провайдер не настроен)
+    payments = None
+    payment_provider = create_payment_provider(config)
+    if payment_provider:
+        payments = PaymentWorker(
+            db,
+            payment_provider,
+            bot=bot,
+            poll_interval=config.payment_poll_interval,
+            payment_ttl=config.payment_ttl
+        )
+        payments.start()
+        logger.info("Платежный провайдер '%s' подключен", payment_provider.name)
     
     # Регистрация middleware для передачи зависимостей
     @dp.update.outer_middleware()
@@ -59,28 +167,129 @@ async def main():
         data["config"] = config
         data["db"] = db
         data["bot"] = bot
+        data["payments"] = payments
+        data["scheduler"] = scheduler
+        data["lifecycle"] = lifecycle
+        data["backups"] = backups
+        data["views"] = views
         return await handler(event, data)
     
-    # Подключение роутеров
-    dp.include_router(get_handlers_router())
+    # Подключение роутеров (модули обработчиков импортируются здесь)
+    with profiler.phase("Роутеры"):
+        dp.include_router(get_handlers_router())
+    
+    if profiler.enabled:
+        dp.update.outer_middleware(profiler.first_update_middleware)
+    
+    # Отложенное уведомление об остатках отправляется сразу, не дожидаясь debounce
+    if stock_watcher:
+        lifecycle.on_drain("stock_watcher", stock_watcher.stop)
+    
+    # Порядок остановки после дренажа: воркеры, буферы, хранилище FSM, сессия бота и последней база
+    lifecycle.on_shutdown("scheduler", scheduler.stop)
+    lifecycle.on_shutdown("product_views", views.flush)
+    lifecycle.on_shutdown("user_activity", activity.flush)
+    lifecycle.on_shutdown("reservations", reservation_sweeper.stop)
+    if payments:
+        lifecycle.on_shutdown("payments", payments.stop)
+    lifecycle.on_shutdown("fsm_storage", dp.storage.close)
+    lifecycle.on_shutdown("bot_session", bot.session.close)
+    lifecycle.on_shutdown("database", db.close)
+    
+    # Диспетчер закрывает хранилище FSM на shutdown, то есть до дренажа
+    # дообрабатываемых обновлений; его закрывает Lifecycle (выше)
+    dp.shutdown.handlers[:] = [
+        handler for handler in dp.shutdown.handlers if handler.callback != dp.fsm.close
+    ]
     
     # Запуск бота
     logger.info("Бот запущен")
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        await dp.start_polling(
+            bot,
+            allowed_updates=dp.resolve_used_update_types(),
+            close_bot_session=False
+        )
     finally:
-        await bot.session.close()
+        # Единственный вызов остановки: после возврата из polling (или ошибки запуска)
+        await lifecycle.shutdown()
+
+
+# Подкоманды и модули, которые их регистрируют (импортируются только при вызове)
+SUBCOMMANDS = {
+    "generate": "datagen",
+    "archive": "archive",
+    "backup": "backup",
+    "compress-payloads": "payload",
+    "export": "exports",
+}
+
 
+def _subcommand_modules(argv: list) -> list:
+    """
+    Модули подкоманд, нужные для разбора argv
 
-def run():
-    """Точка входа для запуска бота"""
+    Для запуска бота подкоманды не импортируются; для известной подкоманды
+    импортируется только ее модуль, для справки и опечаток — все.
+    """
+    command = next((arg for arg in argv if not arg.startswith("-")), None)
+    if command in SUBCOMMANDS:
+        names = [SUBCOMMANDS[command]]
+    elif command or "-h" in argv or "--help" in argv:
+        names = list(dict.fromkeys(SUBCOMMANDS.values()))
+    else:
+        names = []
+    return [importlib.import_module(f".{name}", __package__) for name in names]
+
+
+def run(profiler: Optional[StartupProfiler] = None):
+    """
+    Точка входа для запуска бота
+
+    Args:
+        profiler: Профилировщик, начатый в telegramshop.run до импорта этого
+            модуля; без него --profile-startup начинает замер здесь
+    """
+    argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(prog="telegramshop", description="Telegram бот-магазин")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="вывести профиль запуска (импорты, инициализация базы, время до первого обновления)"
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    for module in _subcommand_modules(argv):
+        module.register(subparsers)
+    args = parser.parse_args(argv)
+    
+    # Подкоманды выполняются вместо запуска бота; их логи (предупреждения
+    # базы, ошибки записи) выводятся текстом, конфигурация бота им не нужна
+    if args.command:
+        log_listener = setup_logging(os.getenv("LOG_LEVEL", "INFO"), "text")
+        try:
+            raise SystemExit(args.func(args))
+        finally:
+            log_listener.stop()
+    
+    if not args.profile_startup:
+        profiler = None
+    elif profiler is None:
+        profiler = StartupProfiler()
+        profiler.track_imports()
+    
+    config = load_config()
+    log_listener = setup_logging(config.log_level, config.log_format, config.log_sample_rate)
+    
     try:
-        asyncio.run(main())
+        asyncio.run(main(config, profiler))
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
-    except Exception as e:
-        logger.error(f"Ошибка при запуске бота: {e}")
-
+    except Exception:
+        logger.exception("Ошибка при запуске бота")
+    finally:
+        # Дописываем очереди трасс и логов (ошибки записи трасс попадают в лог)
+        tracer.stop()
+        log_listener.stop()
 
 if __name__ == "__main__":
     run()
@@ -0,0 +1,187 @@
+"""
+Сжатие данных товарных позиций (product_items.data)
+
+Несжатое значение хранится как TEXT, сжатое — как BLOB с заголовком:
+1 байт алгоритма, 4 байта ID словаря (0 — без словаря), затем данные.
+Словари обучаются по образцам позиций товара и хранятся в payload_dicts;
+словарь с заданным ID не меняется, поэтому его можно кэшировать навсегда.
+Чтение не зависит от настроек: старые сжатые строки читаются и после
+отключения сжатия.
+"""
+import struct
+import zlib
+from typing import Dict, List, Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен, без него доступен zlib
+    zstandard = None
+
+
+ALGORITHMS = ("none", "zlib", "zstd")
+
+_CODEC_IDS = {"zlib": 1, "zstd": 2}
+_CODEC_NAMES = {value: key for key, value in _CODEC_IDS.items()}
+_HEADER = struct.Struct(">BI")
+
+# Значения короче min_size не сжимаются: заголовок съест выигрыш
+DEFAULT_MIN_SIZE = 64
+DICTIONARY_SIZE = 16 * 1024
+# Минимум образцов для обучения словаря товара
+MIN_TRAIN_SAMPLES = 8
+
+
+class PayloadCodec:
+    """
+    Сжатие и распаковка данных позиций
+
+    Args:
+        algorithm: "none", "zlib" или "zstd" (zstd требует пакет zstandard)
+        level: Уровень сжатия
+        min_size: Минимальный размер значения для сжатия (байт)
+    """
+
+    def __init__(self, algorithm: str = "zlib", level: int = 6, min_size: int = DEFAULT_MIN_SIZE):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Неизвестный алгоритм сжатия: {algorithm}")
+        if algorithm == "zstd" and zstandard is None:
+            raise ValueError("Для PAYLOAD_COMPRESSION=zstd установите пакет zstandard")
+        self.algorithm = algorithm
+        self.level = level
+        self.min_size = min_size
+
+    @property
+    def enabled(self) -> bool:
+        return self.algorithm != "none"
+
+    def train(self, samples: List[str], size: int = DICTIONARY_SIZE) -> bytes:
+        """
+        Словарь по образцам позиций одного товара
+
+        Для zstd словарь обучается zstandard; если образцов для этого мало,
+        как и для zlib, словарем служат сами образцы (частые в конце).
+        """
+        encoded = [sample.encode("utf-8") for sample in samples]
+        if self.algorithm == "zstd":
+            try:
+                return zstandard.train_dictionary(size, encoded).as_bytes()
+            except zstandard.ZstdError:
+                pass
+        dictionary = b""
+        for sample in reversed(encoded):
+            if len(dictionary) + len(sample) > size:
+                break
+            dictionary = sample + dictionary
+        return dictionary
+
+    def encode(self, text: str, dict_id: int = 0, dictionary: Optional[bytes] = None) -> Union[str, bytes]:
+        """Сжатие значения; если это не дает выигрыша, возвращается исходный текст"""
+        raw = text.encode("utf-8")
+        if not self.enabled or len(raw) < self.min_size:
+            return text
+
+        if self.algorithm == "zstd":
+            compressor = zstandard.ZstdCompressor(
+                level=self.level,
+                dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None,
+                write_content_size=True, write_checksum=False, write_dict_id=False
+            )
+            body = compressor.compress(raw)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, **({"zdict": dictionary} if dictionary else {}))
+            body = compressor.compress(raw) + compressor.flush()
+
+        if _HEADER.size + len(body) >= len(raw):
+            return text
+        return _HEADER.pack(_CODEC_IDS[self.algorithm], dict_id if dictionary else 0) + body
+
+
+def dictionary_ids(values) -> set:
+    """ID словарей, нужных для распаковки значений"""
+    return {
+        _HEADER.unpack_from(value)[1] for value in values
+        if isinstance(value, bytes) and len(value) >= _HEADER.size and value[0] in _CODEC_NAMES
+    } - {0}
+
+
+def decode(value: Union[str, bytes, None], dictionaries: Dict[int, bytes]) -> Optional[str]:
+    """Распаковка значения из базы (текст возвращается как есть)"""
+    if not isinstance(value, bytes):
+        return value
+    codec_id, dict_id = _HEADER.unpack_from(value)
+    body = value[_HEADER.size:]
+    dictionary = dictionaries[dict_id] if dict_id else None
+
+    if _CODEC_NAMES.get(codec_id) == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Данные сжаты zstd: установите пакет zstandard")
+        decompressor = zstandard.ZstdDecompressor(
+            dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        )
+        raw = decompressor.decompress(body)
+    elif _CODEC_NAMES.get(codec_id) == "zlib":
+        decompressor = zlib.decompressobj(-15, **({"zdict": dictionary} if dictionary else {}))
+        raw = decompressor.decompress(body) + decompressor.flush()
+    else:
+        raise ValueError(f"Неизвестный формат сжатых данных: {codec_id}")
+    return raw.decode("utf-8")
+
+
+def command(args) -> int:
+    """Подкоманда compress-payloads: сжатие ранее сохраненных позиций"""
+    import asyncio
+    import os
+    import time
+    from pathlib import Path
+
+    from .archive import convert_to_incremental_vacuum
+    from .database import Database
+
+    master_key = os.getenv("PAYLOAD_MASTER_KEY") if args.encrypt else None
+    if args.encrypt and not master_key:
+        print("Для --encrypt задайте PAYLOAD_MASTER_KEY")
+        return 2
+    db = Database(args.db, compression=args.algorithm, master_key=master_key)
+    totals = {'scanned': 0, 'compressed': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+
+    async def migrate():
+        await db.init_db()
+        last_item_id = 0
+        while True:
+            result = await db.compress_payloads(last_item_id, args.batch_size)
+            if not result['scanned']:
+                return
+            for key in totals:
+                totals[key] += result[key]
+            last_item_id = result['last_item_id']
+            await asyncio.sleep(args.pause)
+
+    started = time.perf_counter()
+    size_before = Path(args.db).stat().st_size
+    asyncio.run(migrate())
+    print(
+        f"Просмотрено позиций: {totals['scanned']}, перезаписано: {totals['compressed']} "
+        f"({totals['raw_bytes'] / 2 ** 20:.1f} → {totals['stored_bytes'] / 2 ** 20:.1f} МБ) "
+        f"за {time.perf_counter() - started:.1f} с"
+    )
+
+    if args.vacuum:
+        convert_to_incremental_vacuum(args.db)
+        print(f"Файл базы: {size_before / 2 ** 20:.1f} → {Path(args.db).stat().st_size / 2 ** 20:.1f} МБ")
+    else:
+        print("Файл базы уменьшится после VACUUM: telegramshop compress-payloads --vacuum (бот остановлен)")
+    return 0
+
+
+def register(subparsers):
+    """Регистрация подкоманды compress-payloads"""
+    parser = subparsers.add_parser("compress-payloads", help="Сжать (и зашифровать) ранее загруженные позиции")
+    parser.add_argument("--db", default="data/shop.db", help="База данных")
+    parser.add_argument("--algorithm", choices=ALGORITHMS, default="zlib")
+    parser.add_argument("--encrypt", action="store_true",
+                        help="Также зашифровать позиции мастер-ключом из PAYLOAD_MASTER_KEY")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.0, help="Пауза между пачками (сек), если бот работает")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="После сжатия перезаписать файл базы полным VACUUM (бот остановлен)")
+    parser.set_defaults(func=command)
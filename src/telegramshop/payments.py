@@ -0,0 +1,304 @@
+"""
+Платежная подсистема: провайдеры и фоновая обработка платежей
+"""
+import asyncio
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+
+from .config import BotConfig
+from .database import Database
+
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentStatus:
+    """Статусы платежей"""
+    PENDING = "pending"
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
+
+
+@dataclass
+class Invoice:
+    """Счет, выставленный во внешней платежной системе"""
+    external_id: str
+    pay_url: Optional[str] = None
+
+
+StatusListener = Callable[[str, str], Awaitable[None]]
+
+
+class PaymentProvider(ABC):
+    """Базовый класс платежного провайдера"""
+
+    name: str = "base"
+
+    def __init__(self):
+        self._listeners: List[StatusListener] = []
+
+    @abstractmethod
+    async def create_invoice(self, payment_id: int, user_id: int, amount: float) -> Invoice:
+        """Выставление счета на оплату"""
+
+    @abstractmethod
+    async def get_statuses(self, external_ids: List[str]) -> Dict[str, str]:
+        """
+        Пакетная проверка статусов счетов
+
+        Returns:
+            Словарь external_id -> статус (только для известных провайдеру счетов)
+        """
+
+    def subscribe(self, listener: StatusListener):
+        """Подписка на уведомления о смене статуса (для провайдеров с push-уведомлениями)"""
+        self._listeners.append(listener)
+
+    async def _emit_status(self, external_id: str, status: str):
+        """Рассылка уведомления о смене статуса подписчикам"""
+        for listener in self._listeners:
+            try:
+                await listener(external_id, status)
+            except Exception:
+                logger.exception("Ошибка обработки статуса платежа %s", external_id)
+
+    async def close(self):
+        """Освобождение ресурсов провайдера"""
+
+
+class FakePaymentProvider(PaymentProvider):
+    """
+    Локальный провайдер для тестов и разработки
+
+    Счета хранятся в памяти процесса. Оплату можно подтвердить вызовом
+    mark_paid или автоматически через auto_complete_after секунд.
+    """
+
+    name = "fake"
+
+    def __init__(self, auto_complete_after: Optional[float] = None):
+        super().__init__()
+        self.auto_complete_after = auto_complete_after
+        self._invoices: Dict[str, dict] = {}
+        self.status_requests = 0
+
+    async def create_invoice(self, payment_id: int, user_id: int, amount: float) -> Invoice:
+        external_id = uuid.uuid4().hex
+        self._invoices[external_id] = {
+            'payment_id': payment_id,
+            'user_id': user_id,
+            'amount': amount,
+            'status': PaymentStatus.PENDING,
+            'created': time.monotonic()
+        }
+        return Invoice(external_id=external_id)
+
+    async def get_statuses(self, external_ids: List[str]) -> Dict[str, str]:
+        self.status_requests += 1
+        now = time.monotonic()
+        statuses = {}
+
+        for external_id in external_ids:
+            invoice = self._invoices.get(external_id)
+            if not invoice:
+                continue
+            if (
+                invoice['status'] == PaymentStatus.PENDING
+                and self.auto_complete_after is not None
+                and now - invoice['created'] >= self.auto_complete_after
+            ):
+                invoice['status'] = PaymentStatus.COMPLETED
+            statuses[external_id] = invoice['status']
+
+        return statuses
+
+    async def mark_paid(self, external_id: str):
+        """Отметить счет оплаченным"""
+        self._invoices[external_id]['status'] = PaymentStatus.COMPLETED
+        await self._emit_status(external_id, PaymentStatus.COMPLETED)
+
+    async def mark_cancelled(self, external_id: str):
+        """Отметить счет отмененным"""
+        self._invoices[external_id]['status'] = PaymentStatus.CANCELLED
+        await self._emit_status(external_id, PaymentStatus.CANCELLED)
+
+
+def create_payment_provider(config: BotConfig) -> Optional[PaymentProvider]:
+    """Создание платежного провайдера по конфигурации (None — пополнение отключено)"""
+    if not config.payment_provider:
+        return None
+
+    if config.payment_provider == FakePaymentProvider.name:
+        return FakePaymentProvider(auto_complete_after=config.fake_payment_autocomplete)
+
+    raise ValueError(f"Неизвестный платежный провайдер: {config.payment_provider}")
+
+
+class PaymentWorker:
+    """
+    Фоновая обработка ожидающих платежей
+
+    Периодически опрашивает провайдера о статусах платежей в статусе pending
+    пачками и принимает push-уведомления, если провайдер их поддерживает.
+    Зачисление выполняется атомарно через Database.complete_payment.
+    """
+
+    def __init__(self, db: Database, provider: PaymentProvider, bot: Optional[Bot] = None,
+                 poll_interval: float = 10.0, batch_size: int = 100, payment_ttl: int = 3600):
+        self.db = db
+        self.provider = provider
+        self.bot = bot
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.payment_ttl = payment_ttl
+        self._task: Optional[asyncio.Task] = None
+
+        provider.subscribe(self.handle_status_update)
+
+    async def create_payment(self, user_id: int, amount: float):
+        """
+        Создание платежа и выставление счета
+
+        Returns:
+            Пара (payment_id, Invoice)
+        """
+        payment_id = await self.db.add_payment(user_id, amount, self.provider.name)
+        invoice = await self.provider.create_invoice(payment_id, user_id, amount)
+        await self.db.set_payment_external_id(payment_id, invoice.external_id)
+        return payment_id, invoice
+
+    async def check_payment(self, payment_id: int) -> Optional[str]:
+        """Немедленная проверка одного платежа. Возвращает актуальный статус"""
+        payment = await self.db.get_payment(payment_id)
+        if not payment:
+            return None
+
+        if payment['status'] == PaymentStatus.PENDING and payment['external_id']:
+            statuses = await self.provider.get_statuses([payment['external_id']])
+            status = statuses.get(payment['external_id'])
+            if status and status != PaymentStatus.PENDING:
+                await self._apply_status(payment, status)
+                payment = await self.db.get_payment(payment_id)
+
+        return payment['status']
+
+    async def handle_status_update(self, external_id: str, status: str):
+        """Обработка push-уведомления провайдера о смене статуса"""
+        payment = await self.db.get_payment_by_external_id(self.provider.name, external_id)
+        if payment and payment['status'] == PaymentStatus.PENDING:
+            await self._apply_status(payment, status)
+
+    async def process_pending(self) -> int:
+        """
+        Один проход по ожидающим платежам
+
+        Статусы запрашиваются у провайдера и для просроченных платежей:
+        счет, оплаченный перед самым истечением payment_ttl, зачисляется.
+        Отменяются только просроченные платежи, которые провайдер все еще
+        считает неоплаченными, и платежи без выставленного счета.
+
+        Returns:
+            Количество зачисленных или отмененных провайдером платежей
+        """
+        processed = 0
+        cancelled = 0
+        after = None
+
+        while True:
+            payments = await self.db.get_pending_payments(limit=self.batch_size, after=after)
+            if not payments:
+                break
+            after = (payments[-1]['created_at'], payments[-1]['payment_id'])
+
+            by_external_id = {
+                payment['external_id']: payment
+                for payment in payments
+                if payment['payment_method'] == self.provider.name and payment['external_id']
+            }
+            still_pending = [
+                payment['payment_id'] for payment in payments
+                if payment['payment_method'] == self.provider.name and not payment['external_id']
+            ]
+            if by_external_id:
+                statuses = await self.provider.get_statuses(list(by_external_id))
+                for external_id, status in statuses.items():
+                    if status == PaymentStatus.PENDING:
+                        still_pending.append(by_external_id[external_id]['payment_id'])
+                    elif await self._apply_status(by_external_id[external_id], status):
+                        processed += 1
+
+            # Из неоплаченных отменяются только просроченные (возраст проверяет база)
+            cancelled += await self.db.cancel_stale_payments(self.payment_ttl, still_pending)
+
+            if len(payments) < self.batch_size:
+                break
+
+        if cancelled:
+            logger.info("Отменено просроченных платежей: %s", cancelled)
+        return processed
+
+    async def _apply_status(self, payment: dict, status: str) -> bool:
+        """Применение нового статуса платежа"""
+        if status == PaymentStatus.COMPLETED:
+            completed = await self.db.complete_payment(payment['payment_id'])
+            if completed:
+                logger.info(
+                    "Платеж #%s зачислен: %s руб. пользователю %s",
+                    completed['payment_id'], completed['amount'], completed['user_id']
+                )
+                await self._notify_user(
+                    completed['user_id'],
+                    f"✅ Пополнение #{completed['payment_id']} зачислено!\n\n"
+                    f"💰 Сумма: {completed['amount']:.2f} ₽"
+                )
+                return True
+            return False
+
+        if status == PaymentStatus.CANCELLED:
+            return await self.db.update_payment_status(
+                payment['payment_id'], PaymentStatus.CANCELLED, expected_status=PaymentStatus.PENDING
+            )
+
+        return False
+
+    async def _notify_user(self, user_id: int, text: str):
+        """Уведомление пользователя о зачислении"""
+        if not self.bot:
+            return
+        try:
+            await self.bot.send_message(user_id, text)
+        except Exception:
+            logger.warning("Не удалось уведомить пользователя %s о платеже", user_id)
+
+    async def run(self):
+        """Цикл периодической проверки платежей"""
+        while True:
+            try:
+                await self.process_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка обработки платежей")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        """Запуск фоновой обработки"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка фоновой обработки"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.provider.close()
@@ -0,0 +1,68 @@
+"""
+Фоновое снятие истекших броней товарных позиций
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from .database import Database
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReservationSweeper:
+    """
+    Периодически освобождает позиции с истекшей бронью
+
+    Брони снимаются пачками по batch_size, каждая пачка — отдельная короткая
+    транзакция. Выборка идет по частичному индексу на reserved_until, поэтому
+    стоимость прохода пропорциональна числу истекших броней.
+    """
+
+    def __init__(self, db: Database, interval: float = 30.0, batch_size: int = 500):
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def sweep(self) -> int:
+        """Один проход. Возвращает количество освобожденных позиций"""
+        released = 0
+        while True:
+            count = await self.db.release_expired_reservations(self.batch_size)
+            released += count
+            if count < self.batch_size:
+                break
+            # Даем поработать покупкам между пачками
+            await asyncio.sleep(0)
+
+        if released:
+            logger.info("Снято истекших броней: %s", released)
+        return released
+
+    async def run(self):
+        """Цикл периодической очистки"""
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка снятия истекших броней")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Запуск фоновой очистки"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка фоновой очистки"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,294 @@
+"""
+Планировщик фоновых задач: отложенные и периодические задачи
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Coroutine, Dict, List, Optional, Set
+
+from .database import Database
+
+
+logger = logging.getLogger(__name__)
+
+
+JobFunc = Callable[..., Awaitable[Any]]
+
+
+class CronSchedule:
+    """
+    Расписание в формате cron: "минуты часы дни_месяца месяцы дни_недели"
+
+    Поддерживаются *, числа, диапазоны (a-b), списки (a,b) и шаг (*/n, a-b/n).
+    Дни недели: 0–6, где 0 — воскресенье (7 тоже воскресенье).
+    """
+
+    _RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Неверное cron-выражение: {expression}")
+
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            self._parse_field(field, low, high) for field, (low, high) in zip(fields, self._RANGES)
+        ]
+        self.weekdays = {0 if day == 7 else day for day in weekdays}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_str = part.split("/", 1)
+                step = int(step_str)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(value) for value in part.split("-", 1))
+            else:
+                start = end = int(part)
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Неверное поле cron-выражения: {field}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        # В cron воскресенье — 0, в Python — 6
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        # Если заданы и дни месяца, и дни недели, достаточно совпадения любого
+        if not self._any_day and not self._any_weekday:
+            return day or weekday
+        return day and weekday
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Ближайшее время запуска строго после moment"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Ограничение на случай расписаний, которые никогда не срабатывают (31 февраля)
+        limit = candidate + timedelta(days=366 * 5)
+
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + candidate.month // 12
+                candidate = candidate.replace(year=year, month=candidate.month % 12 + 1, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+
+        raise ValueError(f"Расписание никогда не срабатывает: {self.expression}")
+
+
+class _PeriodicJob:
+    """Периодическая задача (по интервалу или cron-расписанию)"""
+
+    __slots__ = ("name", "func", "interval", "cron")
+
+    def __init__(self, name: str, func: JobFunc, interval: Optional[float] = None,
+                 cron: Optional[CronSchedule] = None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = cron
+
+    def next_run(self, now: float) -> float:
+        if self.cron is not None:
+            return self.cron.next_after(datetime.fromtimestamp(now)).timestamp()
+        return now + self.interval
+
+
+class Scheduler:
+    """
+    Планировщик задач внутри процесса
+
+    Все задачи лежат в одной куче по времени запуска, поэтому добавление и
+    выборка стоят O(log n) даже при тысячах ожидающих задач, а цикл спит
+    ровно до ближайшей из них.
+
+    Отложенные задачи (schedule) сохраняются в таблицу scheduled_jobs и
+    восстанавливаются после перезапуска; обработчик для них регистрируется
+    по имени через register, а аргументы должны сериализоваться в JSON.
+    Строка удаляется после выполнения, так что задача, прерванная
+    остановкой бота, будет выполнена при следующем запуске.
+
+    Периодические задачи (every, cron) не сохраняются — они объявляются
+    в коде при каждом запуске.
+
+    Args:
+        create_task: Запуск задачи (Lifecycle.create_task, чтобы остановка
+            бота дождалась выполняющихся задач)
+    """
+
+    def __init__(self, db: Database, create_task: Callable[[Coroutine], asyncio.Task] = asyncio.create_task):
+        self.db = db
+        self._create_task = create_task
+        self._handlers: Dict[str, JobFunc] = {}
+        self._queue: List[tuple] = []
+        self._pending: Dict[int, tuple] = {}  # job_id -> (name, kwargs) отложенных задач
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._running: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats = {'executed': 0, 'failed': 0, 'cancelled': 0}
+
+    @property
+    def pending_count(self) -> int:
+        """Количество ожидающих отложенных задач"""
+        return len(self._pending)
+
+    def register(self, name: str, func: JobFunc):
+        """Регистрация обработчика отложенных задач с именем name"""
+        self._handlers[name] = func
+
+    def _push(self, run_at: float, entry):
+        heapq.heappush(self._queue, (run_at, next(self._counter), entry))
+        # Будим цикл, только если новая задача стала ближайшей
+        if self._queue[0][2] is entry:
+            self._wakeup.set()
+
+    async def schedule(self, name: str, delay: float, **kwargs) -> int:
+        """
+        Отложенный однократный запуск задачи
+
+        Args:
+            name: Имя зарегистрированного обработчика
+            delay: Задержка в секундах
+            **kwargs: Аргументы обработчика (JSON-сериализуемые)
+
+        Returns:
+            ID задачи для отмены через cancel
+        """
+        if name not in self._handlers:
+            raise ValueError(f"Обработчик задачи не зарегистрирован: {name}")
+
+        run_at = time.time() + delay
+        job_id = await self.db.add_scheduled_job(name, json.dumps(kwargs, ensure_ascii=False), run_at)
+        self._pending[job_id] = (name, kwargs)
+        self._push(run_at, job_id)
+        return job_id
+
+    async def cancel(self, job_id: int) -> bool:
+        """Отмена отложенной задачи. Запись в куче пропускается при извлечении"""
+        removed = self._pending.pop(job_id, None) is not None
+        deleted = await self.db.delete_scheduled_job(job_id)
+        if removed or deleted:
+            self.stats['cancelled'] += 1
+        return removed or deleted
+
+    def every(self, name: str, interval: float, func: JobFunc, run_now: bool = False):
+        """Периодическая задача с фиксированным интервалом в секундах"""
+        job = _PeriodicJob(name, func, interval=interval)
+        now = time.time()
+        self._push(now if run_now else job.next_run(now), job)
+
+    def cron(self, name: str, expression: str, func: JobFunc):
+        """Периодическая задача по cron-расписанию (локальное время)"""
+        job = _PeriodicJob(name, func, cron=CronSchedule(expression))
+        self._push(job.next_run(time.time()), job)
+
+    async def load(self) -> int:
+        """Восстановление сохраненных отложенных задач. Возвращает их количество"""
+        loaded = 0
+        for row in await self.db.get_scheduled_jobs():
+            if row['job_id'] in self._pending:
+                continue
+            if row['name'] not in self._handlers:
+                logger.warning("Нет обработчика для задачи #%s (%s)", row['job_id'], row['name'])
+                continue
+            kwargs = json.loads(row['payload']) if row['payload'] else {}
+            self._pending[row['job_id']] = (row['name'], kwargs)
+            self._push(row['run_at'], row['job_id'])
+            loaded += 1
+        return loaded
+
+    def _dispatch(self, entry):
+        """Запуск извлеченной из кучи задачи в отдельной задаче asyncio"""
+        if isinstance(entry, _PeriodicJob):
+            coro = self._run_periodic(entry)
+        else:
+            job = self._pending.pop(entry, None)
+            if job is None:
+                # Задача была отменена
+                return
+            coro = self._run_once(entry, *job)
+
+        task = self._create_task(coro)
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run_once(self, job_id: int, name: str, kwargs: dict):
+        try:
+            await self._handlers[name](**kwargs)
+            self.stats['executed'] += 1
+        except asyncio.CancelledError:
+            # Остановка бота: строка остается в базе и выполнится после перезапуска
+            raise
+        except Exception:
+            self.stats['failed'] += 1
+            logger.exception("Ошибка выполнения задачи #%s (%s)", job_id, name)
+        await self.db.delete_scheduled_job(job_id)
+
+    async def _run_periodic(self, job: _PeriodicJob):
+        try:
+            await job.func()
+            self.stats['executed'] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.stats['failed'] += 1
+            logger.exception("Ошибка выполнения периодической задачи %s", job.name)
+        finally:
+            # Следующий запуск считается от завершения, поэтому запуски не накладываются
+            self._push(job.next_run(time.time()), job)
+
+    async def run(self):
+        """Основной цикл планировщика"""
+        loaded = await self.load()
+        if loaded:
+            logger.info("Восстановлено отложенных задач: %s", loaded)
+
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._queue and self._queue[0][0] <= now:
+                _, _, entry = heapq.heappop(self._queue)
+                self._dispatch(entry)
+
+            timeout = self._queue[0][0] - now if self._queue else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Запуск планировщика"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка планировщика и отмена выполняющихся задач"""
+        tasks = list(self._running)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._running.clear()
@@ -0,0 +1,157 @@
+"""
+Сессия Bot API: пул соединений, keep-alive, таймауты по методам,
+повтор после ограничения частоты и метрики запросов
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+
+logger = logging.getLogger(__name__)
+
+
+# Таймауты по методам (сек); остальные методы используют общий таймаут сессии
+DEFAULT_METHOD_TIMEOUTS = {
+    "answerCallbackQuery": 5,
+    "deleteMessage": 10,
+    "getChatMember": 10,
+    "sendMessage": 15,
+    "editMessageText": 15,
+    "copyMessage": 15,
+    "sendPhoto": 60,
+    "sendDocument": 120,
+}
+
+# Long polling держит запрос открытым и в метрики задержки не попадает
+UNTRACKED_METHODS = frozenset({"getUpdates"})
+
+
+class SessionStats:
+    """Метрики запросов к Bot API"""
+
+    def __init__(self, window: int = 1000):
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.by_method: Dict[str, int] = {}
+        self._latencies = deque(maxlen=window)  # Последние задержки, мс
+
+    def record(self, method: str, elapsed_ms: float, failed: bool):
+        self.requests += 1
+        if failed:
+            self.errors += 1
+        self.by_method[method] = self.by_method.get(method, 0) + 1
+        self._latencies.append(elapsed_ms)
+
+    def latency(self) -> Dict[str, float]:
+        """Перцентили задержки по последним запросам, мс"""
+        if not self._latencies:
+            return {'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+        ordered = sorted(self._latencies)
+        last = len(ordered) - 1
+        return {
+            'p50': ordered[round(last * 0.5)],
+            'p95': ordered[round(last * 0.95)],
+            'max': ordered[last]
+        }
+
+
+class TunedAiohttpSession(AiohttpSession):
+    """
+    AiohttpSession с настроенным пулом соединений
+
+    Пул больше стандартного (рассылки и выдача идут параллельно с обычной
+    обработкой), соединения держатся открытыми keepalive_timeout секунд,
+    DNS кэшируется. Если таймаут запроса не передан явно, он берется из
+    method_timeouts по имени метода.
+    """
+
+    def __init__(self, api_url: Optional[str] = None, limit: int = 200, limit_per_host: int = 0,
+                 keepalive_timeout: float = 30.0, dns_cache_ttl: int = 300,
+                 method_timeouts: Optional[Dict[str, float]] = None, **kwargs):
+        api = TelegramAPIServer.from_base(api_url) if api_url else PRODUCTION
+        super().__init__(api=api, limit=limit, **kwargs)
+        self._connector_init.update(
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=dns_cache_ttl,
+        )
+        self.method_timeouts = {**DEFAULT_METHOD_TIMEOUTS, **(method_timeouts or {})}
+        self.stats = SessionStats()
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType],
+                           timeout: Optional[int] = None) -> TelegramType:
+        name = method.__api_method__
+        if timeout is None:
+            timeout = self.method_timeouts.get(name)
+        if name in UNTRACKED_METHODS:
+            return await super().make_request(bot, method, timeout=timeout)
+
+        self.stats.in_flight += 1
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await super().make_request(bot, method, timeout=timeout)
+            failed = False
+            return result
+        finally:
+            self.stats.in_flight -= 1
+            self.stats.record(name, (time.perf_counter() - started) * 1000, failed)
+
+
+class RetryAfterMiddleware(BaseRequestMiddleware):
+    """
+    Повтор запроса после TelegramRetryAfter
+
+    Ждет указанное Telegram время и повторяет запрос до max_retries раз;
+    если требуемое ожидание больше max_delay секунд, ошибка пробрасывается.
+    """
+
+    def __init__(self, max_retries: int = 3, max_delay: float = 60.0,
+                 stats: Optional[SessionStats] = None):
+        self.max_retries = max_retries
+        self.max_delay = max_delay
+        self.stats = stats
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        attempt = 0
+        while True:
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries or e.retry_after > self.max_delay:
+                    raise
+                if self.stats:
+                    self.stats.retries += 1
+                logger.warning(
+                    "Ограничение частоты для %s, повтор через %s с (попытка %s)",
+                    method.__api_method__, e.retry_after, attempt
+                )
+                await asyncio.sleep(e.retry_after)
+
+
+def create_session(api_url: Optional[str] = None, pool_limit: int = 200, keepalive_timeout: float = 30.0,
+                   retry_max: int = 3) -> TunedAiohttpSession:
+    """Сессия Bot API с повтором после ограничения частоты"""
+    session = TunedAiohttpSession(api_url=api_url, limit=pool_limit, keepalive_timeout=keepalive_timeout)
+    if retry_max:
+        session.middleware(RetryAfterMiddleware(max_retries=retry_max, stats=session.stats))
+    return session
@@ -0,0 +1,147 @@
+"""
+Профилирование запуска бота (флаг --profile-startup)
+"""
+import importlib.abc
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    # Модуль импортируется до начала замера, поэтому сам aiogram не импортирует
+    from aiogram.types import TelegramObject
+
+
+logger = logging.getLogger(__name__)
+
+
+class _TimedLoader:
+    """Обертка загрузчика модуля, замеряющая выполнение модуля"""
+
+    def __init__(self, loader, name: str, timer: "_ImportTimer"):
+        self._loader = loader
+        self._name = name
+        self._timer = timer
+
+    def __getattr__(self, item):
+        return getattr(self._loader, item)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._timer.enter()
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer.leave(self._name, time.perf_counter() - started)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    """
+    Поисковик модулей, оборачивающий загрузчики остальных поисковиков
+
+    Для каждого модуля считается собственное время импорта без учета
+    вложенных импортов (как у python -X importtime).
+    """
+
+    def __init__(self):
+        self.times: Dict[str, float] = {}
+        self._children: List[float] = []
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, fullname, self)
+                return spec
+        return None
+
+    def enter(self):
+        self._children.append(0.0)
+
+    def leave(self, name: str, elapsed: float):
+        children = self._children.pop()
+        self.times[name] = elapsed - children
+        if self._children:
+            self._children[-1] += elapsed
+
+
+class StartupProfiler:
+    """
+    Замеры этапов запуска: импорт модулей, инициализация базы и остальные
+    этапы main(), время до первого обновления.
+
+    Замер импортов начинается в telegramshop.run до импорта main.py, поэтому
+    в отчет попадают и зависимости самого main.py (aiogram, aiosqlite);
+    обработчики импортируются лениво в get_handlers_router и тоже замеряются.
+    Выключенный профилировщик ничего не делает.
+    """
+
+    def __init__(self, enabled: bool = True, top_imports: int = 15):
+        self.enabled = enabled
+        self.top_imports = top_imports
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.first_update: Optional[float] = None
+        self._import_timer: Optional[_ImportTimer] = None
+
+    def track_imports(self):
+        """Начать замер импортов"""
+        if self.enabled and self._import_timer is None:
+            self._import_timer = _ImportTimer()
+            sys.meta_path.insert(0, self._import_timer)
+
+    def stop_tracking_imports(self):
+        """Закончить замер импортов"""
+        if self._import_timer is not None and self._import_timer in sys.meta_path:
+            sys.meta_path.remove(self._import_timer)
+
+    @contextmanager
+    def phase(self, name: str):
+        """Замер этапа запуска"""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def report(self) -> str:
+        """Текстовый отчет о запуске"""
+        lines = ["Профиль запуска:"]
+        for name, elapsed in self.phases:
+            lines.append(f"  {name:<28} {elapsed * 1000:9.1f} мс")
+
+        if self._import_timer is not None and self._import_timer.times:
+            imports = self._import_timer.times
+            lines.append(
+                f"  Импорт модулей: {len(imports)} шт., {sum(imports.values()) * 1000:.1f} мс, самые долгие:"
+            )
+            slowest = sorted(imports.items(), key=lambda item: item[1], reverse=True)
+            for name, elapsed in slowest[:self.top_imports]:
+                lines.append(f"    {name:<40} {elapsed * 1000:7.1f} мс")
+
+        if self.first_update is not None:
+            lines.append(f"  До первого обновления: {(self.first_update - self.started) * 1000:.1f} мс")
+        return "\n".join(lines)
+
+    async def first_update_middleware(
+        self,
+        handler: Callable[["TelegramObject", Dict[str, Any]], Awaitable[Any]],
+        event: "TelegramObject",
+        data: Dict[str, Any]
+    ) -> Any:
+        """Outer middleware на update: фиксирует первое обновление и пишет отчет"""
+        if self.first_update is None:
+            self.first_update = time.perf_counter()
+            self.stop_tracking_imports()
+            logger.info(self.report())
+        return await handler(event, data)
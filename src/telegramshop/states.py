@@ -56,8 +56,18 @@ class BroadcastStates(StatesGroup):
     confirming = State()
 
 
+class ExportStates(StatesGroup):
+    """Состояния для выгрузки данных"""
+    entering_period = State()
+
+
 class EditInfoTextStates(StatesGroup):
     """Состояния для редактирования информационных текстов"""
     choosing_text = State()
     entering_text = State()
 
+
+
+class PaymentStates(StatesGroup):
+    """Состояния для пополнения баланса"""
+    entering_amount = State()
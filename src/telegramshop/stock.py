@@ -0,0 +1,146 @@
+"""
+Уведомления администраторов о заканчивающихся товарах
+"""
+import asyncio
+import html
+import logging
+from typing import Callable, Coroutine, Dict, Iterable, List, Optional, Set
+
+from aiogram import Bot
+
+from .database import Database
+
+
+logger = logging.getLogger(__name__)
+
+# Товаров в одном уведомлении (остальные — одной строкой), чтобы уложиться в лимит сообщения
+MAX_LINES = 50
+
+
+class StockWatcher:
+    """
+    Следит за остатками товаров по событиям базы (покупка, загрузка позиций,
+    пересчет остатков), без опроса
+
+    Остаток относится к уровню: сколько порогов он не превышает. Уведомление
+    ставится в очередь, когда товар опускается на более глубокий уровень
+    (например, 10 → 3 → 0); при пополнении уровень снижается, и следующее
+    падение снова уведомит. Очередь отправляется одним сообщением через
+    debounce секунд после первого события, поэтому серия покупок дает одно
+    уведомление с последними остатками.
+
+    Args:
+        thresholds: Пороги остатка, например (10, 3, 0)
+        debounce: Задержка отправки накопленных уведомлений, сек
+        create_task: Запуск отложенной отправки (Lifecycle.create_task)
+    """
+
+    def __init__(self, db: Database, bot: Bot, admin_ids: List[int],
+                 thresholds: Iterable[int] = (10, 3, 0), debounce: float = 60.0,
+                 create_task: Callable[[Coroutine], asyncio.Task] = asyncio.create_task):
+        self.db = db
+        self.bot = bot
+        self.admin_ids = admin_ids
+        self.thresholds = sorted(set(thresholds), reverse=True)
+        self.debounce = debounce
+        self._create_task = create_task
+        self._levels: Dict[int, int] = {}
+        self._pending: Dict[int, int] = {}  # product_id -> последний остаток
+        self._restocked: Dict[int, int] = {}  # закончившиеся и снова пополненные
+        self._empty: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        db.subscribe_stock(self.handle_stock)
+
+    def _level(self, stock: int) -> int:
+        return sum(1 for threshold in self.thresholds if stock <= threshold)
+
+    async def start(self):
+        """Начальные уровни по текущим остаткам (без уведомлений о том, что уже было)"""
+        for product_id, stock in (await self.db.get_stock_counts()).items():
+            level = self._level(stock)
+            if level:
+                self._levels[product_id] = level
+            if stock <= 0:
+                self._empty.add(product_id)
+
+    async def handle_stock(self, changes: Dict[int, int]):
+        """Новые остатки товаров от базы"""
+        for product_id, stock in changes.items():
+            level = self._level(stock)
+            previous = self._levels.get(product_id, 0)
+            if level:
+                self._levels[product_id] = level
+            else:
+                self._levels.pop(product_id, None)
+            was_empty = product_id in self._empty
+            if stock <= 0:
+                self._empty.add(product_id)
+            else:
+                self._empty.discard(product_id)
+
+            if level > previous:
+                self._pending[product_id] = stock
+                self._restocked.pop(product_id, None)
+            elif was_empty and stock > 0:
+                self._pending.pop(product_id, None)
+                self._restocked[product_id] = stock
+            elif product_id in self._pending:
+                # Уведомление уже в очереди: покажем последний остаток
+                self._pending[product_id] = stock
+                continue
+            else:
+                continue
+
+            if self._task is None:
+                self._task = self._create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.debounce)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> int:
+        """Отправка накопленных уведомлений. Возвращает число товаров в сообщении"""
+        pending, self._pending = self._pending, {}
+        restocked, self._restocked = self._restocked, {}
+        if not pending and not restocked:
+            return 0
+
+        lines = []
+        for product_id, stock in sorted(pending.items(), key=lambda item: item[1]):
+            name = await self._product_name(product_id)
+            if stock <= 0:
+                lines.append(f"❌ {name}: закончился")
+            else:
+                lines.append(f"⚠️ {name}: осталось {stock} шт.")
+        for product_id, stock in restocked.items():
+            lines.append(f"♻️ {await self._product_name(product_id)}: снова в наличии ({stock} шт.)")
+
+        if len(lines) > MAX_LINES:
+            lines[MAX_LINES:] = [f"… и еще {len(lines) - MAX_LINES}"]
+        text = "📦 <b>Остатки товаров</b>\n\n" + "\n".join(lines)
+        for admin_id in self.admin_ids:
+            try:
+                await self.bot.send_message(admin_id, text)
+            except Exception:
+                logger.warning("Не удалось уведомить администратора %s об остатках", admin_id)
+        return len(lines)
+
+    async def _product_name(self, product_id: int) -> str:
+        product = await self.db.get_product(product_id)
+        return html.escape(product['name']) if product else f"#{product_id}"
+
+    async def stop(self):
+        """Немедленная отправка накопленного"""
+        task = self._task
+        if task:
+            # Отложенная отправка выполнится сразу после отмены ожидания
+            task.cancel()
+            await task
+        else:
+            await self.flush()
@@ -0,0 +1,239 @@
+"""
+Трассировка обработки обновлений: корневой span на обновление, дочерние
+на методы базы данных и запросы к Bot API, выгрузка медленных трасс
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueListener
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "telegramshop"
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def _new_id() -> str:
+    return os.urandom(8).hex()
+
+
+class Span:
+    """Отрезок обработки: имя, время начала и длительность в микросекундах, теги"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "tags", "start_us", "duration_us", "_token")
+
+    def __init__(self, trace: "_Trace", name: str, parent_id: Optional[str] = None,
+                 kind: Optional[str] = None, tags: Optional[Dict[str, Any]] = None):
+        self.trace = trace
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.tags = tags or {}
+        self.start_us = time.time_ns() // 1000
+        self.duration_us = 0
+        self._token = None
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_us = time.time_ns() // 1000 - self.start_us
+        if exc_type is not None:
+            self.tags["error"] = exc_type.__name__
+        _current_span.reset(self._token)
+        self.trace.spans.append(self)
+        if self.parent_id is None:
+            self.trace.tracer.finish(self.trace, self)
+
+    def to_zipkin(self) -> Dict[str, Any]:
+        """Span в формате Zipkin v2"""
+        data = {
+            "traceId": self.trace.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": self.start_us,
+            "duration": self.duration_us,
+            "localEndpoint": {"serviceName": SERVICE_NAME},
+            "tags": {key: str(value) for key, value in self.tags.items()},
+        }
+        if self.parent_id:
+            data["parentId"] = self.parent_id
+        if self.kind:
+            data["kind"] = self.kind
+        return data
+
+
+class _Trace:
+    """Все span одного обновления"""
+
+    __slots__ = ("tracer", "trace_id", "spans")
+
+    def __init__(self, tracer: "Tracer"):
+        self.tracer = tracer
+        self.trace_id = _new_id() + _new_id()
+        self.spans: List[Span] = []
+
+
+class _TraceFileHandler(logging.Handler):
+    """Дописывает трассу строкой JSON в файл; выполняется в потоке QueueListener"""
+
+    def __init__(self, path: str, stats: Dict[str, int]):
+        super().__init__()
+        self.path = path
+        self.stats = stats
+
+    def emit(self, record: logging.LogRecord):
+        line = json.dumps(record.msg, ensure_ascii=False)
+        try:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(line + "\n")
+            self.stats['exported'] += 1
+        except OSError:
+            logger.exception("Не удалось записать трассу в %s", self.path)
+
+
+class Tracer:
+    """
+    Трассировщик
+
+    Выключенный трассировщик не создает корневых span, а дочерние span
+    создаются только внутри корневого, поэтому без трассировки обертки
+    стоят одного чтения contextvar.
+
+    Трассы дольше slow_threshold_ms дописываются в файл path строкой
+    JSON в формате Zipkin v2 (список span), пригодной для загрузки
+    в Zipkin или Jaeger. Сериализация и запись выполняются в отдельном
+    потоке (QueueListener, как у логов), цикл событий только кладет
+    трассу в очередь; при выходе нужно вызвать stop, чтобы дописать очередь.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_threshold_ms = 500.0
+        self.path: Optional[str] = None
+        self.stats = {'traces': 0, 'exported': 0}
+        self._queue: Optional[queue.SimpleQueue] = None
+        self._listener: Optional[QueueListener] = None
+
+    def configure(self, enabled: bool, slow_threshold_ms: float = 500.0, path: Optional[str] = None):
+        """Включение трассировки и запуск потока записи трасс"""
+        self.stop()
+        self.enabled = enabled
+        self.slow_threshold_ms = slow_threshold_ms
+        self.path = path
+        if enabled and path:
+            self._queue = queue.SimpleQueue()
+            self._listener = QueueListener(self._queue, _TraceFileHandler(path, self.stats))
+            self._listener.start()
+
+    def stop(self):
+        """Остановка потока записи: дописывает трассы из очереди"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+            self._queue = None
+
+    def start_trace(self, name: str, kind: Optional[str] = None, **tags) -> Span:
+        """Корневой span новой трассы"""
+        return Span(_Trace(self), name, kind=kind, tags=tags)
+
+    def finish(self, trace: _Trace, root: Span):
+        """Завершение трассы: выгрузка, если она медленная"""
+        self.stats['traces'] += 1
+        if self._queue is not None and root.duration_us >= self.slow_threshold_ms * 1000:
+            self.export(trace)
+
+    def export(self, trace: _Trace):
+        """Передача трассы в поток записи (одна строка на трассу)"""
+        spans = [span.to_zipkin() for span in trace.spans]
+        self._queue.put_nowait(logging.makeLogRecord({"msg": spans}))
+
+
+tracer = Tracer()
+
+
+def child_span(name: str, kind: Optional[str] = None, **tags) -> Optional[Span]:
+    """Дочерний span текущей трассы или None, если трассы нет"""
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return Span(parent.trace, name, parent_id=parent.span_id, kind=kind, tags=tags)
+
+
+def traced(name: str):
+    """Декоратор корутины: дочерний span на каждый вызов"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            span = child_span(name)
+            if span is None:
+                return await func(*args, **kwargs)
+            with span:
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_methods(prefix: str):
+    """Декоратор класса: span вокруг каждого публичного асинхронного метода"""
+    def decorator(cls):
+        for attr, value in list(vars(cls).items()):
+            if not attr.startswith("_") and inspect.iscoroutinefunction(value):
+                setattr(cls, attr, traced(f"{prefix}.{attr}")(value))
+        return cls
+    return decorator
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Outer middleware на update: корневой span обновления"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not tracer.enabled:
+            return await handler(event, data)
+
+        tags = {}
+        if isinstance(event, Update):
+            tags["update_id"] = event.update_id
+        user = data.get("event_from_user")
+        if user:
+            tags["user_id"] = user.id
+
+        with tracer.start_trace("update", kind="SERVER", **tags):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: дочерний span на каждый запрос к Bot API"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        span = child_span(f"bot.{method.__api_method__}", kind="CLIENT")
+        if span is None:
+            return await make_request(bot, method)
+        with span:
+            return await make_request(bot, method)
@@ -1,27 +1,26 @@
 """
 Вспомогательные утилиты для бота
 """
-import asyncio
 from aiogram import Bot
 from aiogram.types import Message
-from typing import List, Optional
+from typing import List
 
+from .logs import count_failure
 
-async def delete_message_after_delay(bot: Bot, chat_id: int, message_id: int, delay: int):
+
+async def delete_message(bot: Bot, chat_id: int, message_id: int):
     """
-    Удалить сообщение через заданное количество секунд
+    Удалить сообщение; ошибки учитываются в счетчике delete_message (задача планировщика)
     
     Args:
         bot: Экземпляр бота
         chat_id: ID чата
         message_id: ID сообщения
-        delay: Задержка в секундах
     """
-    await asyncio.sleep(delay)
     try:
         await bot.delete_message(chat_id, message_id)
-    except Exception:
-        pass
+    except Exception as e:
+        count_failure("delete_message", e)
 
 
 async def delete_messages(bot: Bot, chat_id: int, message_ids: List[int]):
@@ -34,10 +33,7 @@ async def delete_messages(bot: Bot, chat_id: int, message_ids: List[int]):
         message_ids: Список ID сообщений для удаления
     """
     for msg_id in message_ids:
-        try:
-            await bot.delete_message(chat_id, msg_id)
-        except Exception:
-            pass
+        await delete_message(bot, chat_id, msg_id)
 
 
 async def safe_delete_message(message: Message):
@@ -49,6 +45,6 @@ async def safe_delete_message(message: Message):
     """
     try:
         await message.delete()
-    except Exception:
-        pass
+    except Exception as e:
+        count_failure("delete_message", e)
 
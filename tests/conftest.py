@@ -0,0 +1,34 @@
+"""
+Общие фикстуры тестов
+"""
+import pytest
+from aiogram import Bot
+
+from telegramshop.database import Database
+from telegramshop.fake_bot_api import FakeBotAPI
+from telegramshop.session import create_session
+
+
+@pytest.fixture
+async def db(tmp_path):
+    """Пустая база во временном каталоге"""
+    database = Database(str(tmp_path / "shop.db"))
+    await database.init_db()
+    return database
+
+
+@pytest.fixture
+async def fake_api():
+    """Локальный FakeBotAPI (retry_after — 1 с, минимальное значение, которое aiogram считает повтором)"""
+    api = FakeBotAPI(retry_after=1)
+    await api.start()
+    yield api
+    await api.stop()
+
+
+@pytest.fixture
+async def bot(fake_api):
+    """Бот с сессией как в main (повтор после 429), направленный на fake_api"""
+    bot = Bot("1:test", session=create_session(api_url=fake_api.url))
+    yield bot
+    await bot.session.close()
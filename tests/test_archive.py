@@ -0,0 +1,68 @@
+"""
+Тесты архива: перенос старых заказов не меняет статистику и сегменты рассылок
+"""
+import sqlite3
+
+import pytest
+
+from telegramshop.database import Database
+
+
+@pytest.fixture
+async def shop(tmp_path):
+    archive_path = str(tmp_path / "archive.db")
+    db = Database(str(tmp_path / "shop.db"), archive_path=archive_path)
+    await db.init_db()
+    category_id = await db.add_category("Игры")
+    other_id = await db.add_category("Софт")
+    product_id = await db.add_product(category_id, "Ключ", "", 10.0)
+    other_product_id = await db.add_product(other_id, "Лицензия", "", 5.0)
+    for user_id in range(1, 5):
+        await db.add_user(user_id, None, f"user{user_id}")
+    # Пользователи 1 и 2 купили в категории давно, 3 — недавно, 4 — в другой категории
+    with sqlite3.connect(db.db_path) as conn:
+        conn.executemany("""
+            INSERT INTO orders (user_id, product_id, product_name, amount, status, created_at)
+            VALUES (?, ?, 'x', ?, ?, datetime('now', ?))
+        """, [
+            (1, product_id, 10.0, "completed", "-200 days"),
+            (2, product_id, 10.0, "completed", "-120 days"),
+            (2, product_id, 10.0, "cancelled", "-120 days"),
+            (3, product_id, 10.0, "completed", "-1 days"),
+            (4, other_product_id, 5.0, "completed", "-200 days"),
+        ])
+    await db.init_archive(archive_path)
+    return db, archive_path, category_id
+
+
+async def test_statistics_survive_archiving(shop):
+    db, archive_path, _ = shop
+    before = await db.get_statistics()
+
+    assert await db.archive_orders(archive_path, 90) == 4
+
+    assert await db.get_statistics() == before
+    assert before['orders_count'] == 4 and before['revenue'] == 35.0
+
+
+async def test_category_segment_includes_archived_buyers(shop):
+    db, archive_path, category_id = shop
+    before = await db.count_broadcast_audience("category", str(category_id))
+
+    await db.archive_orders(archive_path, 90)
+
+    assert before == 3
+    assert await db.count_broadcast_audience("category", str(category_id)) == 3
+    broadcast = await db.create_broadcast("category", "hi", str(category_id))
+    assert broadcast['total'] == 3
+    assert await db.get_broadcast_recipients(broadcast['broadcast_id']) == [1, 2, 3]
+
+
+async def test_statistics_without_archive(tmp_path):
+    db = Database(str(tmp_path / "shop.db"), archive_path=str(tmp_path / "missing.db"))
+    await db.init_db()
+    await db.add_order(1, "x", 7.0)
+
+    stats = await db.get_statistics()
+
+    assert stats['orders_count'] == 1 and stats['revenue'] == 7.0
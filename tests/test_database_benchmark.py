@@ -0,0 +1,115 @@
+"""
+Бенчмарк методов Database в тестах: каждый публичный метод выполняется
+на небольшой сгенерированной базе, а сравнение с прошлым прогоном
+находит регрессии
+
+Полные замеры на 10k–1M строк — python -m telegramshop.benchmarks database.
+Только эти тесты: pytest -m benchmark.
+"""
+import argparse
+import asyncio
+import json
+import shutil
+
+import pytest
+
+from telegramshop.benchmarks import database as bench
+from telegramshop.database import Database
+
+
+pytestmark = pytest.mark.benchmark
+
+ROWS = 1000
+
+
+@pytest.fixture(scope="module")
+def template(tmp_path_factory):
+    """Сгенерированная база на ROWS строк (одна на модуль)"""
+    data_dir = tmp_path_factory.mktemp("bench")
+    return asyncio.run(bench._template(data_dir, ROWS))
+
+
+@pytest.fixture
+async def generated(template, tmp_path):
+    """Копия сгенерированной базы с архивом, как в бенчмарке"""
+    path = tmp_path / "bench.db"
+    shutil.copyfile(template, path)
+    ctx = bench.Context(ROWS, str(tmp_path / "archive.db"))
+    db = Database(str(path), archive_path=ctx.archive_path)
+    await db.init_archive(ctx.archive_path)
+    return db, ctx
+
+
+def test_every_public_method_has_case():
+    assert [name for name in bench.public_methods() if name not in bench.CASES] == []
+
+
+@pytest.mark.parametrize("name", sorted(bench.CASES))
+async def test_case_runs(generated, name):
+    db, ctx = generated
+
+    samples = await bench.measure(db, ctx, bench.CASES[name], iterations=3, max_seconds=1.0)
+
+    assert len(samples) == 3
+    stats = bench.summarize(samples)
+    assert stats['ops_per_sec'] > 0 and stats['p50_ms'] <= stats['p99_ms']
+
+
+async def test_generated_database_is_consistent(generated):
+    db, ctx = generated
+
+    assert await db.get_users_count() == ROWS
+    assert await db.verify_balances() == []
+    assert await db.reconcile_stock() == 0
+    # У каждого товара есть позиции в наличии: покупки в замерах проходят
+    stock = await db.get_stock_counts()
+    assert len(stock) == bench.PRODUCTS and min(stock.values()) > 0
+    user = await db.get_user(ctx.user_id(1))
+    assert user['balance'] == 1000
+    payment = await db.get_payment(ctx.pending_payment_id(1))
+    assert payment['status'] == "pending"
+
+
+async def test_purchase_case_creates_order(generated):
+    db, ctx = generated
+    user_id = ctx.user_id(0)
+    stock = await db.get_available_stock(ctx.product_id(0))
+
+    await bench.measure(db, ctx, bench.CASES["complete_purchase"], iterations=1, max_seconds=1.0)
+
+    assert await db.get_available_stock(ctx.product_id(0)) == stock - 1
+    orders = await db.get_user_orders(user_id)
+    assert orders[0]['product_id'] == ctx.product_id(0)
+
+
+def test_compare_flags_only_significant_growth():
+    baseline = {"results": {"1000": {
+        "get_user": {"p50_ms": 1.0}, "get_setting": {"p50_ms": 0.01}, "add_user": {"p50_ms": 2.0},
+    }}}
+    results = {"results": {"1000": {
+        # +50%: регрессия; +100%, но на 0.01 мс: шум; -50%: ускорение
+        "get_user": {"p50_ms": 1.5}, "get_setting": {"p50_ms": 0.02}, "add_user": {"p50_ms": 1.0},
+        "get_product": {"p50_ms": 5.0},
+    }}}
+
+    regressions = bench.compare(results, baseline, threshold=0.2, min_delta_ms=0.05)
+
+    assert len(regressions) == 1 and "get_user" in regressions[0]
+
+
+async def test_run_writes_results_and_detects_regression(template, tmp_path):
+    shutil.copyfile(template, tmp_path / template.name)
+    output = tmp_path / "results.json"
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps({"results": {str(ROWS): {"get_user": {"p50_ms": 0.0001}}}}))
+    args = argparse.Namespace(
+        rows=[ROWS], methods=["get_user", "add_user"], iterations=5, max_seconds=1.0,
+        data_dir=str(tmp_path), compression="none", output=str(output), baseline=str(baseline),
+        threshold=0.2, min_delta_ms=0.0,
+    )
+
+    assert await bench.run(args) == 1
+
+    results = json.loads(output.read_text(encoding="utf-8"))
+    assert set(results["results"][str(ROWS)]) == {"get_user", "add_user"}
+    assert results["results"][str(ROWS)]["get_user"]["count"] == 5
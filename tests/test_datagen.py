@@ -0,0 +1,35 @@
+"""
+Тесты генератора синтетических данных
+"""
+import sqlite3
+
+from telegramshop.datagen import DataSpec, generate
+
+
+SPEC = DataSpec(users=50, categories=3, products=10, items=200, batch_size=64)
+
+
+def _dump(path) -> list:
+    db = sqlite3.connect(path)
+    try:
+        return list(db.iterdump())
+    finally:
+        db.close()
+
+
+def test_same_seed_gives_same_database(tmp_path):
+    generate(str(tmp_path / "a.db"), SPEC)
+    generate(str(tmp_path / "b.db"), SPEC)
+
+    assert _dump(tmp_path / "a.db") == _dump(tmp_path / "b.db")
+
+
+def test_generated_database_uses_wal(tmp_path):
+    path = tmp_path / "scale.db"
+    generate(str(path), SPEC)
+
+    db = sqlite3.connect(path)
+    try:
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    finally:
+        db.close()
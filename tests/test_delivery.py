@@ -0,0 +1,67 @@
+"""
+Тесты выдачи позиций документом
+"""
+import html
+import time
+
+import pytest
+from aiogram.types import Message
+
+from telegramshop.delivery import CAPTION_LIMIT, ItemsInputFile, deliver_items
+
+
+async def _read(document: ItemsInputFile, bot) -> bytes:
+    return b"".join([chunk async for chunk in document.read(bot)])
+
+
+async def _items(count: int):
+    for i in range(count):
+        yield f"item-{i}"
+
+
+async def test_factory_is_read_again_on_every_read(bot):
+    document = ItemsInputFile(lambda: _items(3), filename="items.txt", chunk_size=8)
+
+    assert await _read(document, bot) == b"item-0\nitem-1\nitem-2\n"
+    assert await _read(document, bot) == b"item-0\nitem-1\nitem-2\n"
+
+
+async def test_one_shot_iterators_are_rejected():
+    with pytest.raises(TypeError):
+        ItemsInputFile(_items(3), filename="items.txt")
+    with pytest.raises(TypeError):
+        ItemsInputFile(iter(["a"]), filename="items.txt")
+
+
+async def test_document_survives_retry_after(fake_api, bot):
+    fake_api.inject_retry_after("sendDocument")
+
+    await bot.send_document(1, ItemsInputFile(lambda: _items(1000), filename="purchases.txt"))
+
+    assert bot.session.stats.retries == 1
+    method, params = fake_api.requests[-1]
+    assert method == "sendDocument"
+    # aiogram передает файл отдельным полем формы: document = attach://<поле>
+    content = params[params["document"].removeprefix("attach://")]
+    assert content == "".join(f"item-{i}\n" for i in range(1000)).encode()
+
+
+async def test_long_caption_is_truncated_before_escaping(fake_api, bot):
+    message = Message.model_validate({
+        "message_id": 1,
+        "date": int(time.time()),
+        "chat": {"id": 1, "type": "private"},
+    }, context={"bot": bot})
+    header = "🎯 Товар: " + "<b>&amp;</b> " * 200
+
+    await deliver_items(message, header, ["x" * 5000], footer="💰 Баланс: 10 руб.")
+
+    method, params = fake_api.requests[-1]
+    assert method == "sendDocument"
+    caption = params["caption"]
+    # Обрезан только заголовок, подпись и разметка целы
+    assert html.escape(html.unescape(caption)) == caption
+    text = html.unescape(caption)
+    assert len(text.encode("utf-16-le")) // 2 <= CAPTION_LIMIT
+    assert text.startswith("🎯 Товар: <b>&amp;</b>")
+    assert text.endswith("…\n📦 Ваш товар во вложении.\n💰 Баланс: 10 руб.")
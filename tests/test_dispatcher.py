@@ -0,0 +1,89 @@
+"""
+Сквозные тесты: настоящий Dispatcher с обработчиками бота против FakeBotAPI
+
+Исключение любого обработчика проваливает тест (dp["errors"]).
+"""
+import pytest
+
+from telegramshop.benchmarks.dispatcher import (
+    ADMIN_ID, _build_dispatcher, _prepare, broadcast_flow, polling_flow, shop_flow, wait_replies
+)
+from telegramshop.config import BotConfig
+
+
+USERS = 20
+
+
+@pytest.fixture
+async def shop(tmp_path, fake_api, bot):
+    db, category_id, product_id = await _prepare(str(tmp_path / "shop.db"), USERS, USERS * 2)
+    dp = _build_dispatcher(db, bot, BotConfig(token="1:test", admin_ids=[ADMIN_ID]))
+    yield db, dp, category_id, product_id
+    # Роутеры модулей обработчиков глобальные и подключаются к одному родителю
+    for router in dp.sub_routers:
+        for handler_router in router.sub_routers:
+            handler_router._parent_router = None
+    assert dp["errors"] == []
+
+
+async def test_purchase_flow(shop, fake_api, bot):
+    db, dp, category_id, product_id = shop
+
+    samples, _ = await shop_flow(fake_api, dp, bot, USERS, category_id, product_id)
+
+    assert len(samples) == USERS * 6
+    assert dp["errors"] == []
+    assert (await db.get_product(product_id))['stock_count'] == USERS
+    for user_id in range(1, USERS + 1):
+        orders = await db.get_user_orders(user_id)
+        assert [order['product_id'] for order in orders] == [product_id]
+
+
+async def test_polling_burst_of_new_users(shop, fake_api, bot):
+    """Параллельные /start новых пользователей не упираются в блокировку базы"""
+    db, dp, _, _ = shop
+    updates = 200
+
+    await polling_flow(fake_api, dp, bot, updates)
+
+    assert dp["errors"] == []
+    for user_id in (1, USERS + 1, updates):
+        assert await db.get_user(user_id) is not None
+
+
+async def test_broadcast_skips_blocked_users(shop, fake_api, bot):
+    db, dp, _, _ = shop
+    fake_api.blocked_chats.update(range(1, 6))
+
+    sent_before = fake_api.calls["sendMessage"]
+    await broadcast_flow(fake_api, dp, bot)
+    first = fake_api.calls["sendMessage"] - sent_before
+
+    sent_before = fake_api.calls["sendMessage"]
+    await broadcast_flow(fake_api, dp, bot)
+    second = fake_api.calls["sendMessage"] - sent_before
+
+    # Все пользователи и администратор плюс итог рассылки администратору
+    assert first == USERS + 1 + 1
+    assert second == first - 5
+    assert dp["errors"] == []
+
+
+async def test_handler_error_stops_waiting(shop, fake_api, bot, monkeypatch):
+    db, dp, _, _ = shop
+
+    async def broken_add_user(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(db, "add_user", broken_add_user)
+
+    with pytest.raises(RuntimeError, match="Ошибок обработчиков: 1"):
+        await polling_flow(fake_api, dp, bot, 1)
+    dp["errors"].clear()
+
+
+async def test_wait_replies_without_errors(shop, fake_api, bot):
+    _, dp, _, _ = shop
+
+    await bot.send_message(1, "hi")
+    await wait_replies(fake_api, dp, 1, timeout=1)
@@ -0,0 +1,130 @@
+"""
+Тесты загрузки позиций со сжатием и шифрованием: ключ данных и словарь
+создаются в транзакции загрузки и кэшируются только после ее фиксации
+"""
+import sqlite3
+
+import pytest
+
+from telegramshop.database import Database
+from telegramshop.encryption import generate_master_key, is_encrypted
+
+
+@pytest.fixture
+def master_key():
+    return generate_master_key()
+
+
+@pytest.fixture
+async def secure_db(tmp_path, master_key):
+    database = Database(str(tmp_path / "shop.db"), compression="zlib", master_key=master_key)
+    await database.init_db()
+    return database
+
+
+def _count(db: Database, table: str) -> int:
+    with sqlite3.connect(db.db_path) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def _lines(count: int, fail_after: int = None):
+    for n in range(count):
+        if n == fail_after:
+            raise RuntimeError("обрыв загрузки")
+        yield f"login{n}:password{n}"
+
+
+async def _product(db: Database) -> int:
+    category_id = await db.add_category("c")
+    return await db.add_product(category_id, "Товар", "", 1.0)
+
+
+async def test_failed_bulk_load_leaves_nothing(secure_db):
+    product_id = await _product(secure_db)
+
+    with pytest.raises(RuntimeError):
+        await secure_db.add_product_items_bulk(product_id, _lines(50, fail_after=30), batch_size=10)
+
+    for table in ("product_items", "data_keys", "payload_dicts"):
+        assert _count(secure_db, table) == 0
+    assert secure_db._product_keys == {}
+    assert secure_db._dictionaries == {}
+    assert secure_db.cipher.lookup(range(1, 4))[0] == {}
+
+
+async def test_bulk_load_after_rollback(secure_db):
+    product_id = await _product(secure_db)
+    with pytest.raises(RuntimeError):
+        await secure_db.add_product_items_bulk(product_id, _lines(50, fail_after=30), batch_size=10)
+
+    assert await secure_db.add_product_items_bulk(product_id, _lines(30), batch_size=10) == 30
+
+    assert _count(secure_db, "data_keys") == 1
+    assert _count(secure_db, "payload_dicts") == 1
+    with sqlite3.connect(secure_db.db_path) as conn:
+        key_id, = conn.execute("SELECT key_id FROM data_keys").fetchone()
+        dict_id, = conn.execute("SELECT dict_id FROM payload_dicts").fetchone()
+    assert secure_db._product_keys == {product_id: key_id}
+    assert set(secure_db._dictionaries) == {dict_id}
+
+    item = await secure_db.get_available_product_item(product_id)
+    assert is_encrypted(item['data'])
+    revealed, = await secure_db.reveal_items([item])
+    assert revealed['data'] == "login0:password0"
+
+
+async def test_items_decrypt_with_fresh_cache(secure_db, master_key):
+    product_id = await _product(secure_db)
+
+    await secure_db.add_product_item(product_id, "first")
+    await secure_db.add_product_item(product_id, "second")
+
+    assert _count(secure_db, "data_keys") == 1
+    # Без кэша ключ разворачивается из базы
+    fresh = Database(secure_db.db_path, compression="zlib", master_key=master_key)
+    item = await fresh.get_available_product_item(product_id)
+    revealed, = await fresh.reveal_items([item])
+    assert revealed['data'] == "first"
+
+
+def _raw_bytes(db: Database) -> bytes:
+    """Содержимое файла базы после переноса журнала WAL"""
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    with open(db.db_path, "rb") as file:
+        return file.read()
+
+
+async def test_no_item_plaintext_in_database_file(secure_db):
+    product_id = await _product(secure_db)
+
+    await secure_db.add_product_items_bulk(product_id, _lines(50))
+
+    raw = _raw_bytes(secure_db)
+    assert b"password7" not in raw and b"login" not in raw
+    with sqlite3.connect(secure_db.db_path) as conn:
+        dictionary, = conn.execute("SELECT data FROM payload_dicts").fetchone()
+    assert is_encrypted(dictionary)
+    item = await secure_db.get_available_product_item(product_id)
+    revealed, = await secure_db.reveal_items([item])
+    assert revealed['data'] == "login0:password0"
+
+
+async def test_plain_dictionary_is_encrypted_on_next_load(tmp_path, master_key):
+    path = str(tmp_path / "shop.db")
+    plain = Database(path, compression="zlib")
+    await plain.init_db()
+    product_id = await _product(plain)
+    await plain.add_product_items_bulk(product_id, _lines(20))
+
+    secure = Database(path, compression="zlib", master_key=master_key)
+    await secure.add_product_items_bulk(product_id, [f"extra{n}:password{n}" for n in range(5)])
+
+    with sqlite3.connect(path) as conn:
+        dictionary, = conn.execute("SELECT data FROM payload_dicts").fetchone()
+    assert is_encrypted(dictionary)
+    # Позиции, сжатые открытым словарем, распаковываются расшифрованным
+    fresh = Database(path, compression="zlib", master_key=master_key)
+    item = await fresh.get_available_product_item(product_id)
+    revealed, = await fresh.reveal_items([item])
+    assert revealed['data'] == "login0:password0"
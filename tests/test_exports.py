@@ -0,0 +1,38 @@
+"""
+Тесты выгрузок таблиц
+"""
+import csv
+
+import pytest
+
+from telegramshop.exports import export_table
+
+
+async def _add_users(db, count: int):
+    for user_id in range(1, count + 1):
+        await db.add_user(user_id, f"user{user_id}", f"User {user_id}")
+
+
+async def test_export_writes_all_rows(db, tmp_path):
+    await _add_users(db, 5)
+    path = tmp_path / "exports" / "users.csv"
+
+    result = await export_table(db, "users", path, batch_size=2)
+
+    assert result['rows'] == 5
+    with path.open(encoding="utf-8") as f:
+        assert len(list(csv.DictReader(f))) == 5
+    assert list(path.parent.iterdir()) == [path]
+
+
+async def test_failed_export_removes_partial_file(db, tmp_path):
+    await _add_users(db, 5)
+    path = tmp_path / "exports" / "users.csv"
+
+    async def fail(done: int, total: int):
+        raise RuntimeError("обрыв выгрузки")
+
+    with pytest.raises(RuntimeError):
+        await export_table(db, "users", path, batch_size=2, progress=fail, progress_interval=0)
+
+    assert list(path.parent.iterdir()) == []
@@ -0,0 +1,113 @@
+"""
+Тесты FSM: буферизованный контекст и хранилище SQLite
+"""
+import asyncio
+import sqlite3
+
+import pytest
+from aiogram import Dispatcher, F, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import SimpleEventIsolation
+from aiogram.types import Message, Update
+
+from telegramshop.fsm_context import BufferedFSMMiddleware
+from telegramshop.fsm_storage import SQLiteStorage
+
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+@pytest.fixture
+async def storage(db):
+    storage = SQLiteStorage(db.db_path)
+    yield storage
+    await storage.close()
+
+
+def _remembering_dispatcher(storage: SQLiteStorage) -> Dispatcher:
+    """Диспетчер как в main: изоляция событий и буферизованный FSM"""
+    dp = Dispatcher(storage=storage, events_isolation=SimpleEventIsolation())
+    dp.update.outer_middleware(BufferedFSMMiddleware())
+    router = Router()
+
+    @router.message(F.text)
+    async def remember(message: Message, state: FSMContext):
+        await state.update_data({message.text: True})
+        # Второе обновление того же чата приходит, пока первое не записано
+        await asyncio.sleep(0.05)
+
+    dp.include_router(router)
+    return dp
+
+
+async def test_concurrent_updates_of_one_chat_keep_both_changes(storage, fake_api, bot):
+    dp = _remembering_dispatcher(storage)
+    updates = [
+        Update.model_validate(fake_api.message_update(1, text), context={"bot": bot})
+        for text in ("first", "second")
+    ]
+
+    await asyncio.gather(*(dp.feed_update(bot, update) for update in updates))
+
+    state = dp.fsm.get_context(bot, chat_id=1, user_id=1)
+    assert await state.get_data() == {"first": True, "second": True}
+
+
+def _rows(db_path: str) -> list:
+    db = sqlite3.connect(db_path)
+    try:
+        return db.execute("SELECT storage_key, state, data FROM fsm_states").fetchall()
+    finally:
+        db.close()
+
+
+async def test_storage_set_get_and_clear(storage, db):
+    await storage.set_state(KEY, "AdminStates:waiting_price")
+    await storage.update_data(KEY, {"name": "Товар"})
+    await storage.update_data(KEY, {"price": 10})
+
+    assert await storage.get_state(KEY) == "AdminStates:waiting_price"
+    assert await storage.get_data(KEY) == {"name": "Товар", "price": 10}
+    # Несколько изменений ключа — одна запись в базу
+    assert _rows(db.db_path) == []
+    assert await storage.flush() == 1
+    assert len(_rows(db.db_path)) == 1
+
+    await storage.set_record(KEY, None, {})
+    await storage.flush()
+
+    assert await storage.get_state(KEY) is None
+    assert await storage.get_data(KEY) == {}
+    assert _rows(db.db_path) == []
+
+
+async def test_storage_survives_restart(db):
+    storage = SQLiteStorage(db.db_path)
+    storage.start()
+    await storage.set_state(KEY, "AdminStates:waiting_items")
+    await storage.set_data(KEY, {"product_id": 7})
+    await storage.close()
+
+    restarted = SQLiteStorage(db.db_path)
+    assert await restarted.get_state(KEY) == "AdminStates:waiting_items"
+    assert await restarted.get_data(KEY) == {"product_id": 7}
+    assert restarted.stats['reads'] == 1
+    await restarted.close()
+
+
+async def test_storage_sweeps_stale_sessions(db):
+    storage = SQLiteStorage(db.db_path, ttl=3600)
+    await storage.update_data(KEY, {"step": 1})
+    await storage.update_data(StorageKey(bot_id=1, chat_id=20, user_id=20), {"step": 2})
+    await storage.flush()
+    connection = sqlite3.connect(db.db_path)
+    connection.execute("""
+        UPDATE fsm_states SET updated_at = datetime('now', '-2 hours') WHERE storage_key = ?
+    """, (storage.key_builder.build(KEY),))
+    connection.commit()
+    connection.close()
+
+    assert await storage.sweep() == 1
+    assert len(_rows(db.db_path)) == 1
+    await storage.close()
@@ -0,0 +1,110 @@
+"""
+Тесты остановки: дренаж фоновых задач и порядок действий
+"""
+import asyncio
+
+from telegramshop import broadcasts
+from telegramshop.lifecycle import Lifecycle
+from telegramshop.scheduler import Scheduler
+from telegramshop.stock import StockWatcher
+
+
+async def test_shutdown_order_and_single_run():
+    lifecycle = Lifecycle(drain_timeout=5)
+    calls = []
+
+    async def job():
+        await asyncio.sleep(0.05)
+        calls.append("task")
+
+    async def record(name):
+        calls.append(name)
+
+    lifecycle.create_task(job())
+    lifecycle.on_drain("drain", lambda: record("drain"))
+    lifecycle.on_shutdown("storage", lambda: record("storage"))
+    lifecycle.on_shutdown("database", lambda: record("database"))
+
+    await lifecycle.shutdown()
+    await lifecycle.shutdown()
+
+    assert calls == ["drain", "task", "storage", "database"]
+    assert lifecycle.closed
+
+
+async def test_drain_timeout_cancels_tasks():
+    lifecycle = Lifecycle(drain_timeout=0.05)
+    task = lifecycle.create_task(asyncio.sleep(60))
+
+    await lifecycle.shutdown()
+
+    assert task.cancelled()
+
+
+async def test_scheduler_jobs_are_drained(db):
+    lifecycle = Lifecycle(drain_timeout=5)
+    scheduler = Scheduler(db, create_task=lifecycle.create_task)
+    finished = []
+
+    async def slow_job():
+        await asyncio.sleep(0.1)
+        finished.append(True)
+
+    scheduler.register("slow", slow_job)
+    await scheduler.schedule("slow", 0)
+    scheduler.start()
+    await asyncio.sleep(0.02)
+
+    lifecycle.on_shutdown("scheduler", scheduler.stop)
+    await lifecycle.shutdown()
+
+    assert finished == [True]
+    assert await db.get_scheduled_jobs() == []
+
+
+class _Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0.01)
+        self.sent.append((chat_id, text))
+
+
+async def test_stock_alert_is_sent_on_drain_without_debounce(db):
+    category_id = await db.add_category("c")
+    product_id = await db.add_product(category_id, "Товар", "", 1.0)
+    lifecycle = Lifecycle(drain_timeout=5)
+    bot = _Bot()
+    watcher = StockWatcher(db, bot, [42], thresholds=(3,), debounce=60, create_task=lifecycle.create_task)
+    lifecycle.on_drain("stock_watcher", watcher.stop)
+
+    await watcher.handle_stock({product_id: 1})
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await lifecycle.shutdown()
+
+    assert loop.time() - started < 1
+    assert [chat_id for chat_id, _ in bot.sent] == [42]
+    assert "осталось 1 шт." in bot.sent[0][1]
+
+
+async def test_cancelled_broadcast_is_marked_interrupted(db):
+    for user_id in range(1, 6):
+        await db.add_user(user_id, None, f"user{user_id}")
+    broadcast = await db.create_broadcast("all", "hi")
+    message = broadcasts.BroadcastMessage("text", 0, 0, "hi")
+    bot = _Bot()
+
+    task = asyncio.create_task(
+        broadcasts.send_broadcast(bot, db, broadcast['broadcast_id'], message, broadcast['total'], delay=0.05)
+    )
+    await asyncio.sleep(0.1)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    result = await db.finish_broadcast(broadcast['broadcast_id'], status="interrupted")
+    assert result['status'] == "interrupted"
+    assert result['sent'] == len(bot.sent)
+    pending = await db.get_broadcast_recipients(broadcast['broadcast_id'])
+    assert len(pending) == 5 - len(bot.sent)
@@ -0,0 +1,134 @@
+"""
+Тесты платежей: тестовый провайдер, фоновая обработка и ввод суммы
+"""
+from types import SimpleNamespace
+
+import aiosqlite
+import pytest
+
+from telegramshop.config import BotConfig
+from telegramshop.handlers.profile import add_balance_amount
+from telegramshop.payments import FakePaymentProvider, PaymentStatus, PaymentWorker
+
+
+USER_ID = 1
+
+
+@pytest.fixture
+async def worker(db):
+    await db.add_user(USER_ID, "user", "User")
+    return PaymentWorker(db, FakePaymentProvider(), payment_ttl=3600)
+
+
+async def _age_payment(db, payment_id: int, seconds: int):
+    """Сдвиг времени создания платежа в прошлое"""
+    async with aiosqlite.connect(db.db_path) as conn:
+        await conn.execute(
+            "UPDATE payments SET created_at = datetime('now', ?) WHERE payment_id = ?",
+            (f"-{seconds} seconds", payment_id)
+        )
+        await conn.commit()
+
+
+async def test_fake_provider_statuses():
+    provider = FakePaymentProvider()
+    invoice = await provider.create_invoice(1, USER_ID, 100.0)
+
+    assert await provider.get_statuses([invoice.external_id, "unknown"]) == {
+        invoice.external_id: PaymentStatus.PENDING
+    }
+    await provider.mark_paid(invoice.external_id)
+    assert await provider.get_statuses([invoice.external_id]) == {invoice.external_id: PaymentStatus.COMPLETED}
+
+
+async def test_fake_provider_auto_complete():
+    provider = FakePaymentProvider(auto_complete_after=0)
+    invoice = await provider.create_invoice(1, USER_ID, 100.0)
+
+    assert await provider.get_statuses([invoice.external_id]) == {invoice.external_id: PaymentStatus.COMPLETED}
+
+
+async def test_push_notification_credits_once(db, worker):
+    payment_id, invoice = await worker.create_payment(USER_ID, 150.0)
+
+    await worker.provider.mark_paid(invoice.external_id)
+    await worker.handle_status_update(invoice.external_id, PaymentStatus.COMPLETED)
+
+    assert (await db.get_payment(payment_id))['status'] == PaymentStatus.COMPLETED
+    assert (await db.get_user(USER_ID))['balance'] == 150.0
+    assert await db.verify_balances() == []
+
+
+async def test_process_pending_polls_provider(db, worker):
+    paid_id, paid = await worker.create_payment(USER_ID, 100.0)
+    waiting_id, _ = await worker.create_payment(USER_ID, 50.0)
+    # Без подписчиков: статус узнается только опросом
+    worker.provider._invoices[paid.external_id]['status'] = PaymentStatus.COMPLETED
+
+    assert await worker.process_pending() == 1
+    assert (await db.get_payment(paid_id))['status'] == PaymentStatus.COMPLETED
+    assert (await db.get_payment(waiting_id))['status'] == PaymentStatus.PENDING
+    assert (await db.get_user(USER_ID))['balance'] == 100.0
+
+
+async def test_stale_paid_payment_is_credited(db, worker):
+    payment_id, invoice = await worker.create_payment(USER_ID, 100.0)
+    await _age_payment(db, payment_id, 7200)
+    worker.provider._invoices[invoice.external_id]['status'] = PaymentStatus.COMPLETED
+
+    await worker.process_pending()
+
+    assert (await db.get_payment(payment_id))['status'] == PaymentStatus.COMPLETED
+    assert (await db.get_user(USER_ID))['balance'] == 100.0
+
+
+async def test_stale_unpaid_payment_is_cancelled(db, worker):
+    stale_id, _ = await worker.create_payment(USER_ID, 100.0)
+    fresh_id, _ = await worker.create_payment(USER_ID, 100.0)
+    await _age_payment(db, stale_id, 7200)
+
+    await worker.process_pending()
+
+    assert (await db.get_payment(stale_id))['status'] == PaymentStatus.CANCELLED
+    assert (await db.get_payment(fresh_id))['status'] == PaymentStatus.PENDING
+    assert (await db.get_user(USER_ID))['balance'] == 0
+
+
+class _State:
+    def __init__(self):
+        self.cleared = False
+
+    async def clear(self):
+        self.cleared = True
+
+
+class _Message:
+    def __init__(self, text):
+        self.text = text
+        self.from_user = SimpleNamespace(id=USER_ID)
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+
+@pytest.mark.parametrize("text", [None, "abc", "0", "-5", "nan", "inf", "-inf", "1e308", "100001"])
+async def test_add_balance_amount_rejects_invalid(db, worker, text):
+    message, state = _Message(text), _State()
+    config = BotConfig(token="1:test", admin_ids=[], payment_max_amount=100000)
+
+    await add_balance_amount(message, state, config, worker)
+
+    assert message.answers[0].startswith("❌")
+    assert not state.cleared
+    assert await db.get_pending_payments() == []
+
+
+async def test_add_balance_amount_creates_invoice(db, worker):
+    message, state = _Message("99,5"), _State()
+
+    await add_balance_amount(message, state, BotConfig(token="1:test", admin_ids=[]), worker)
+
+    assert state.cleared
+    payments = await db.get_pending_payments()
+    assert [payment['amount'] for payment in payments] == [99.5]
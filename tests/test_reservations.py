@@ -0,0 +1,101 @@
+"""
+Тесты брони товарных позиций и покупки забронированного
+"""
+import sqlite3
+
+import pytest
+
+from telegramshop.reservations import ReservationSweeper
+
+
+STOCK = 5
+
+
+@pytest.fixture
+async def product_id(db):
+    """Товар с STOCK позициями и двумя пользователями с балансом"""
+    for user_id in (1, 2):
+        await db.add_user(user_id, f"user{user_id}", f"User {user_id}")
+        await db.update_user_balance(user_id, 1000)
+    category_id = await db.add_category("Категория")
+    product_id = await db.add_product(category_id, "Товар", "", 10.0)
+    await db.add_product_items_bulk(product_id, [f"item-{i}" for i in range(STOCK)])
+    await db.update_product_stock(product_id)
+    return product_id
+
+
+def _expire_reservations(db_path: str):
+    """Перенос всех броней в прошлое (так, как будто ttl истек)"""
+    db = sqlite3.connect(db_path)
+    try:
+        db.execute("""
+            UPDATE product_items SET reserved_until = datetime('now', '-1 minute')
+            WHERE reserved_by IS NOT NULL
+        """)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def test_reservation_holds_items(db, product_id):
+    assert await db.reserve_product_items(product_id, 1, quantity=3) == 3
+
+    assert await db.get_available_stock(product_id) == STOCK - 3
+    # Другому пользователю остаются только свободные позиции
+    assert await db.reserve_product_items(product_id, 2, quantity=3) == 0
+    assert await db.reserve_product_items(product_id, 2, quantity=2) == 2
+    assert await db.get_available_stock(product_id) == 0
+
+
+async def test_new_reservation_replaces_previous(db, product_id):
+    await db.reserve_product_items(product_id, 1, quantity=4)
+
+    assert await db.reserve_product_items(product_id, 1, quantity=2) == 2
+    assert await db.get_available_stock(product_id) == STOCK - 2
+
+    await db.release_reservation(product_id, 1)
+    assert await db.get_available_stock(product_id) == STOCK
+
+
+async def test_sweeper_releases_expired_reservations(db, product_id):
+    await db.reserve_product_items(product_id, 1, quantity=3)
+    await db.reserve_product_items(product_id, 2, quantity=2)
+    _expire_reservations(db.db_path)
+
+    released = await ReservationSweeper(db, batch_size=2).sweep()
+
+    assert released == 5
+    assert await db.get_available_stock(product_id) == STOCK
+    result = await db.complete_purchase(1, product_id)
+    assert result['status'] == 'no_reservation'
+
+
+async def test_purchase_of_several_items_is_one_order(db, product_id):
+    await db.reserve_product_items(product_id, 1, quantity=3)
+
+    result = await db.complete_purchase(1, product_id)
+
+    assert result['status'] == 'ok'
+    assert result['quantity'] == 3
+    assert result['total'] == 30.0
+    assert result['new_balance'] == 970.0
+    assert sorted(item['data'] for item in result['items']) == ["item-0", "item-1", "item-2"]
+    assert (await db.get_product(product_id))['stock_count'] == STOCK - 3
+    assert (await db.get_user(1))['balance'] == 970.0
+    orders = await db.get_user_orders(1)
+    assert [(order['quantity'], order['amount']) for order in orders] == [(3, 30.0)]
+    assert await db.verify_balances() == []
+
+
+async def test_insufficient_funds_keeps_reservation_and_balance(db, product_id):
+    await db.update_user_balance(2, -985)
+    await db.reserve_product_items(product_id, 2, quantity=2)
+
+    result = await db.complete_purchase(2, product_id)
+
+    assert result['status'] == 'insufficient_funds'
+    assert result['total'] == 20.0
+    assert (await db.get_user(2))['balance'] == 15.0
+    assert (await db.get_product(product_id))['stock_count'] == STOCK
+    assert await db.get_available_stock(product_id) == STOCK - 2
+    assert await db.get_user_orders(2) == []
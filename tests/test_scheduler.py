@@ -0,0 +1,85 @@
+"""
+Тесты планировщика: cron-расписания и порядок запуска задач
+"""
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from telegramshop.scheduler import CronSchedule, Scheduler
+
+
+@pytest.mark.parametrize("expression, moment, expected", [
+    ("*/10 * * * *", datetime(2025, 3, 1, 12, 5, 30), datetime(2025, 3, 1, 12, 10)),
+    # Строго после moment, даже если moment сам подходит
+    ("30 4 * * *", datetime(2025, 3, 1, 4, 30), datetime(2025, 3, 2, 4, 30)),
+    # Будни, рабочие часы: из пятницы вечером в понедельник утром
+    ("0,30 9-17 * * 1-5", datetime(2025, 3, 7, 17, 45), datetime(2025, 3, 10, 9, 0)),
+    # Переход через год
+    ("0 0 1 1 *", datetime(2025, 12, 31, 23, 59), datetime(2026, 1, 1, 0, 0)),
+    # 7 — тоже воскресенье
+    ("0 12 * * 7", datetime(2025, 3, 3, 0, 0), datetime(2025, 3, 9, 12, 0)),
+    # Заданы и день месяца, и день недели: достаточно любого (13-е или пятница)
+    ("0 0 13 * 5", datetime(2025, 3, 1, 0, 0), datetime(2025, 3, 7, 0, 0)),
+    ("0 0 29 2 *", datetime(2025, 3, 1, 0, 0), datetime(2028, 2, 29, 0, 0)),
+])
+def test_cron_next_after(expression, moment, expected):
+    assert CronSchedule(expression).next_after(moment) == expected
+
+
+@pytest.mark.parametrize("expression", [
+    "* * * *",
+    "60 * * * *",
+    "* 24 * * *",
+    "* * 0 * *",
+    "5-1 * * * *",
+    "*/0 * * * *",
+    "a * * * *",
+])
+def test_cron_rejects_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_cron_that_never_fires():
+    with pytest.raises(ValueError):
+        CronSchedule("0 0 31 2 *").next_after(datetime(2025, 1, 1))
+
+
+async def test_jobs_run_in_time_order(db):
+    scheduler = Scheduler(db)
+    done = []
+
+    async def job(label: str):
+        done.append(label)
+
+    scheduler.register("job", job)
+    for label, delay in [("c", 0.15), ("a", 0.05), ("d", 0.2), ("b", 0.1)]:
+        await scheduler.schedule("job", delay, label=label)
+    cancelled = await scheduler.schedule("job", 0.12, label="cancelled")
+    assert await scheduler.cancel(cancelled)
+
+    scheduler.start()
+    try:
+        for _ in range(100):
+            if len(done) == 4:
+                break
+            await asyncio.sleep(0.02)
+    finally:
+        await scheduler.stop()
+
+    assert done == ["a", "b", "c", "d"]
+    assert scheduler.stats == {'executed': 4, 'failed': 0, 'cancelled': 1}
+    assert await db.get_scheduled_jobs() == []
+
+
+async def test_pending_jobs_survive_restart(db):
+    scheduler = Scheduler(db)
+    scheduler.register("job", lambda **kwargs: asyncio.sleep(0))
+    await scheduler.schedule("job", 3600, chat_id=1)
+
+    restarted = Scheduler(db)
+    restarted.register("job", lambda **kwargs: asyncio.sleep(0))
+
+    assert await restarted.load() == 1
+    assert restarted.pending_count == 1
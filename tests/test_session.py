@@ -0,0 +1,94 @@
+"""
+Тесты сессии Bot API: повтор после 429 и таймауты по методам
+"""
+import pytest
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+
+from telegramshop.fake_bot_api import FakeBotAPI
+from telegramshop.session import RetryAfterMiddleware, TunedAiohttpSession, create_session
+
+
+async def test_retry_after_is_retried(fake_api, bot):
+    fake_api.inject_retry_after("sendMessage")
+
+    message = await bot.send_message(1, "hi")
+
+    assert message.text == "hi"
+    assert fake_api.calls["sendMessage"] == 1
+    stats = bot.session.stats
+    assert stats.retries == 1
+    assert stats.by_method["sendMessage"] == 2
+    assert stats.errors == 1
+
+
+async def test_retry_after_only_for_limited_method(fake_api, bot):
+    fake_api.inject_retry_after("answerCallbackQuery")
+
+    await bot.send_message(1, "hi")
+
+    assert bot.session.stats.retries == 0
+    assert fake_api._injected == ["answerCallbackQuery"]
+
+
+async def test_retries_exhausted(fake_api):
+    bot = Bot("1:test", session=create_session(api_url=fake_api.url, retry_max=1))
+    fake_api.inject_retry_after("sendMessage", count=2)
+    try:
+        with pytest.raises(TelegramRetryAfter):
+            await bot.send_message(1, "hi")
+    finally:
+        await bot.session.close()
+
+    assert bot.session.stats.retries == 1
+    assert bot.session.stats.by_method["sendMessage"] == 2
+    assert fake_api.calls["sendMessage"] == 0
+
+
+async def test_retry_after_longer_than_max_delay_is_raised(fake_api):
+    session = TunedAiohttpSession(api_url=fake_api.url)
+    session.middleware(RetryAfterMiddleware(max_retries=3, max_delay=0.5, stats=session.stats))
+    bot = Bot("1:test", session=session)
+    fake_api.inject_retry_after("sendMessage")
+    try:
+        with pytest.raises(TelegramRetryAfter):
+            await bot.send_message(1, "hi")
+    finally:
+        await bot.session.close()
+
+    assert session.stats.retries == 0
+    assert session.stats.by_method["sendMessage"] == 1
+
+
+@pytest.fixture
+async def slow_api():
+    api = FakeBotAPI(latency=0.3)
+    await api.start()
+    yield api
+    await api.stop()
+
+
+async def test_method_timeout(slow_api):
+    session = TunedAiohttpSession(api_url=slow_api.url, method_timeouts={"sendMessage": 0.1}, timeout=5)
+    bot = Bot("1:test", session=session)
+    try:
+        with pytest.raises(TelegramNetworkError, match="timeout"):
+            await bot.send_message(1, "hi")
+        # Метод без своего таймаута использует общий таймаут сессии
+        me = await bot.get_me()
+        # Явный таймаут запроса важнее таблицы
+        message = await bot.send_message(1, "hi", request_timeout=5)
+    finally:
+        await bot.session.close()
+
+    assert me.id
+    assert message.text == "hi"
+    assert session.stats.errors == 1
+    assert session.stats.by_method == {"sendMessage": 2, "getMe": 1}
+
+
+def test_method_timeouts_override_defaults():
+    session = TunedAiohttpSession(method_timeouts={"sendMessage": 3})
+
+    assert session.method_timeouts["sendMessage"] == 3
+    assert session.method_timeouts["sendDocument"] == 120
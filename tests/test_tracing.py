@@ -0,0 +1,62 @@
+"""
+Тесты выгрузки медленных трасс
+"""
+import json
+import threading
+import time
+
+from telegramshop import tracing
+from telegramshop.tracing import Tracer
+
+
+def _slow_trace(tracer: Tracer):
+    with tracer.start_trace("update", kind="SERVER", update_id=1):
+        with tracing.child_span("db.get_user"):
+            time.sleep(0.002)
+
+
+def test_slow_trace_is_written_by_listener_thread(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    writers = []
+    emit = tracing._TraceFileHandler.emit
+
+    def record_thread(self, record):
+        writers.append(threading.current_thread())
+        emit(self, record)
+
+    monkeypatch.setattr(tracing._TraceFileHandler, "emit", record_thread)
+    tracer = Tracer()
+    tracer.configure(True, slow_threshold_ms=1, path=str(path))
+
+    _slow_trace(tracer)
+    tracer.stop()
+
+    assert writers and threading.current_thread() not in writers
+    assert tracer.stats == {'traces': 1, 'exported': 1}
+    spans = json.loads(path.read_text(encoding="utf-8"))
+    root, child = sorted(spans, key=lambda span: "parentId" in span)
+    assert root["name"] == "update" and root["tags"] == {"update_id": "1"}
+    assert child["name"] == "db.get_user" and child["parentId"] == root["id"]
+
+
+def test_fast_trace_is_not_exported(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer()
+    tracer.configure(True, slow_threshold_ms=10_000, path=str(path))
+
+    _slow_trace(tracer)
+    tracer.stop()
+
+    assert tracer.stats == {'traces': 1, 'exported': 0}
+    assert not path.exists()
+
+
+def test_write_error_is_logged(tmp_path, caplog):
+    tracer = Tracer()
+    tracer.configure(True, slow_threshold_ms=1, path=str(tmp_path))
+
+    _slow_trace(tracer)
+    tracer.stop()
+
+    assert tracer.stats['exported'] == 0
+    assert "Не удалось записать трассу" in caplog.text